@@ -16,42 +16,18 @@ def create_extract_directory(file_path):
     return new_dir_name
 
 
-import re
-
-import fitz  # PyMuPDF
-import io
-from PIL import Image
+# NOTE: the application reads the PDF directly now (drop the .pdf), this is only to get the images files
+from henskan.source import list_archive_images, open_source, split_member_path
 
 
 def extract_jpg_from_pdf(pdf_path, output_folder):
-    # Open the PDF file
-    pdf_document = fitz.open(pdf_path)
-    
-    # Iterate through the pages
-    for page_number in range(len(pdf_document)):
-        page = pdf_document[page_number]
-        image_list = page.get_images(full=True)
-        
-        # Print the number of images found in this page
-        print(f"[INFO] Found {len(image_list)} images on page {page_number + 1}")
-        
-        # Iterate through the images
-        for img_index, img in enumerate(image_list):
-            # Extract the image bytes
-            xref = img[0]
-            base_image = pdf_document.extract_image(xref)
-            image_bytes = base_image["image"]
-            image_ext = base_image["ext"]
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            print(f"[INFO] Extracted image {img_index + 1} with extension: {image_ext}")
-            
-            # Only save if the image is in JPG format
-            if image_ext == "jpeg":
-                image_name = f"page_{page_number + 1}_img_{img_index + 1}.jpg"
-                image_path = f"{output_folder}/{image_name}"
-                image.save(image_path)
-                print(f"[INFO] Saved image: {image_path}")
+    # All the images, in the pages order, written as they are in the PDF (no decode/re-encode)
+    for member_path in list_archive_images(pdf_path):
+        image_name = split_member_path(member_path)[1]
+        image_path = f"{output_folder}/{image_name}"
+        with open_source(member_path) as source, open(image_path, 'wb') as f:
+            f.write(source.read())
+        print(f"[INFO] Saved image: {image_path}")
 
 
 def main():
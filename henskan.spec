@@ -5,7 +5,7 @@ a = Analysis(
     ['main.py'],
     pathex=[],
     binaries=[],
-    datas=[('henskan/ui', 'henskan/ui'), ('henskan/img', 'henskan/img')],
+    datas=[('henskan/ui', 'henskan/ui'), ('henskan/img', 'henskan/img'), ('henskan/profiles.json', 'henskan')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
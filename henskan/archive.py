@@ -31,11 +31,25 @@ class Archive(ABC):
         pass
     
     
+    # Add an already encoded page (png, jpeg...) without any temporary file. Pages are numbered
+    # from 0 in reading order, arcname is the name the page should have inside the archive
+    @abstractmethod
+    def add_page(self, page_number, arcname, data):
+        pass
+    
+    
     @abstractmethod
     def add_chapter(self, title):
         pass
     
     
+    # progress_callback(done, total) let the caller display the finalization, that can be long on big books
+    @abstractmethod
+    def close(self, progress_callback=None):
+        pass
+    
+    
+    # The conversion was cancelled (or did fail): stop writing and remove the unfinished file
     @abstractmethod
-    def close(self):
+    def abort(self):
         pass
@@ -16,34 +16,296 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import bisect
+import os
 import os.path
+import threading
 import time
-from zipfile import ZipFile, ZIP_STORED
+import xml.etree.ElementTree as ElementTree
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
 
 from henskan.archive import Archive
+from henskan.log import get_logger
+from henskan.zip_writer import ZipWriter, LOCAL_HEADER, LOCAL_HEADER_SIGNATURE
 
+logger = get_logger(__name__)
 
+# Max number of pages that can wait in RAM for the writer thread. Producers that are too much
+# in advance are blocked until the writer catch up, so memory is bounded whatever the page count
+DEFAULT_PENDING_WINDOW = 32
+
+COMIC_INFO_NAME = 'ComicInfo.xml'
+
+# zlib is releasing the GIL while compressing, so threads are enough to deflate the pages in parallel. It's the
+# default when the archive is written alone (transcode, merge), the conversion service gives what its processes
+# are leaving
+DEFAULT_DEFLATE_THREADS = max(1, (os.cpu_count() or 1) - 1)
+
+
+# => (crc, data to write, compress type, uncompressed size). Pages that deflate does not make smaller (JPEG,
+# PNG level 9...) are stored as they are, so the readers do not pay for a useless inflate
+def _deflate_page(data, compress_level):
+    # type: (bytes, int) -> tuple[int, bytes, int, int]
+    crc = zlib.crc32(data)
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -15)  # raw deflate, as in the zip entries
+    compressed = compressor.compress(data) + compressor.flush()
+    if len(compressed) >= len(data):
+        return crc, data, ZIP_STORED, len(data)
+    return crc, compressed, ZIP_DEFLATED, len(data)
+
+
+# (title, [(image index, bookmark title)]) of the ComicInfo.xml of the archive, empty if it has none
+def read_comic_info(zip_file):
+    # type: (ZipFile) -> tuple[str, list[tuple[int, str]]]
+    if COMIC_INFO_NAME not in zip_file.namelist():
+        return '', []
+    try:
+        root = ElementTree.fromstring(zip_file.read(COMIC_INFO_NAME))
+    except ElementTree.ParseError as exp:
+        logger.warning('Bad %s in %s, it is skipped: %s', COMIC_INFO_NAME, zip_file.filename, exp)
+        return '', []
+    bookmarks = []
+    for page in root.iterfind('Pages/Page'):
+        image_index, title = page.get('Image'), page.get('Bookmark')
+        if title and image_index is not None and image_index.isdigit():
+            bookmarks.append((int(image_index), title))
+    return root.findtext('Title', ''), bookmarks
+
+
+# The member data as it is in the zip file (still compressed), to copy it in another zip without inflate/deflate
+def read_raw_member(zip_file, zinfo):
+    # type: (ZipFile, ZipInfo) -> bytes
+    if zinfo.flag_bits & 0x1:
+        raise RuntimeError(f'Cannot copy {zinfo.filename} from {zip_file.filename}: it is encrypted')
+    try:
+        with open(zip_file.filename, 'rb') as f:
+            f.seek(zinfo.header_offset)
+            header = f.read(LOCAL_HEADER.size)
+            if len(header) != LOCAL_HEADER.size or header[:4] != LOCAL_HEADER_SIGNATURE:
+                raise RuntimeError(f'Cannot copy {zinfo.filename} from {zip_file.filename}: bad local header')
+            fields = LOCAL_HEADER.unpack(header)
+            name_length, extra_length = fields[-2], fields[-1]
+            f.seek(name_length + extra_length, os.SEEK_CUR)
+            raw_data = f.read(zinfo.compress_size)
+    except OSError as exp:
+        raise RuntimeError(f'Cannot read {zinfo.filename} from {zip_file.filename}: {exp}')
+    if len(raw_data) != zinfo.compress_size:
+        raise RuntimeError(f'Cannot copy {zinfo.filename} from {zip_file.filename}: the file is truncated')
+    return raw_data
+
+
+# deflate_level: None for stored pages (the default, pages are already compressed images), or the zlib level of
+# the pages, they are then deflated by a pool of threads before the writer thread
 class ArchiveCBZ(Archive):
-    def __init__(self, path):
-        # type: (str) -> None
+    def __init__(self, path, title='', pending_window=DEFAULT_PENDING_WINDOW, comic_info=True, deflate_level=None,
+                 nb_deflate_threads=DEFAULT_DEFLATE_THREADS):
+        # type: (str, str, int, bool, int|None, int) -> None
+        if deflate_level is not None and not 1 <= deflate_level <= 9:
+            raise ValueError(f'deflate level must be between 1 and 9, not {deflate_level}')
         output_directory = os.path.dirname(path)
         output_file_name = '%s.cbz' % os.path.basename(path)
         self._output_path = os.path.join(output_directory, output_file_name)
-        self._zipfile = ZipFile(self._output_path, 'w', ZIP_STORED)
-        print(f"[CBZ] file: {self._output_path} open for writing")
+        self._zip_writer = ZipWriter(self._output_path)  # the pages can be given already compressed
+        
+        self._title = title
+        self._with_comic_info = comic_info
+        self._pending_window = max(1, pending_window)
+        self._deflate_level = deflate_level
+        self._deflate_executor = None  # type: ThreadPoolExecutor|None
+        if deflate_level is not None:
+            self._deflate_executor = ThreadPoolExecutor(max_workers=max(1, nb_deflate_threads), thread_name_prefix='cbz-deflate')
+        
+        # All theses are protected by the condition, as producers and writer thread are sharing them
+        self._condition = threading.Condition()
+        self._pending_pages = {}  # page_number -> (arcname, data, future of the _deflate_page result, or None)
+        self._next_page_to_write = 0
+        self._nb_pages_submitted = 0
+        self._written_page_numbers = []  # sorted, so we can find bookmarks positions even if a page is missing
+        self._bookmarks = []  # (page_number, title)
+        self._is_closing = False
+        self._writer_error = None
+        self._is_writer_done = False
+        
+        self._writer_thread = threading.Thread(target=self._writer_loop, name='cbz-writer', daemon=True)
+        self._writer_thread.start()
+        logger.debug('[CBZ] file: %s open for writing', self._output_path)
     
     
     def add(self, filename):
         # type: (str) -> None
         arcname = os.path.basename(filename)
-        self._zipfile.write(filename, arcname)
+        with open(filename, 'rb') as f:
+            data = f.read()
+        self._add_pending_page(None, arcname, data, None)  # the next page number, reserved with the lock
+    
+    
+    # Can be called from several threads, pages will be written in the page_number order whatever
+    # the order they are given
+    def add_page(self, page_number, arcname, data):
+        # type: (int, str, bytes) -> None
+        self._add_pending_page(page_number, arcname, data, None)
+    
+    
+    # A page compressed in another zip (zinfo and read_raw_member data of it): it is copied as it is
+    def add_raw_page(self, page_number, arcname, zinfo, raw_data):
+        # type: (int, str, ZipInfo, bytes) -> None
+        prepared = Future()
+        prepared.set_result((zinfo.CRC, raw_data, zinfo.compress_type, zinfo.file_size))
+        self._add_pending_page(page_number, arcname, None, prepared)
     
-    # Not managed for CBZ
-    def add_chapter(self, title):
-        # type: (str) -> None
-        pass
     
-    def close(self):
+    # page_number None: the page after the last submitted one
+    def _add_pending_page(self, page_number, arcname, data, prepared):
+        # type: (int|None, str, bytes|None, Future|None) -> None
+        with self._condition:
+            if page_number is None:
+                page_number = self._nb_pages_submitted
+                self._nb_pages_submitted += 1  # reserved now, so another add() cannot take it while we wait
+            # Too much in advance: wait for the writer to catch up (or for a close/abort, if a page is missing)
+            while page_number >= self._next_page_to_write + self._pending_window and self._writer_error is None and not self._is_closing:
+                self._condition.wait()
+            self._raise_writer_error()
+            if self._is_closing:
+                raise RuntimeError(f'Cannot add page {page_number} to {self._output_path}: archive is closed')
+            if page_number < self._next_page_to_write or page_number in self._pending_pages:
+                raise ValueError(f'Page {page_number} was already added to {self._output_path}')
+            # the page is deflated while the writer is busy with the previous ones
+            if prepared is None and self._deflate_executor is not None:
+                prepared = self._deflate_executor.submit(_deflate_page, data, self._deflate_level)
+            self._pending_pages[page_number] = (arcname, data, prepared)
+            self._nb_pages_submitted = max(self._nb_pages_submitted, page_number + 1)
+            self._condition.notify_all()
+    
+    
+    # The chapter will be bookmarked in the ComicInfo.xml, on the page_number page, or by default
+    # on the next page to come
+    def add_chapter(self, title, page_number=None):
+        # type: (str, int|None) -> None
+        with self._condition:
+            if page_number is None:
+                page_number = self._nb_pages_submitted
+            self._bookmarks.append((page_number, title))
+    
+    
+    def _raise_writer_error(self):
+        if self._writer_error is not None:
+            raise RuntimeError(f'Cannot write into {self._output_path}: {self._writer_error}')
+    
+    
+    def _writer_loop(self):
+        while True:
+            with self._condition:
+                while self._next_page_to_write not in self._pending_pages and not self._is_closing:
+                    self._condition.wait()
+                if self._next_page_to_write not in self._pending_pages:
+                    if not self._pending_pages:  # closing and all was written
+                        self._is_writer_done = True
+                        self._condition.notify_all()
+                        return
+                    # closing with a missing page (a producer did fail), do not stay stuck on the hole
+                    self._next_page_to_write = min(self._pending_pages)
+                page_number = self._next_page_to_write
+                arcname, data, prepared = self._pending_pages.pop(page_number)
+            
+            try:
+                self._write_entry(arcname, data, prepared)
+            except Exception as exp:
+                with self._condition:
+                    self._writer_error = exp
+                    self._is_writer_done = True
+                    self._condition.notify_all()
+                return
+            
+            with self._condition:
+                self._written_page_numbers.append(page_number)
+                self._next_page_to_write = page_number + 1
+                self._condition.notify_all()
+    
+    
+    def _write_entry(self, arcname, data, prepared=None):
+        # type: (str, bytes|None, Future|None) -> None
+        if prepared is not None:  # deflated by the threads, or a raw copy
+            crc, entry_data, compress_type, file_size = prepared.result()
+        elif self._deflate_level is None:
+            crc, entry_data, compress_type, file_size = zlib.crc32(data), data, ZIP_STORED, len(data)
+        else:  # not a page (ComicInfo.xml): small, deflated here
+            crc, entry_data, compress_type, file_size = _deflate_page(data, self._deflate_level)
+        self._zip_writer.write_entry(arcname, crc, entry_data, compress_type=compress_type, file_size=file_size)
+    
+    
+    def _get_comic_info(self):
+        # type: () -> bytes
+        root = ElementTree.Element('ComicInfo', {'xmlns:xsi': 'http://www.w3.org/2001/XMLSchema-instance',
+                                                 'xmlns:xsd': 'http://www.w3.org/2001/XMLSchema'})
+        if self._title:
+            ElementTree.SubElement(root, 'Title').text = self._title
+        ElementTree.SubElement(root, 'PageCount').text = str(len(self._written_page_numbers))
+        
+        # ComicInfo pages are indexed by their position in the archive, not by our page numbers
+        bookmark_by_image = {}
+        for page_number, title in self._bookmarks:
+            image_index = bisect.bisect_left(self._written_page_numbers, page_number)
+            if image_index >= len(self._written_page_numbers):  # empty chapter at the end
+                continue
+            if image_index in bookmark_by_image:  # empty chapter, the next one is taking the page
+                logger.debug('[CBZ] chapter %s is empty, replaced by %s', bookmark_by_image[image_index], title)
+            bookmark_by_image[image_index] = title
+        if bookmark_by_image:
+            pages = ElementTree.SubElement(root, 'Pages')
+            for image_index in sorted(bookmark_by_image):
+                ElementTree.SubElement(pages, 'Page', {'Image': str(image_index), 'Bookmark': bookmark_by_image[image_index]})
+        
+        ElementTree.indent(root)
+        return ElementTree.tostring(root, encoding='utf-8', xml_declaration=True)
+    
+    
+    def close(self, progress_callback=None):
         t0 = time.time()
-        self._zipfile.close()
-        print(f"[CBZ] file: {self._output_path} generation time: {time.time() - t0:.3f}s")
+        with self._condition:
+            self._is_closing = True
+            self._condition.notify_all()
+        # Let the caller know how the writer is doing with the remaining pages. The callback goes to the UI, so
+        # it is called without our lock (the writer must not wait for the UI)
+        while True:
+            with self._condition:
+                if self._is_writer_done:
+                    break
+                done, total = len(self._written_page_numbers), self._nb_pages_submitted
+            if progress_callback is not None:
+                progress_callback(done, total)
+            with self._condition:
+                if not self._is_writer_done:
+                    self._condition.wait(0.5)
+        self._writer_thread.join()
+        try:
+            self._raise_writer_error()
+            if self._with_comic_info:
+                self._write_entry(COMIC_INFO_NAME, self._get_comic_info())
+        finally:
+            self._zip_writer.close()
+            self._shutdown_deflate()
+        logger.info('[CBZ] file: %s generation time: %.3fs', self._output_path, time.time() - t0)
+    
+    
+    def _shutdown_deflate(self):
+        if self._deflate_executor is not None:
+            self._deflate_executor.shutdown(wait=True, cancel_futures=True)
+            self._deflate_executor = None
+    
+    
+    def abort(self):
+        with self._condition:
+            self._pending_pages.clear()  # no need to write them
+            self._is_closing = True
+            self._condition.notify_all()
+        self._writer_thread.join()
+        self._zip_writer.abort()
+        self._shutdown_deflate()
+        try:
+            os.remove(self._output_path)
+        except OSError as exp:
+            logger.warning('[CBZ] cannot remove the unfinished file %s: %s', self._output_path, exp)
+            return
+        logger.info('[CBZ] file: %s aborted and removed', self._output_path)
@@ -18,12 +18,13 @@
 
 import os.path
 import time
-from uuid import uuid4
-
-from reportlab.pdfgen import canvas
 
 from .archive import Archive
 from .image import EReaderData
+from .log import get_logger
+from .pdf_writer import PDFWriter
+
+logger = get_logger(__name__)
 
 
 class ArchivePDF(Archive):
@@ -32,34 +33,42 @@ class ArchivePDF(Archive):
         output_directory = os.path.dirname(path)
         output_file_name = '%s.pdf' % os.path.basename(path)
         self._output_path = os.path.join(output_directory, output_file_name)
-        # self._current_device = device
-        # self.bookTitle = title
-        self._page_size = EReaderData.Profiles[device][0]
-        # pagesize could be letter or A4 for standardization, but we need to control some image sizes
-        self._canvas = canvas.Canvas(self._output_path, pagesize=self._page_size)
-        self._canvas.setAuthor("Henskan")
-        self._canvas.setTitle(title)
-        self._canvas.setSubject("Created by Henskan for " + device)
+        # pages are already at the e-reader size, so the pdf page is the same size
+        self._page_size = EReaderData.get_size(device)
+        self._writer = PDFWriter(self._output_path, self._page_size, title=title, author='Henskan', subject='Created by Henskan for ' + device)
         
-        print(f'[PDF] file: {self._output_path} open for writing')
+        logger.debug('[PDF] file: %s open for writing', self._output_path)
     
     
     def add(self, filename):
         # type: (str) -> None
-        self._canvas.drawImage(filename, 0, 0, width=self._page_size[0], height=self._page_size[1], preserveAspectRatio=True, anchor='c')
-        self._canvas.showPage()  # close page
+        with open(filename, 'rb') as f:
+            data = f.read()
+        self._writer.add_page(data)
+    
     
+    # NOTE: pdf pages are directly written to the file, so pages must be given in order
+    def add_page(self, page_number, arcname, data):
+        # type: (int, str, bytes) -> None
+        nb_pages = self._writer.get_nb_pages()
+        if page_number != nb_pages:
+            raise ValueError(f'PDF pages must be added in order: got page {page_number} but expected {nb_pages}')
+        self._writer.add_page(data)
     
-    # create a chapter in the reportlab pdf, so it can be added to the table of contents
-    # NOTE: key in pdf must be unique, so using a uuid4, duplicated title are not a problem
+    
+    # create a chapter in the pdf table of contents, it will point to the next page
+    # NOTE: duplicated title are not a problem
     def add_chapter(self, title):
         # type: (str) -> None
-        key = uuid4().hex  # so it's unique
-        self._canvas.bookmarkPage(key)
-        self._canvas.addOutlineEntry(title, key, 0, 0)
+        self._writer.add_outline(title)
     
     
-    def close(self):
+    def close(self, progress_callback=None):
         t0 = time.time()
-        self._canvas.save()
-        print(f"[PDF] file: {self._output_path} generation time: {time.time() - t0:.3f}s")
+        self._writer.close(progress_callback=progress_callback)
+        logger.info('[PDF] file: %s generation time: %.3fs', self._output_path, time.time() - t0)
+    
+    
+    def abort(self):
+        self._writer.abort()
+        logger.info('[PDF] file: %s aborted and removed', self._output_path)
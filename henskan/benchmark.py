@@ -0,0 +1,459 @@
+# Copyright 2020+     Gabès Jean (naparuba@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmark of the image pipeline, on synthetic images so it's the same for everyone and for every commit:
+#   python -m henskan.benchmark --output bench.json
+#   python -m henskan.benchmark --compare bench.json   (exit 1 if a case is slower than the threshold)
+# And the page encoders on your own pages (a directory, a CBZ or a PDF):
+#   python -m henskan.benchmark --encoders ~/manga/tome1.cbz --device 'Kobo Libra H2O'
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+
+from . import image as henskan_image
+from .encoders import get_encoder
+from .image import EReaderData
+from .log import set_batch_mode
+from .parameters import parameters, ConversionSettings
+from .source import is_archive_file, is_image_file, list_archive_images
+from .util import natural_key, spread_sample
+
+try:
+    import resource  # not on Windows
+except ImportError:
+    resource = None
+
+DEFAULT_NB_PAGES = 2
+DEFAULT_REPEAT = 1
+DEFAULT_REGRESSION_THRESHOLD = 0.10  # 10% slower is a regression
+
+# Stages are always benched on this profile, the full conversion on all profiles
+STAGE_PROFILE = 'Kobo Libra H2O'
+
+SAMPLE_KINDS = ('manga_double', 'colour', 'webtoon_black', 'webtoon_slanted')
+
+# The rgb stage has nothing to do on RGB images, so it's timed on the other modes the sources can have
+RGB_STAGE_INPUT_MODES = ('P', 'CMYK')
+
+# Pages taken from the user sources for the encoders benchmark, spread over all the sources
+DEFAULT_NB_ENCODER_PAGES = 20
+
+# Encoders (and their profile options) compared by the encoders benchmark
+ENCODER_CANDIDATES = (
+    ('png', {}),
+    ('png', {'compress_level': 9}),
+    ('png', {'strategy': 'rle'}),
+    ('jpeg', {'quality': 90}),
+    ('jpeg', {'quality': 90, 'progressive': True}),
+    ('jpeg', {'quality': 75}),
+    ('webp', {'lossless': True}),
+)
+
+
+def _get_peak_rss_mb():
+    # type: () -> float|None
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  # bytes on mac, KB on linux
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def _get_git_commit():
+    # type: () -> str
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def _draw_screentone(draw, box, rnd):
+    x0, y0, x1, y1 = box
+    step = rnd.choice((4, 6, 8))
+    for y in range(y0, y1, step):
+        for x in range(x0 + (y // step % 2) * step // 2, x1, step):
+            draw.ellipse((x, y, x + step // 2, y + step // 2), fill=(90, 90, 90))
+
+
+def _draw_panel_content(draw, box, rnd, colored):
+    x0, y0, x1, y1 = box
+    for _ in range(12):
+        cx, cy = rnd.randint(x0, x1), rnd.randint(y0, y1)
+        radius = rnd.randint(10, max(11, (x1 - x0) // 5))
+        if colored:
+            color = (rnd.randint(0, 255), rnd.randint(0, 255), rnd.randint(0, 255))
+        else:
+            grey = rnd.randint(0, 200)
+            color = (grey, grey, grey)
+        draw.ellipse((cx - radius, cy - radius, cx + radius, cy + radius), outline=(0, 0, 0), width=3, fill=color)
+    # some speech bubble text
+    for line in range(3):
+        ty = y0 + 20 + line * 18
+        draw.line((x0 + 20, ty, x0 + 20 + rnd.randint(40, 160), ty), fill=(0, 0, 0), width=6)
+
+
+# Scan of 2 manga pages side by side, with white borders and page numbers
+def generate_manga_double(rnd):
+    # type: (random.Random) -> Image
+    width, height = 2400, 1700
+    image = Image.new('RGB', (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for page in range(2):
+        page_x0 = page * width // 2
+        margin = 80
+        panel_height = (height - 2 * margin) // 3
+        for row in range(3):
+            y0 = margin + row * panel_height
+            box = (page_x0 + margin, y0 + 10, page_x0 + width // 2 - margin, y0 + panel_height - 10)
+            draw.rectangle(box, outline=(0, 0, 0), width=4)
+            inner = (box[0] + 6, box[1] + 6, box[2] - 6, box[3] - 6)
+            if rnd.random() < 0.5:
+                _draw_screentone(draw, (inner[0], inner[1], inner[0] + (inner[2] - inner[0]) // 3, inner[3]), rnd)
+            _draw_panel_content(draw, inner, rnd, colored=False)
+        # page number
+        draw.text((page_x0 + width // 4, height - 50), str(rnd.randint(1, 200)), fill=(0, 0, 0))
+    return image
+
+
+def generate_colour(rnd):
+    # type: (random.Random) -> Image
+    width, height = 1200, 1700
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    tint = Image.new('RGB', (width, height), (rnd.randint(0, 255), rnd.randint(0, 255), rnd.randint(0, 255)))
+    image = Image.blend(image, tint, 0.5)
+    draw = ImageDraw.Draw(image)
+    _draw_panel_content(draw, (50, 50, width - 50, height - 50), rnd, colored=True)
+    return image
+
+
+def _generate_webtoon(rnd, background, slanted):
+    # type: (random.Random, tuple[int, int, int], bool) -> Image
+    width, height = 800, 6000
+    image = Image.new('RGB', (width, height), background)
+    draw = ImageDraw.Draw(image)
+    y = 150
+    while y < height - 900:
+        panel_height = rnd.randint(500, 900)
+        slant = rnd.randint(40, 120) if slanted else 0
+        polygon = [(40, y + slant), (width - 40, y), (width - 40, y + panel_height), (40, y + panel_height + slant)]
+        draw.polygon(polygon, fill=(230, 230, 230), outline=(20, 20, 20))
+        _draw_panel_content(draw, (60, y + slant + 20, width - 60, y + panel_height - 20), rnd, colored=True)
+        y += panel_height + slant + rnd.randint(120, 300)
+    return image
+
+
+def generate_webtoon_black(rnd):
+    # type: (random.Random) -> Image
+    return _generate_webtoon(rnd, (0, 0, 0), slanted=False)
+
+
+def generate_webtoon_slanted(rnd):
+    # type: (random.Random) -> Image
+    return _generate_webtoon(rnd, (255, 255, 255), slanted=True)
+
+
+GENERATORS = {
+    'manga_double':    generate_manga_double,
+    'colour':          generate_colour,
+    'webtoon_black':   generate_webtoon_black,
+    'webtoon_slanted': generate_webtoon_slanted,
+}
+
+
+def generate_samples(directory, nb_pages, seed=42):
+    # type: (str, int, int) -> dict[str, list[str]]
+    samples = {}
+    for kind in SAMPLE_KINDS:
+        rnd = random.Random(f'{seed}-{kind}')  # same images whatever the kinds asked
+        samples[kind] = []
+        for idx in range(nb_pages):
+            path = os.path.join(directory, f'{kind}_{idx:03d}.jpg')
+            GENERATORS[kind](rnd).save(path, quality=90)
+            samples[kind].append(path)
+    return samples
+
+
+class _Case(object):
+    def __init__(self, name):
+        # type: (str) -> None
+        self.name = name
+        self.best_time = None
+        self.nb_pages = 0
+        self.mpix = 0.0
+    
+    
+    def add_run(self, elapsed, nb_pages, mpix):
+        # type: (float, int, float) -> None
+        # keep the best of the repeats, it's the less noisy one
+        if self.best_time is None or elapsed < self.best_time:
+            self.best_time = elapsed
+            self.nb_pages = nb_pages
+            self.mpix = mpix
+    
+    
+    def to_dict(self):
+        # type: () -> dict
+        elapsed = max(self.best_time or 0.0, 1e-9)
+        return {
+            'time':          round(elapsed, 6),
+            'pages':         self.nb_pages,
+            'pages_per_sec': round(self.nb_pages / elapsed, 3),
+            'mpix_per_sec':  round(self.mpix / elapsed, 3),
+        }
+
+
+def _get_stages(size, palette):
+    # type: (tuple[int, int], list) -> list[tuple[str, callable]]
+    return [
+        ('split', henskan_image._split_left),
+        ('crop', henskan_image._auto_crop_image),
+        ('orient', lambda image: henskan_image._orient_image(image, size)),
+        ('grey-detect', henskan_image._is_image_grey),
+        ('quantize-palette', lambda image: henskan_image._apply_grey_palette(image, palette)),
+        ('quantize-basic', henskan_image._apply_basic_grey),
+        ('resize', lambda image: henskan_image._resize_image(image, size)),
+        ('fill', lambda image: henskan_image._fill_image_to_whole_size(henskan_image._resize_image(image, size), size)),
+        ('encode', henskan_image.encode_image),
+    ]
+
+
+def _bench_stages(samples, repeat):
+    # type: (dict[str, list[str]], int) -> dict[str, _Case]
+    cases = {}
+    size = EReaderData.get_size(STAGE_PROFILE)
+    palette = EReaderData.get_palette(STAGE_PROFILE)
+    for kind in ('manga_double', 'colour'):
+        images = [Image.open(path).convert('RGB') for path in samples[kind]]
+        stages = [(f'rgb-from-{mode.lower()}', henskan_image._format_image_mode, [image.convert(mode) for image in images])
+                  for mode in RGB_STAGE_INPUT_MODES]
+        stages += [(stage_name, stage, images) for (stage_name, stage) in _get_stages(size, palette)]
+        for stage_name, stage, stage_images in stages:
+            case = cases.setdefault(f'stage/{stage_name}/{kind}', _Case(f'stage/{stage_name}/{kind}'))
+            for _ in range(repeat):
+                mpix = 0.0
+                before = time.perf_counter()
+                for image in stage_images:
+                    stage(image)
+                    mpix += image.size[0] * image.size[1] / 1e6
+                case.add_run(time.perf_counter() - before, len(stage_images), mpix)
+    return cases
+
+
+def _bench_convert(samples, devices, repeat):
+    # type: (dict[str, list[str]], list[str], int) -> dict[str, _Case]
+    cases = {}
+    for device in devices:
+        parameters.set_device(device, 0)
+        for kind in SAMPLE_KINDS:
+            parameters.set_is_webtoon(kind.startswith('webtoon'))
+            name = f'convert/{device}/{kind}'
+            case = cases.setdefault(name, _Case(name))
+            for _ in range(repeat):
+                nb_pages = 0
+                mpix = 0.0
+                before = time.perf_counter()
+                for path in samples[kind]:
+                    split_left = kind == 'manga_double'
+                    pages = henskan_image.convert_image(path, split_left=split_left)
+                    for page in pages:
+                        henskan_image.encode_image(page)
+                    nb_pages += len(pages)
+                    with Image.open(path) as source:
+                        mpix += source.size[0] * source.size[1] / 1e6
+                case.add_run(time.perf_counter() - before, nb_pages, mpix)
+    parameters.set_is_webtoon(False)
+    return cases
+
+
+def run_benchmark(nb_pages=DEFAULT_NB_PAGES, repeat=DEFAULT_REPEAT, devices=None, with_stages=True, reduced_decode=True):
+    # type: (int, int, list[str]|None, bool, bool) -> dict
+    if devices is None:
+        devices = EReaderData.get_devices()
+    parameters.set_reduced_decode(reduced_decode)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        samples = generate_samples(tmp_dir, nb_pages)
+        cases = {}
+        if with_stages:
+            cases.update(_bench_stages(samples, repeat))
+        cases.update(_bench_convert(samples, devices, repeat))
+    return {
+        'commit':         _get_git_commit(),
+        'date':           time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python':         platform.python_version(),
+        'pillow':         Image.__version__,
+        'machine':        platform.machine(),
+        'nb_pages':       nb_pages,
+        'repeat':         repeat,
+        'reduced_decode': reduced_decode,
+        'peak_rss_mb':    _get_peak_rss_mb(),  # of the whole run: the memory is not given back between the cases
+        'cases':          {name: case.to_dict() for (name, case) in cases.items()},
+    }
+
+
+# Compare on the throughput, as the number of pages for webtoons can change between commits
+def compare_results(previous, current, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    # type: (dict, dict, float) -> list[str]
+    regressions = []
+    for name, case in sorted(current['cases'].items()):
+        previous_case = previous['cases'].get(name)
+        if previous_case is None:
+            print(f'{name:<60} NEW')
+            continue
+        ratio = case['mpix_per_sec'] / max(previous_case['mpix_per_sec'], 1e-9)
+        flag = ''
+        if ratio < 1.0 - threshold:
+            flag = '  <== REGRESSION'
+            regressions.append(name)
+        print(f'{name:<60} {previous_case["mpix_per_sec"]:>9.2f} -> {case["mpix_per_sec"]:>9.2f} MPix/s  ({ratio:>5.2f}x){flag}')
+    return regressions
+
+
+# A directory (with its sub-directories), an archive/PDF or an image => nb_pages sources, spread over all of them
+def get_sample_sources(path, nb_pages):
+    # type: (str, int) -> list[str]
+    if os.path.isdir(path):
+        sources = []
+        for root, _, file_names in os.walk(path):
+            for file_name in file_names:
+                file_path = os.path.join(root, file_name)
+                if is_image_file(file_path):
+                    sources.append(file_path)
+                elif is_archive_file(file_path):
+                    sources.extend(list_archive_images(file_path))
+        sources.sort(key=natural_key)
+    elif is_archive_file(path):
+        sources = list_archive_images(path)
+    else:
+        sources = [path]
+    return spread_sample(sources, nb_pages)
+
+
+# The pages are converted once for the device, then each encoder is timed on them (encode, and decode as
+# the e-reader will have to do it) with the bytes by page
+def run_encoders_benchmark(sources, device, repeat=DEFAULT_REPEAT):
+    # type: (list[str], str, int) -> dict
+    settings = ConversionSettings(device, False, True)
+    pages = []
+    for source in sources:
+        pages.extend(henskan_image.convert_image(source, settings=settings))
+    if not pages:
+        raise ValueError('No page to benchmark the encoders on')
+    encoders = {}
+    for encoder_name, options in ENCODER_CANDIDATES:
+        encoder = get_encoder(encoder_name, options)
+        encode_time = decode_time = None
+        datas = []
+        for _ in range(repeat):  # keep the best of the repeats, it's the less noisy one
+            before = time.perf_counter()
+            datas = [encoder.encode(page) for page in pages]
+            elapsed = time.perf_counter() - before
+            encode_time = elapsed if encode_time is None else min(encode_time, elapsed)
+            before = time.perf_counter()
+            for data in datas:
+                Image.open(io.BytesIO(data)).load()
+            elapsed = time.perf_counter() - before
+            decode_time = elapsed if decode_time is None else min(decode_time, elapsed)
+        encoders[encoder.get_description()] = {
+            'encoder':            encoder_name,
+            'options':            options,
+            'encode_ms_per_page': round(1000 * encode_time / len(pages), 3),
+            'decode_ms_per_page': round(1000 * decode_time / len(pages), 3),
+            'bytes_per_page':     sum(len(data) for data in datas) // len(pages),
+        }
+    return {
+        'commit':   _get_git_commit(),
+        'date':     time.strftime('%Y-%m-%d %H:%M:%S'),
+        'pillow':   Image.__version__,
+        'device':   device,
+        'nb_pages': len(pages),
+        'repeat':   repeat,
+        'encoders': encoders,
+    }
+
+
+def _print_encoders_results(results):
+    # type: (dict) -> None
+    print(f'Device: {results["device"]}  Pages: {results["nb_pages"]}  Pillow: {results["pillow"]}')
+    print(f'{"encoder":<32} {"encode":>12} {"decode":>12} {"size":>12}')
+    for description, encoder in sorted(results['encoders'].items(), key=lambda item: item[1]['bytes_per_page']):
+        print(f'{description:<32} {encoder["encode_ms_per_page"]:>7.1f} ms/p {encoder["decode_ms_per_page"]:>7.1f} ms/p '
+              f'{encoder["bytes_per_page"] / 1024:>7.1f} KB/p')
+
+
+def _print_results(results):
+    # type: (dict) -> None
+    print(f'Commit: {results["commit"]}  Python: {results["python"]}  Pillow: {results["pillow"]}  Peak RSS: {results["peak_rss_mb"]} MB')
+    for name, case in sorted(results['cases'].items()):
+        print(f'{name:<60} {case["time"]:>8.3f}s  {case["pages_per_sec"]:>8.2f} pages/s  {case["mpix_per_sec"]:>8.2f} MPix/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Henskan image pipeline on synthetic pages')
+    parser.add_argument('--pages', type=int, help=f'number of pages by kind of sample (default {DEFAULT_NB_PAGES}), '
+                                                  f'or of your pages for --encoders (default {DEFAULT_NB_ENCODER_PAGES})')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='run each case N times and keep the best')
+    parser.add_argument('--device', action='append', dest='devices', help='e-reader profile to bench (default: all)')
+    parser.add_argument('--no-stages', action='store_true', help='only bench the full conversion')
+    parser.add_argument('--full-decode', action='store_true', help='disable the reduced decode of big sources')
+    parser.add_argument('--output', help='save the results in this JSON file')
+    parser.add_argument('--compare', help='previous JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD, help='slowdown ratio that is a regression')
+    parser.add_argument('--encoders', metavar='PATH', help='compare the page encoders on your pages (directory, CBZ/ZIP or PDF)')
+    args = parser.parse_args()
+    
+    # the pipeline is very verbose, and we don't want to bench the console
+    set_batch_mode(True)
+    
+    if args.encoders:
+        device = args.devices[0] if args.devices else STAGE_PROFILE
+        sources = get_sample_sources(args.encoders, args.pages or DEFAULT_NB_ENCODER_PAGES)
+        results = run_encoders_benchmark(sources, device, repeat=args.repeat)
+        _print_encoders_results(results)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        return
+    
+    results = run_benchmark(nb_pages=args.pages or DEFAULT_NB_PAGES, repeat=args.repeat, devices=args.devices, with_stages=not args.no_stages,
+                            reduced_decode=not args.full_decode)
+    _print_results(results)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            previous = json.load(f)
+        regressions = compare_results(previous, results, threshold=args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regression(s) over {args.threshold:.0%}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# Copyright 2020+     Gabès Jean (naparuba@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Size budget: each output file (volume) must fit in a number of bytes, like 200 MB on old Kindles.
+# A sample of the sources is converted once and measured with each candidate encoder, then the best
+# looking encoder that fits is used for all the pages.
+
+from .archive import ARCHIVE_FORMATS
+from .encoders import Encoder, get_encoder
+from .log import get_logger
+from .profiles import DeviceProfile
+
+logger = get_logger(__name__)
+
+BUDGET_SAMPLE_SOURCES = 8  # spread over all the sources, so it's not only the first chapter
+
+BUDGET_MARGIN = 0.05  # the sample is only an estimation, keep some room
+
+# After the profile encoder, from the best looking to the smallest pages
+BUDGET_CANDIDATES = (
+    ('png', {'compress_level': 9}),
+    ('jpeg', {'quality': 90}),
+    ('jpeg', {'quality': 80}),
+    ('jpeg', {'quality': 70}),
+    ('png', {'compress_level': 9, 'greys': 4}),
+    ('jpeg', {'quality': 55}),
+    ('jpeg', {'quality': 40}),
+)
+
+
+def get_budget_encoders(profile):
+    # type: (DeviceProfile) -> list[Encoder]
+    encoders = [profile.get_encoder()]
+    for encoder_name, options in BUDGET_CANDIDATES:
+        encoder = get_encoder(encoder_name, options)
+        if profile.get_archive_format() == ARCHIVE_FORMATS.PDF and not encoder.is_pdf_compatible():
+            continue
+        encoders.append(encoder)
+    return encoders
+
+
+# sample_sizes: for each sample source, the size of its pages with each encoder (henskan.image.measure_source)
+# => (encoder, predicted size of the biggest volume). If none is fitting, the smallest one
+def choose_encoder(encoders, sample_sizes, nb_volume_sources, max_bytes):
+    # type: (list[Encoder], list[list[int]], int, int) -> tuple[Encoder, int]
+    if not sample_sizes:
+        return encoders[0], 0
+    predictions = []
+    for idx, encoder in enumerate(encoders):
+        bytes_by_source = sum(sizes[idx] for sizes in sample_sizes) / len(sample_sizes)
+        predictions.append((encoder, int(bytes_by_source * nb_volume_sources)))
+    for encoder, predicted_bytes in predictions:
+        logger.debug('size budget: %s => %s bytes predicted', encoder, predicted_bytes)
+        if predicted_bytes <= max_bytes * (1.0 - BUDGET_MARGIN):
+            return encoder, predicted_bytes
+    encoder, predicted_bytes = min(predictions, key=lambda prediction: prediction[1])
+    logger.warning('No encoder can fit in %s bytes, using the smallest one %s (%s bytes predicted)', max_bytes, encoder, predicted_bytes)
+    return encoder, predicted_bytes
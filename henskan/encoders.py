@@ -0,0 +1,261 @@
+# Copyright 2020+     Gabès Jean (naparuba@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import zlib
+from abc import ABC, abstractmethod
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+# PNG encoding of the pages, can be set by profile with "png": {"compress_level": 9, "strategy": "rle"}
+DEFAULT_PNG_COMPRESS_LEVEL = 6  # same as zlib/Pillow
+PNG_STRATEGIES = {
+    'default':  zlib.Z_DEFAULT_STRATEGY,
+    'filtered': zlib.Z_FILTERED,
+    'huffman':  zlib.Z_HUFFMAN_ONLY,
+    'rle':      zlib.Z_RLE,
+    'fixed':    zlib.Z_FIXED,
+}
+
+# PNG stores a palette of 16 colors (or less) with 4 bits by pixel (2 bits for 4, 1 bit for 2): Pillow
+# does it for our P pages, the L pages with only a few greys are given a palette of these greys
+PNG_PACKED_MAX_COLORS = 16
+
+DEFAULT_JPEG_QUALITY = 90
+
+# PNG text chunk with the device of the pages written by the pipeline, so a re-export for the same device can
+# copy them without decoding them (the other formats have no place for it)
+PAGE_DEVICE_KEY = 'Henskan-Device'
+
+# Page data first bytes => extension of the page in the archive
+DATA_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8', 'jpg'),
+)
+
+
+def get_data_extension(data):
+    # type: (bytes) -> str
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    for signature, extension in DATA_SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    return 'png'
+
+
+# The page pixels => the page file data, in the archive. Encoders are built from the profile options,
+# and are the same for all the pages of a device
+class Encoder(ABC):
+    name = ''
+    
+    
+    # device: the page is what the pipeline gives for this device, '' for the other pages
+    @abstractmethod
+    def encode(self, image, device=''):
+        # type: (Image.Image, str) -> bytes
+        pass
+    
+    
+    # Short text for the logs and the benchmark, like png(level=9,rle)
+    @abstractmethod
+    def get_description(self):
+        # type: () -> str
+        pass
+    
+    
+    # Can the PDF embed this data without decoding it?
+    def is_pdf_compatible(self):
+        # type: () -> bool
+        return True
+    
+    
+    def __repr__(self):
+        return self.get_description()
+    
+    
+    def _save(self, image, image_format, **options):
+        # type: (Image.Image, str, object) -> bytes
+        try:
+            with io.BytesIO() as buffer:
+                image.save(buffer, format=image_format, **options)
+                return buffer.getvalue()
+        except IOError:
+            raise RuntimeError('Cannot encode image %s' % image)
+
+
+class PNGEncoder(Encoder):
+    name = 'png'
+    
+    
+    # greys: if set, the page is reduced to this number of greys (2 to 16), for smaller pages than the device palette
+    def __init__(self, compress_level=DEFAULT_PNG_COMPRESS_LEVEL, strategy='default', greys=0):
+        # type: (int, str, int) -> None
+        if not isinstance(compress_level, int) or not 0 <= compress_level <= 9:
+            raise ValueError(f'png compress_level must be between 0 and 9, not {compress_level}')
+        if strategy not in PNG_STRATEGIES:
+            raise ValueError(f'png strategy must be one of {", ".join(PNG_STRATEGIES)}, not {strategy}')
+        if not isinstance(greys, int) or not (greys == 0 or 2 <= greys <= PNG_PACKED_MAX_COLORS):
+            raise ValueError(f'png greys must be between 2 and {PNG_PACKED_MAX_COLORS}, not {greys}')
+        self._compress_level = compress_level
+        self._strategy = strategy
+        self._greys = greys
+    
+    
+    def get_compress_level(self):
+        # type: () -> int
+        return self._compress_level
+    
+    
+    def get_strategy(self):
+        # type: () -> str
+        return self._strategy
+    
+    
+    def get_greys(self):
+        # type: () -> int
+        return self._greys
+    
+    
+    # Directly the Pillow PNG save options
+    def get_options(self):
+        # type: () -> dict[str, int]
+        return {'compress_level': self._compress_level, 'compress_type': PNG_STRATEGIES[self._strategy]}
+    
+    
+    def get_description(self):
+        # type: () -> str
+        if self._greys:
+            return f'png(level={self._compress_level},{self._strategy},{self._greys} greys)'
+        return f'png(level={self._compress_level},{self._strategy})'
+    
+    
+    # Evenly spaced greys, each luminance goes to the nearest one
+    def _reduce_greys(self, image):
+        # type: (Image.Image) -> Image.Image
+        if image.mode != 'L':
+            image = image.convert('L')
+        nb_steps = self._greys - 1
+        lut = [(luminance * nb_steps + 127) // 255 for luminance in range(256)]
+        reduced_image = image.point(lut)
+        reduced_image.putpalette([(255 * index) // nb_steps for index in range(self._greys) for _ in range(3)])  # L -> P
+        return reduced_image
+    
+    
+    @staticmethod
+    def pack_image(image):
+        # type: (Image.Image) -> Image.Image
+        if image.mode != 'L':
+            return image
+        colors = image.getcolors(PNG_PACKED_MAX_COLORS)  # None if more colors
+        if colors is None:
+            return image
+        greys = sorted(grey for (_, grey) in colors)
+        lut = [0] * 256
+        for index, grey in enumerate(greys):
+            lut[grey] = index
+        packed_image = image.point(lut)
+        packed_image.putpalette([grey for grey in greys for _ in range(3)])  # L -> P
+        return packed_image
+    
+    
+    def encode(self, image, device=''):
+        # type: (Image.Image, str) -> bytes
+        image = self._reduce_greys(image) if self._greys else self.pack_image(image)
+        options = self.get_options()
+        if device:
+            options['pnginfo'] = PngInfo()
+            options['pnginfo'].add_text(PAGE_DEVICE_KEY, device)
+        return self._save(image, 'PNG', **options)
+
+
+# Baseline JPEG is far faster to open than a big PNG on some e-readers (Kobo), and is given as is to the PDF
+class JPEGEncoder(Encoder):
+    name = 'jpeg'
+    
+    
+    def __init__(self, quality=DEFAULT_JPEG_QUALITY, progressive=False):
+        # type: (int, bool) -> None
+        if not isinstance(quality, int) or not 1 <= quality <= 100:
+            raise ValueError(f'jpeg quality must be between 1 and 100, not {quality}')
+        if not isinstance(progressive, bool):
+            raise ValueError(f'jpeg progressive must be true or false, not {progressive}')
+        self._quality = quality
+        self._progressive = progressive
+    
+    
+    def get_description(self):
+        # type: () -> str
+        return f'jpeg(quality={self._quality},{"progressive" if self._progressive else "baseline"})'
+    
+    
+    def encode(self, image, device=''):
+        # type: (Image.Image, str) -> bytes
+        if image.mode not in ('L', 'RGB'):  # no palette in JPEG, our palettes are greys
+            image = image.convert('L' if image.mode in ('P', '1', 'LA') else 'RGB')
+        return self._save(image, 'JPEG', quality=self._quality, progressive=self._progressive)
+
+
+class WebPEncoder(Encoder):
+    name = 'webp'
+    
+    
+    def __init__(self, lossless=True, quality=DEFAULT_JPEG_QUALITY):
+        # type: (bool, int) -> None
+        if not isinstance(lossless, bool):
+            raise ValueError(f'webp lossless must be true or false, not {lossless}')
+        if not isinstance(quality, int) or not 1 <= quality <= 100:
+            raise ValueError(f'webp quality must be between 1 and 100, not {quality}')
+        self._lossless = lossless
+        self._quality = quality
+    
+    
+    def get_description(self):
+        # type: () -> str
+        if self._lossless:
+            return 'webp(lossless)'
+        return f'webp(quality={self._quality})'
+    
+    
+    def is_pdf_compatible(self):
+        # type: () -> bool
+        return False
+    
+    
+    def encode(self, image, device=''):
+        # type: (Image.Image, str) -> bytes
+        if image.mode not in ('L', 'RGB'):
+            image = image.convert('L' if image.mode in ('P', '1', 'LA') else 'RGB')
+        return self._save(image, 'WEBP', lossless=self._lossless, quality=self._quality)
+
+
+ENCODERS = {encoder_class.name: encoder_class for encoder_class in (PNGEncoder, JPEGEncoder, WebPEncoder)}
+
+
+# options are the profile ones, like {"quality": 85} for jpeg. Bad names or options => ValueError
+def get_encoder(name, options=None):
+    # type: (str, dict|None) -> Encoder
+    encoder_class = ENCODERS.get(name)
+    if encoder_class is None:
+        raise ValueError(f'encoder must be one of {", ".join(ENCODERS)}, not {name}')
+    if options is None:
+        options = {}
+    if not isinstance(options, dict):
+        raise ValueError(f'{name} options must be an object')
+    try:
+        return encoder_class(**options)
+    except TypeError as exp:  # unknown option
+        raise ValueError(f'bad {name} options {options}: {exp}')
@@ -19,9 +19,13 @@ import os
 
 from PyQt6.QtCore import QAbstractListModel, QModelIndex, Qt, QVariant
 
+from .log import get_logger
 from .parameters import parameters
+from .source import get_source_size, open_source
 from .util import natural_key
 
+logger = get_logger(__name__)
+
 
 class FilePathModel(QAbstractListModel):
     FullPathRole = Qt.ItemDataRole.UserRole + 1
@@ -84,6 +88,12 @@ class FilePathModel(QAbstractListModel):
         self.endInsertRows()
     
     
+    def clear(self):
+        self.beginResetModel()
+        self._items = []
+        self.endResetModel()
+    
+    
     # We will look at duplicate images, and remove them, because it must be scan team ad
     # NOTE: we cannot hash all files, so first look at size duplicate, and then for same size, we can compute
     #       the hash.
@@ -95,7 +105,7 @@ class FilePathModel(QAbstractListModel):
         # First look at same size
         for idx, entry in enumerate(self._items):
             filename = entry["full_path"]
-            size = os.path.getsize(filename)
+            size = get_source_size(filename)  # can be in an archive
             # print "File: %s => %s " % (filename, size)
             if size not in file_by_sizes:
                 file_by_sizes[size] = []
@@ -110,7 +120,7 @@ class FilePathModel(QAbstractListModel):
                 continue
             _hashs = {}
             for idx, filename in file_by_sizes[size]:
-                with open(filename, 'rb') as f:
+                with open_source(filename) as f:
                     buf = f.read()
                     _hash = hashlib.sha1(buf).hexdigest()
                     if _hash not in _hashs:
@@ -123,7 +133,7 @@ class FilePathModel(QAbstractListModel):
         
         # Now clean duplicate images
         if _idx_to_delete:
-            print("We will clean a total of %s of %s images" % (len(_idx_to_delete), len(self._items)))
+            logger.info('We will clean a total of %s of %s images', len(_idx_to_delete), len(self._items))
             # We need to remove by the end
             _idx_to_delete.sort()
             _idx_to_delete.reverse()
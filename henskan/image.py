@@ -14,15 +14,22 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import io
-import time
 import traceback
 from enum import Enum
 from math import ceil
 
+import numpy
 from PIL import Image, ImageChops, ImageFilter, ImageOps, ImageStat
 
 from .archive import ARCHIVE_FORMATS
-from .parameters import parameters
+from .log import get_logger
+from .parameters import parameters, ConversionSettings
+from .encoders import PAGE_DEVICE_KEY, Encoder, PNGEncoder
+from .profiles import DeviceProfile, compute_palette_lut, profiles
+from .profiling import profiler
+from .source import open_source, split_member_path
+
+logger = get_logger(__name__)
 
 DEBUG = False
 
@@ -40,109 +47,50 @@ def _get_palette(size):
     return _palette
 
 
-Palette4 = [
-    0x00, 0x00, 0x00,
-    0x55, 0x55, 0x55,
-    0xaa, 0xaa, 0xaa,
-    0xff, 0xff, 0xff
-]
-
-Palette15a = [
-    0x00, 0x00, 0x00,
-    0x11, 0x11, 0x11,
-    0x22, 0x22, 0x22,
-    0x33, 0x33, 0x33,
-    0x44, 0x44, 0x44,
-    0x55, 0x55, 0x55,
-    0x66, 0x66, 0x66,
-    0x77, 0x77, 0x77,
-    0x88, 0x88, 0x88,
-    0x99, 0x99, 0x99,
-    0xaa, 0xaa, 0xaa,
-    0xbb, 0xbb, 0xbb,
-    0xcc, 0xcc, 0xcc,
-    0xdd, 0xdd, 0xdd,
-    0xff, 0xff, 0xff,
-]
-
-Palette15b = [
-    0x00, 0x00, 0x00,
-    0x11, 0x11, 0x11,
-    0x22, 0x22, 0x22,
-    0x33, 0x33, 0x33,
-    0x44, 0x44, 0x44,
-    0x55, 0x55, 0x55,
-    0x77, 0x77, 0x77,
-    0x88, 0x88, 0x88,
-    0x99, 0x99, 0x99,
-    0xaa, 0xaa, 0xaa,
-    0xbb, 0xbb, 0xbb,
-    0xcc, 0xcc, 0xcc,
-    0xdd, 0xdd, 0xdd,
-    0xee, 0xee, 0xee,
-    0xff, 0xff, 0xff,
-]
-
-Palette16 = [
-    0x00, 0x00, 0x00,
-    0x11, 0x11, 0x11,
-    0x22, 0x22, 0x22,
-    0x33, 0x33, 0x33,
-    0x44, 0x44, 0x44,
-    0x55, 0x55, 0x55,
-    0x66, 0x66, 0x66,
-    0x77, 0x77, 0x77,
-    0x88, 0x88, 0x88,
-    0x99, 0x99, 0x99,
-    0xaa, 0xaa, 0xaa,
-    0xbb, 0xbb, 0xbb,
-    0xcc, 0xcc, 0xcc,
-    0xdd, 0xdd, 0xdd,
-    0xee, 0xee, 0xee,
-    0xff, 0xff, 0xff,
-]
+_default_encoder = PNGEncoder()  # without a profile (scripts & tests)
+
+# Kept for the scripts & tests, the real source is the profile registry
+Palette4 = profiles.get_palette('4')
+Palette15a = profiles.get_palette('15a')
+Palette15b = profiles.get_palette('15b')
+Palette16 = profiles.get_palette('16')
 
 
+# The devices are in the profile registry (henskan/profiles.json & the user one), this is the old API on it
 class EReaderData:
-    Profiles = {
-        'Kindle 1':                         ((600, 800), Palette4, ARCHIVE_FORMATS.PDF),
-        'Kindle 2/3/Touch':                 ((600, 800), Palette15a, ARCHIVE_FORMATS.PDF),
-        'Kindle 4 & 5':                     ((600, 800), Palette15b, ARCHIVE_FORMATS.PDF),
-        'Kindle DX/DXG':                    ((824, 1200), Palette15a, ARCHIVE_FORMATS.PDF),
-        'Kindle Paperwhite 1 & 2':          ((758, 1024), Palette15b, ARCHIVE_FORMATS.PDF),
-        'Kindle Paperwhite 3/Voyage/Oasis': ((1072, 1448), Palette16, ARCHIVE_FORMATS.PDF),
-        'Kobo Mini/Touch':                  ((600, 800), Palette15b, ARCHIVE_FORMATS.CBZ),
-        'Kobo Glo':                         ((768, 1024), Palette15b, ARCHIVE_FORMATS.CBZ),
-        'Kobo Glo HD':                      ((1072, 1448), Palette15b, ARCHIVE_FORMATS.CBZ),
-        'Kobo Aura':                        ((758, 1024), Palette15b, ARCHIVE_FORMATS.CBZ),
-        'Kobo Aura HD':                     ((1080, 1440), Palette16, ARCHIVE_FORMATS.CBZ),
-        'Kobo Aura H2O':                    ((1080, 1430), Palette16, ARCHIVE_FORMATS.CBZ),
-        'Kobo Libra H2O':                   ((1264, 1680), Palette16, ARCHIVE_FORMATS.CBZ),
-        'Kobo Elipsa 2E':                   ((1440, 1872), Palette16, ARCHIVE_FORMATS.CBZ),
-    }
+    @staticmethod
+    def get_profile(device):
+        # type: (str) -> DeviceProfile
+        return profiles.get(device)
     
     
     @staticmethod
     def get_size(device):
         # type: (str) -> tuple[int, int]
-        return EReaderData.Profiles[device][0]
+        return profiles.get(device).get_size()
     
     
     @staticmethod
     def get_palette(device):
         # type: (str) -> list
-        return EReaderData.Profiles[device][1]
+        return profiles.get(device).get_palette()
     
     
     @staticmethod
     def get_archive_format(device):
         # type: (str) -> ARCHIVE_FORMATS
-        return EReaderData.Profiles[device][2]
+        return profiles.get(device).get_archive_format()
     
     
     @staticmethod
     def is_device_exists(device):
-        return device in EReaderData.Profiles
+        return profiles.exists(device)
+    
+    
+    @staticmethod
+    def get_devices():
+        # type: () -> list[str]
+        return profiles.get_names()
 
 
 # decorate a function that use image, *** and if there
@@ -155,7 +103,7 @@ def protect_bad_image(func):
         try:
             return func(*args, **kwargs)
         except (IOError, ValueError):  # Exception from PIL about bad image
-            print(f' * protect_bad_image:: Bad image, return original {traceback.format_exc()}')
+            logger.warning('Bad image, return original one: %s', traceback.format_exc())
             return args[0]
     
     
@@ -178,103 +126,75 @@ def _split_right(image):
     return image.crop((width_img // 2, 0, width_img, height_img))
 
 
-class PIXEL_CATEGORY(Enum):
-    WHITE = 1
-    BLACK = 2
-    GREY = 3
-    OTHER = 4
-
-
-def _detect_pixel_category(pixel):
-    # type: (tuple[int, int, int]) -> PIXEL_CATEGORY
-    if pixel[0] >= 255 and pixel[1] >= 255 and pixel[2] >= 255:
-        return PIXEL_CATEGORY.WHITE
-    elif pixel[0] <= 0 and pixel[1] <= 0 and pixel[2] <= 0:
-        return PIXEL_CATEGORY.BLACK
-    elif abs(pixel[0] - pixel[1]) < 10 and abs(pixel[0] - pixel[2]) < 10:  # a diff in 10 (on 255) is ok for "quite the same"
-        return PIXEL_CATEGORY.GREY
-    else:
-        return PIXEL_CATEGORY.OTHER
-
-
-@protect_bad_image
-def _is_globally_grey__slow(image):
+# A pixel is grey if its channels are close (a diff in 10 on 255 is ok for "quite the same")
+GREY_PIXEL_MAX_DIFF = 10
+# If no channel diff is over this, the image is totally grey, no need to look further
+GREY_IMAGE_MAX_DIFF = 15
+# Mostly grey with a little bit of colors is still grey: less than 10% of color pixels
+GREY_MAX_COLOR_RATIO = 0.1
+
+# palette -> 256 entries lookup table, from luminance to the nearest palette index
+_palette_luts = {}
+
+
+# Only one pass on the pixels: the max channel diff of each pixel gives both the "totally grey"
+# and the "mostly grey" answers
+def _get_channel_diff_stats(image):
+    # type: (Image) -> tuple[int, float]
+    if image.mode == 'L':
+        return 0, 0.0
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    pixels = numpy.asarray(image)
+    red, green, blue = pixels[:, :, 0], pixels[:, :, 1], pixels[:, :, 2]
+    # stay in uint8: max - min is the absolute diff without overflow, and in place to avoid big temporary arrays
+    channel_diff = numpy.maximum(red, green)
+    channel_diff -= numpy.minimum(red, green)
+    blue_diff = numpy.maximum(red, blue)
+    blue_diff -= numpy.minimum(red, blue)
+    numpy.maximum(channel_diff, blue_diff, out=channel_diff)
+    if channel_diff.size == 0:
+        return 0, 0.0
+    max_diff = int(channel_diff.max())
+    if max_diff < GREY_IMAGE_MAX_DIFF:
+        return max_diff, 0.0
+    color_ratio = float(numpy.count_nonzero(channel_diff >= GREY_PIXEL_MAX_DIFF)) / channel_diff.size
+    return max_diff, color_ratio
+
+
+# A bad image is not grey: it keeps its colors, like all the other steps are keeping it as it is
+def _is_image_grey(image):
     # type: (Image) -> bool
-    pixels = image.getdata()
-    
-    nb_pixels = len(pixels)
-    nb_pixels_in_colors_over_threshold = nb_pixels * 0.1  # if more than 10% of pixels are in colors, then it's not grey and we can stop the loop
-    nb_pixels_in_colors = 0
-    cats = {}
-    for pixel in pixels:
-        cat = _detect_pixel_category(pixel)
-        if cat not in cats:
-            cats[cat] = 0
-        cats[cat] += 1
-        if cat == PIXEL_CATEGORY.OTHER:
-            nb_pixels_in_colors += 1
-            if nb_pixels_in_colors > nb_pixels_in_colors_over_threshold:
-                print(f' too many pixels in colors, over 10%: {nb_pixels_in_colors} / {nb_pixels}')
-                return False
-    print(f' cats: {cats}')
-    total_pixels = cats.get(PIXEL_CATEGORY.WHITE, 0) + cats.get(PIXEL_CATEGORY.BLACK, 0) + cats.get(PIXEL_CATEGORY.GREY, 0) + cats.get(
-            PIXEL_CATEGORY.OTHER, 0)
-    nb_others = cats.get(PIXEL_CATEGORY.OTHER, 0)
-    pct_colors = nb_others / total_pixels * 100
-    print(f' pct_colors: {pct_colors:.2f}%')
-    is_grey = pct_colors < 10  # if less than 10% of colors, then it's mostly grey
-    return is_grey
-
-
-# Check if image is monochrome (1 channel or 3 identical channels)
-@protect_bad_image
-def _is_totally_greyscale__fast(image):
-    # type: ( Image) -> bool
-    if image.mode not in ("L", "RGB"):
-        # Unsupported image mode
+    try:
+        max_diff, color_ratio = _get_channel_diff_stats(image)
+    except (IOError, ValueError):  # Exception from PIL about bad image
+        logger.warning('Bad image, cannot detect if it is grey: %s', traceback.format_exc())
         return False
-    
-    if image.mode == "RGB":
-        rgb = image.split()
-        extrema = ImageChops.difference(rgb[0], rgb[1]).getextrema()[1]
-        print(f' extrema 1?  {extrema}')
-        if extrema >= 15:
-            return False
-        extrema = ImageChops.difference(rgb[0], rgb[2]).getextrema()[1]
-        print(f' extrema 2?  {extrema}')
-        if extrema >= 15:
-            return False
-    return True
+    is_grey = max_diff < GREY_IMAGE_MAX_DIFF or color_ratio < GREY_MAX_COLOR_RATIO
+    logger.debug('grey detection => is_grey: %s (max diff=%s, colors=%.2f%%)', is_grey, max_diff, color_ratio * 100)
+    return is_grey
 
 
-@protect_bad_image
-def _is_image_grey(image):
-    # type: (Image) -> bool
-    before = time.time()
-    is_grey = _is_totally_greyscale__fast(image)  # if True, then we can trust it's grey
-    print(f'{time.time() - before:.2f} GREYSCALE Image FAST => is_grey: {is_grey}')
-    
-    if not is_grey:  # maybe it's a grey with a little bit of colors, so must check for real colors presence
-        before_slow = time.time()
-        is_grey = _is_globally_grey__slow(image)
-        print(f'  {time.time() - before_slow:.2f} SLOW DETECT COLORS => is_grey: {is_grey}')
-        if is_grey:
-            print(f'  *********** WAS IN FACT GREY ***********')
-    return is_grey
+def _get_palette_lut(palette):
+    # type: (list) -> list[int]
+    key = tuple(palette)
+    lut = _palette_luts.get(key)
+    if lut is None:
+        lut = compute_palette_lut(palette)
+        _palette_luts[key] = lut
+    return lut
 
 
+# Palettes are only greys, so it's a lookup on the luminance, no need for a generic RGB quantize
 @protect_bad_image
-def _apply_grey_palette(image, palette):
-    # type: (Image, list) -> Image
-    
-    colors = len(palette) // 3
-    if colors < 256:
-        palette = palette + palette[:3] * (256 - colors)
-    
-    pal_img = Image.new('P', (1, 1))
-    pal_img.putpalette(palette)
+def _apply_grey_palette(image, palette, lut=None):
+    # type: (Image, list, list[int]|None) -> Image
     
-    return image.quantize(palette=pal_img)
+    if image.mode != 'L':
+        image = image.convert('L')
+    indexed_image = image.point(lut or _get_palette_lut(palette))  # device profiles have their lut precomputed
+    indexed_image.putpalette(palette)  # L -> P, with only the palette colors
+    return indexed_image
 
 
 @protect_bad_image
@@ -284,37 +204,38 @@ def _apply_basic_grey(image):
     return ImageOps.grayscale(image)
 
 
+# Size of the page in the archive, with this encoder. It's the only way to know it (PNG/JPEG sizes are
+# depending on the content), so it's only done on the pages we must compare
+def get_encoded_size(image, encoder):
+    # type: (Image, Encoder) -> int
+    return len(encoder.encode(image))
+
+
 @protect_bad_image
-def _quantize_image(image, palette):
-    # type: (Image, list) -> Image
+def _quantize_image(image, palette, encoder=None):
+    # type: (Image, list, Encoder|None) -> Image
+    if encoder is None:
+        encoder = _default_encoder
     
-    t0 = time.time()
-    img_palette = _apply_grey_palette(image, palette)
-    t1 = time.time()
-    img_basic_grey = _apply_basic_grey(image)
-    t2 = time.time()
+    with profiler.stage('quantize-palette'):
+        img_palette = _apply_grey_palette(image, palette)
+    with profiler.stage('quantize-basic'):
+        img_basic_grey = _apply_basic_grey(image)
     
     # Get image that is smaller in disk size
     
-    # Save both images to buffers
-    with io.BytesIO() as temp_palette_file:
-        img_palette.save(temp_palette_file, format='PNG')
-        palette_file_size = len(temp_palette_file.getvalue())
-    t3 = time.time()
+    # Encode both images as the pages will be (a palette is far better in PNG than in JPEG)
+    with profiler.stage('quantize-measure'):
+        palette_file_size = get_encoded_size(img_palette, encoder)
+        basic_file_size = get_encoded_size(img_basic_grey, encoder)
     
-    with io.BytesIO() as temp_basic_file:
-        img_basic_grey.save(temp_basic_file, format='PNG')
-        basic_file_size = len(temp_basic_file.getvalue())
-    t4 = time.time()
-    
-    print(f'Times: Palette:{t1 - t0:.3f}s  Basic:{t2 - t1:.3f}s  Save-palette:{t3 - t2:.3f}s  Save-basic:{t4 - t3:.3f}s')
-    print(f'Sizes: Palette:{palette_file_size}  Basic:{basic_file_size}')
+    logger.debug('sizes: palette:%s  basic:%s', palette_file_size, basic_file_size)
     
     # Get smaller one
     if palette_file_size < basic_file_size:
-        print(f' * Quantize image => Using palette image')
+        logger.debug('quantize image => using palette image')
         return img_palette
-    print(f' * Quantize image => Using basic grey image')
+    logger.debug('quantize image => using basic grey image')
     return img_basic_grey
 
 
@@ -338,28 +259,44 @@ def _resize_image(image, to_size):
         width_img, height_img = to_size
     
     if DEBUG:
-        print(' * Resizing image from %s to %s/%s' % (image.size, width_img, height_img))
+        logger.debug('resizing image from %s to %s/%s', image.size, width_img, height_img)
     
     # Ok we can resize
     return image.resize((width_img, height_img), Image.Resampling.LANCZOS)
-    
-    
+
+
+FILL_MARGIN_LEFT = 10  # in pixels, the e-readers are often hiding the left border
+
+
+# The brightest color of a grey palette (not always 255, and not always the last one)
+def _get_palette_white_index(palette):
+    # type: (list[int]) -> int
+    greys = palette[::3]
+    return greys.index(max(greys))
+
+
+# The page keeps its mode from the grey pass (L or P, 1 byte by pixel), only the other ones are filled in RGB
 @protect_bad_image
 def _fill_image_to_whole_size(image, to_size):
     # type: (Image, tuple[int, int]) -> Image
-    white = (255, 255, 255)
-    final_image = Image.new("RGB", to_size, white)  # Fond blanc
+    if image.mode == 'L':
+        final_image = Image.new('L', to_size, 255)
+    elif image.mode == 'P':
+        palette = image.getpalette()
+        final_image = Image.new('P', to_size, _get_palette_white_index(palette))
+        final_image.putpalette(palette)
+    else:
+        final_image = Image.new("RGB", to_size, (255, 255, 255))  # Fond blanc
     
-    margin_left = 10
     image_width, _ = image.size
     to_width, _ = to_size
     
     # If the image is small enough, put a margin of the left
-    if image_width <= to_width - margin_left:
-        paste_position = (margin_left, 0)
+    if image_width <= to_width - FILL_MARGIN_LEFT:
+        paste_position = (FILL_MARGIN_LEFT, 0)
     else: # ok no place for the margin ^^
         paste_position = (0, 0)
-        
+    
     final_image.paste(image, paste_position)
     
     return final_image
@@ -374,6 +311,21 @@ def _format_image_to_rgb(image):
     return image.convert('RGB')
 
 
+# Grey sources stay in L (3 times less pixels to move in all the stages), only the colors ones need RGB
+@protect_bad_image
+def _format_image_mode(image):
+    # type: (Image) -> Image
+    if image.mode in ('L', 'RGB'):
+        return image
+    if image.mode in ('1', 'I', 'I;16', 'LA'):
+        return image.convert('L')
+    if image.mode == 'P' and 'transparency' not in image.info:
+        palette = image.getpalette()
+        if all(palette[i] == palette[i + 1] == palette[i + 2] for i in range(0, len(palette), 3)):
+            return image.convert('L')
+    return image.convert('RGB')
+
+
 @protect_bad_image
 def _orient_image(image, device_size):
     # type: (Image, tuple[int, int]) -> Image
@@ -381,41 +333,134 @@ def _orient_image(image, device_size):
     width_img, height_img = image.size
     
     if (width_img > height_img) != (width_dev > height_dev):
-        return image.rotate(90, Image.Resampling.LANCZOS, True)
+        return image.transpose(Image.Transpose.ROTATE_90)  # exact, no resampling like a rotate
     return image
 
 
 # We will auto crop the image, by removing just white part around the image
 # by inverting colors, and asking a bounder box ^^
+# Crop decisions are only boxes, so they are computed on a small proxy of the page, and the boxes are mapped
+# back on the original image with a safety margin (we prefer to keep a few white pixels than to cut the drawing)
+ANALYSIS_PROXY_MAX_SIZE = 800  # max width/height of the proxy, 0 to analyse the original image
+ANALYSIS_PROXY_MARGIN = 4  # in pixels of the original image
+
+
+def set_analysis_proxy(max_size, margin=ANALYSIS_PROXY_MARGIN):
+    # type: (int, int) -> None
+    global ANALYSIS_PROXY_MAX_SIZE, ANALYSIS_PROXY_MARGIN
+    ANALYSIS_PROXY_MAX_SIZE = max_size
+    ANALYSIS_PROXY_MARGIN = margin
+
+
+class AnalysisProxy(object):
+    def __init__(self, image):
+        # type: (Image) -> None
+        self._original_size = image.size
+        self._image = image
+        factor = 1
+        if ANALYSIS_PROXY_MAX_SIZE > 0:
+            factor = int(ceil(max(image.size) / ANALYSIS_PROXY_MAX_SIZE))
+        if factor >= 2 and image.mode in ('L', 'RGB', 'RGBA'):
+            self._image = image.reduce(factor)  # box filter, fast and keep the mean colors
+        self._is_reduced = self._image is not image
+        self._scale_x = self._original_size[0] / self._image.size[0]
+        self._scale_y = self._original_size[1] / self._image.size[1]
+    
+    
+    def get_image(self):
+        # type: () -> Image
+        return self._image
+    
+    
+    def to_proxy_length(self, length):
+        # type: (float) -> float
+        return max(1.0, length / self._scale_x) if self._is_reduced else length
+    
+    
+    # The box filter is averaging the noise (jpeg, screentones) of the original pixels, so a variance threshold
+    # must be lower on the proxy
+    def to_proxy_variance(self, variance):
+        # type: (float) -> float
+        return variance / self._scale_x if self._is_reduced else variance
+    
+    
+    def to_original_box(self, box):
+        # type: (tuple[int, int, int, int]) -> tuple[int, int, int, int]
+        if not self._is_reduced:
+            return box
+        x0, y0, x1, y1 = box
+        width, height = self._original_size
+        return (max(0, int(x0 * self._scale_x) - ANALYSIS_PROXY_MARGIN),
+                max(0, int(y0 * self._scale_y) - ANALYSIS_PROXY_MARGIN),
+                min(width, int(ceil(x1 * self._scale_x)) + ANALYSIS_PROXY_MARGIN),
+                min(height, int(ceil(y1 * self._scale_y)) + ANALYSIS_PROXY_MARGIN))
+    
+    
+    # Number of pixels to remove at the bottom of the original image
+    def to_original_bottom_cut(self, cut):
+        # type: (int) -> int
+        if not self._is_reduced:
+            return cut
+        return max(0, int(cut * self._scale_y) - ANALYSIS_PROXY_MARGIN)
+
+
 @protect_bad_image
 def _blurauto_crop_image(image):
     # type: (Image) -> Image
     orig_image = image
     power = 2.0  # mode: pifometre
+    proxy = AnalysisProxy(image)
     # work on a black image
-    blur_image = ImageOps.invert(image.convert(mode='L'))
+    blur_image = ImageOps.invert(proxy.get_image().convert(mode='L'))
     blur_image = blur_image.point(lambda x: x and 255)
     blur_image = blur_image.filter(ImageFilter.MinFilter(size=3))
-    blur_image = blur_image.filter(ImageFilter.GaussianBlur(radius=5))
+    blur_image = blur_image.filter(ImageFilter.GaussianBlur(radius=proxy.to_proxy_length(5)))  # the same blur as the original size
     blur_image = blur_image.point(lambda x: (x >= 16 * power) and x)
     blur_bbox = blur_image.getbbox()
     if blur_bbox:
-        return orig_image.crop(blur_bbox)
+        return orig_image.crop(proxy.to_original_box(blur_bbox))
     return orig_image
 
 
-def _find_dominant_color(img):
-    # type: (Image) -> int
-    # Resizing parameters
-    width, height = 150, 150
-    img = img.resize((width, height), resample=0)
-    # Get colors from image object
-    pixels = img.getcolors(width * height)
-    # Sort them by count number(first element of tuple)
-    sorted_pixels = sorted(pixels, key=lambda t: t[0])
-    # Get the most frequent color
-    dominant_color = sorted_pixels[-1][1]
-    return dominant_color
+class BACKGROUND(Enum):
+    WHITE = 'WHITE'
+    BLACK = 'BLACK'
+    OTHER = 'OTHER'  # colored background, or no real background
+
+
+BACKGROUND_SAMPLES = 200  # sampled grid of about 200x200 pixels, enough for a histogram
+BACKGROUND_EDGE_RATIO = 0.1  # the left/right 10% of the image are the most likely to be background...
+BACKGROUND_EDGE_WEIGHT = 4  # ... so they count more
+BACKGROUND_MIN_RATIO = 0.3  # under this, we cannot say there is a background
+
+
+# Webtoons are split on background lines, so we must know if it's white or black. We look at a luminance
+# histogram of a sampled grid, tolerant to the jpeg noise (a 'black' of 3/2/4 is still black)
+def classify_background(image):
+    # type: (Image) -> tuple[BACKGROUND, float]
+    width, height = image.size
+    if width == 0 or height == 0:
+        return BACKGROUND.OTHER, 0.0
+    step_x = max(1, width // BACKGROUND_SAMPLES)
+    step_y = max(1, height // BACKGROUND_SAMPLES)
+    luminance = image if image.mode == 'L' else image.convert('L')
+    samples = numpy.asarray(luminance)[::step_y, ::step_x]
+    
+    weights = numpy.ones(samples.shape, dtype=numpy.float32)
+    edge_width = max(1, int(samples.shape[1] * BACKGROUND_EDGE_RATIO))
+    weights[:, :edge_width] = BACKGROUND_EDGE_WEIGHT
+    weights[:, -edge_width:] = BACKGROUND_EDGE_WEIGHT
+    
+    histogram = numpy.bincount(samples.ravel(), weights=weights.ravel(), minlength=256)
+    total = histogram.sum()
+    black_ratio = float(histogram[:QUITE_BLACK_LIMIT + 1].sum() / total)
+    white_ratio = float(histogram[255 - QUITE_BLACK_LIMIT:].sum() / total)
+    
+    if max(black_ratio, white_ratio) < BACKGROUND_MIN_RATIO:
+        return BACKGROUND.OTHER, 1.0 - max(black_ratio, white_ratio)
+    if black_ratio > white_ratio:
+        return BACKGROUND.BLACK, black_ratio
+    return BACKGROUND.WHITE, white_ratio
 
 
 def _get_image_variance(image):
@@ -423,28 +468,13 @@ def _get_image_variance(image):
     return ImageStat.Stat(image).var[0]
 
 
-@protect_bad_image
-def _auto_crop_image(image):
-    # type: (Image) -> Image
-    fixed_threshold = 5.0
-    
-    before = time.time()
-    
-    if ImageChops.invert(image).getbbox() is None:
-        if DEBUG:
-            print(' * autoCropImage => Using simpleCropImage because no bbox')
-        image = _simple_crop_image(image)
-        return image
-    
+# Height of the bottom part with only the page number (or nothing), that can be removed. The steps are in pixels
+# of the given image: on a proxy they must be scaled like the threshold
+def _find_page_number_cut(image, fixed_threshold, line_step=2, column_step=5):
+    # type: (Image, float, int, int) -> int
     width, height = image.size
-    delta = 2
+    delta = line_step
     diff = delta
-    if _get_image_variance(image) < 2 * fixed_threshold:
-        if DEBUG:
-            print(' * autoCropImage => Image variance is already too small, give back image')
-        image = _simple_crop_image(image)
-        return image
-    
     while _get_image_variance(image.crop((0, height - diff, width, height))) < fixed_threshold and diff < height:
         diff += delta
     diff -= delta
@@ -464,7 +494,7 @@ def _auto_crop_image(image):
         diff += delta
     diff -= delta
     page_number_cut3 = diff
-    delta = 5
+    delta = column_step
     diff = delta
     while _get_image_variance(image.crop((0, height - page_number_cut2, diff, height))) < fixed_threshold and diff < width:
         diff += delta
@@ -482,26 +512,55 @@ def _auto_crop_image(image):
     else:
         diff = page_number_cut1
     
+    return diff
+
+
+@protect_bad_image
+def _auto_crop_image(image):
+    # type: (Image) -> Image
+    fixed_threshold = 5.0
+    
+    if ImageChops.invert(image).getbbox() is None:
+        if DEBUG:
+            logger.debug('auto crop => using simple crop because no bbox')
+        image = _simple_crop_image(image)
+        return image
+    
+    # the page number is searched on a small proxy, it's a lot of variance computations
+    proxy = AnalysisProxy(image)
+    analysed_image = proxy.get_image()
+    proxy_threshold = proxy.to_proxy_variance(fixed_threshold)
+    if _get_image_variance(analysed_image) < 2 * proxy_threshold:
+        if DEBUG:
+            logger.debug('auto crop => image variance is already too small, give back image')
+        image = _simple_crop_image(image)
+        return image
+    
+    with profiler.stage('crop-page-number'):
+        diff = proxy.to_original_bottom_cut(_find_page_number_cut(analysed_image, proxy_threshold,
+                                                                  line_step=int(round(proxy.to_proxy_length(2))),
+                                                                  column_step=int(round(proxy.to_proxy_length(5)))))
+    width, height = image.size
+    
     if DEBUG:
-        print(' * autoCropImage:: Computing crop diff to %s (in %.3f)' % (diff, time.time() - before))
+        logger.debug('auto crop: computing crop diff to %s', diff)
         image.save('tmp/1_before_crop.png')
     
-    before = time.time()
     image = image.crop((0, 0, width, height - diff))
     if DEBUG:
-        print(' * autoCropImage:: apply crop to %s (in %.3f)' % (diff, time.time() - before))
+        logger.debug('auto crop: apply crop to %s', diff)
         image.save('tmp/2_after_crop.png')
     
-    before = time.time()
-    image = _simple_crop_image(image)
+    with profiler.stage('crop-simple'):
+        image = _simple_crop_image(image)
     if DEBUG:
-        print(' * autoCropImage:: simple crop to %s in %.3f' % (image.size, time.time() - before))
+        logger.debug('auto crop: simple crop to %s', image.size)
         image.save('tmp/3_after_simple_crop.png')
     
-    before = time.time()
-    image = _blurauto_crop_image(image)
+    with profiler.stage('crop-blur'):
+        image = _blurauto_crop_image(image)
     if DEBUG:
-        print(' * autoCropImage:: Blurauto %s in %.3f' % (image.size, time.time() - before))
+        logger.debug('auto crop: blur crop to %s', image.size)
         image.save('tmp/4_after_auto_blur.png')
     
     return image
@@ -555,6 +614,8 @@ SOFT_MAX_BLOC_HEIGHT = 1500  # if higher than this, try to split into parts agai
 
 HARD_MAX_BLOC_HEIGHT = 3000  # if higher than this, stop the block
 
+WEBTOON_CHECKPOINT_LINES = 500  # lines analysed between two cancel/pause checks
+
 
 def __get_image_height(image):
     # type: (Image) -> int
@@ -581,14 +642,14 @@ def _is_full_background_image(image):
     is_white = _is_quite_white(start_pixel, precision=precision)
     is_black = _is_quite_black(start_pixel, precision=precision)
     if DEBUG:
-        print('  is_full_background_image:: white=%s   black=%s' % (is_white, is_black))
+        logger.debug('is_full_background_image: white=%s   black=%s', is_white, is_black)
     if is_white:
         for x in range(width):
             for y in range(height):
                 pixel = pixels[x, y]
                 if not _is_quite_white(pixel, precision=precision):
                     if DEBUG:
-                        print('    is_full_background_image:: the pixel %s/%s is not white %s-%s-%s' % (x, y, pixel[0], pixel[1], pixel[2]))
+                        logger.debug('is_full_background_image: the pixel %s/%s is not white %s', x, y, pixel)
                     return False
         # all was white
         return True
@@ -598,7 +659,7 @@ def _is_full_background_image(image):
                 pixel = pixels[x, y]
                 if not _is_quite_black(pixel, precision=precision):
                     if DEBUG:
-                        print('    is_full_background_image:: the pixel %s/%s is not black %s-%s-%s' % (x, y, pixel[0], pixel[1], pixel[2]))
+                        logger.debug('is_full_background_image: the pixel %s/%s is not black %s', x, y, pixel)
                     return False
         # all was black
         return True
@@ -611,7 +672,7 @@ def __fail_back_to_cut_very_big_one(image):
     # type: (Image) -> list[Image]
     image_height = __get_image_height(image)
     image_width = __get_image_width(image)
-    print("__fail_back_to_cut_very_big_one:: %s" % image_height)
+    logger.debug('hard cut of a very big block: %s', image_height)
     if image_height <= HARD_MAX_BLOC_HEIGHT:
         return [image]
     
@@ -621,7 +682,7 @@ def __fail_back_to_cut_very_big_one(image):
     for idx in range(nb_images):
         hard_split = image.crop((0, idx * HARD_MAX_BLOC_HEIGHT, image_width, (idx + 1) * HARD_MAX_BLOC_HEIGHT))
         hard_split_images.append(hard_split)
-    print("__fail_back_to_cut_very_big_one:: cut into %s parts" % len(hard_split_images))
+    logger.debug('hard cut of a very big block: cut into %s parts', len(hard_split_images))
     return hard_split_images
 
 
@@ -634,14 +695,12 @@ def __try_to_smart_split_block(image, is_black_background, level=1):
         image.save('tmp/input_%s.jpg' % level)
     image_height = __get_image_height(image)
     image_width = __get_image_width(image)
-    print(" === [LEVEL=%s] Try to smart split block of size %s / %s  (mostly black=%s)" % (level, image_height, image_width, is_black_background))
+    logger.debug('[level=%s] try to smart split block of size %s / %s  (mostly black=%s)', level, image_height, image_width, is_black_background)
     
     # Maybe the image is now too small: just give it back :)
     if image_height <= 200:
         return [image]
     
-    split_pixel = WHITE_PIXEL if not is_black_background else (0, 0, 0)
-    print(" ==== Finding for pixel: %s" % str(split_pixel))
     pixels = image.load()
     for y in range(500, image_height - 200, 10):  # do not try to cut too early, it's useless
         # First look if the left => higher right is possible for split
@@ -667,10 +726,10 @@ def __try_to_smart_split_block(image, is_black_background, level=1):
                 if line_is_valid:
                     break
             if line_is_valid:
-                print("LEFT:: found a valid split line, angle=%s y=%s" % (found_angle, y))
+                logger.debug('left: found a valid split line, angle=%s y=%s', found_angle, y)
         
         # Then is the line is not found look if the right => higher left is possible for split
-        if not line_is_valid and pixels[image_width - 1, y] == split_pixel:
+        if not line_is_valid and _is_background_pixel(pixels[image_width - 1, y], is_black_background):
             from_left = False
             for angle_int in range(0, 200):
                 angle = float(angle_int) // 100
@@ -696,7 +755,7 @@ def __try_to_smart_split_block(image, is_black_background, level=1):
         if not line_is_valid:
             continue
         
-        print("Yeah, we can cut from %s with angle %s and from left:%s" % (y, found_angle, from_left))
+        logger.debug('we can cut from %s with angle %s and from left:%s', y, found_angle, from_left)
         
         split_pixels = {}
         if from_left:
@@ -731,7 +790,7 @@ def __try_to_smart_split_block(image, is_black_background, level=1):
         
         if DEBUG:
             image.save('tmp/with_line_%s.jpg' % level)
-            print("SPLIT RANGE", lower_y, higher_y)
+            logger.debug('split range: %s-%s', lower_y, higher_y)
         
         # HIGHER PART: clean all BELOW the line
         for y in range(lower_y, higher_y):
@@ -764,7 +823,7 @@ def __try_to_smart_split_block(image, is_black_background, level=1):
         return res
     
     # We did fail to split it so give back the original image
-    print("did fail to smart split the image, still %s high" % image_height)
+    logger.debug('did fail to smart split the image, still %s high', image_height)
     # fuck
     fail_back_images = __fail_back_to_cut_very_big_one(image)
     return fail_back_images
@@ -779,54 +838,57 @@ def __parse_webtoon_block(image, start_of_box, width, end_of_box, split_final_im
     # Maybe it's too high
     img_height = __get_image_height(box_image)
     if img_height >= SOFT_MAX_BLOC_HEIGHT:
-        print(" *** WebToon block is too high (%s), trying to split it again" % img_height)
+        logger.debug('webtoon block is too high (%s), trying to split it again', img_height)
         potential_images = __try_to_smart_split_block(box_image, is_black_background, level=0)
     
     for p_image in potential_images:
         # TODO: TEST: if all pixels are black: drop
         image_cropped = _auto_crop_image(p_image)
-        print('  ** image cropped size: %s' % str(image_cropped.size))
+        logger.debug('image cropped size: %s', image_cropped.size)
         try:
             variance = _get_image_variance(image_cropped)
         except ZeroDivisionError:  # seems that the image is too small, let the real test look for it
-            print('   ** Image seems to have issue, skipping variance check')
+            logger.debug('image seems to have issue, skipping variance check')
             variance = 999  # do not delete it
         
         if variance < 1:  # mostly the same color, skip it
             similarity._add_deleted_image('too_low_variance', image_cropped, 'variance_%.2f' % variance, do_move=True)
-            print('  ** SKIP image cropped variance: %s is too small' % str(variance))
+            logger.debug('skip image, cropped variance: %s is too small', variance)
             continue
         # Skip images that are too small (bugs in cut detection protection)
         if __get_image_height(image_cropped) <= MIN_BOX_ALLOWED_HEIGHT:
-            print("SKIP: image is too small to save (%dpx)" % __get_image_height(image_cropped))
+            logger.debug('skip image, too small to save (%dpx)', __get_image_height(image_cropped))
             continue
         if not similarity.is_valid_image(image_cropped, do_move=True):
-            print(" ** [similarity] DROPPING IMAGE")
+            logger.debug('dropping unwanted image (similarity)')
             continue
         if _is_full_background_image(image_cropped):
-            print(" ** Dropping full white/black image")
+            logger.debug('dropping full white/black image')
             similarity._add_deleted_image('too_white', image_cropped, 0, do_move=True)
             continue
-        print(" Split size: %s" % str(image_cropped.size))
+        logger.debug('split size: %s', image_cropped.size)
         split_final_images.append(image_cropped)
 
 
-def _split_webtoon(image):
-    # type: (Image) -> list[Image]
+# checkpoint() is called regularly, it can block (job paused) or raise (job cancelled): a webtoon strip can be long
+def _split_webtoon(image, checkpoint=None):
+    # type: (Image, callable|None) -> list[Image]
     split_images = []
     width, height = image.size
     
     # If we have a black background, good luck to split by white
-    most_color = _find_dominant_color(image)
-    is_black_background = most_color == (0, 0, 0)
+    background, confidence = classify_background(image)
+    is_black_background = background == BACKGROUND.BLACK  # colored backgrounds are split on white lines, like before
     
-    print(" TOON: analysing image %s/%s  (is black background=%s)" % (width, height, is_black_background))
+    logger.debug('webtoon: analysing image %s/%s  (background=%s, confidence=%.2f)', width, height, background.value, confidence)
     MIN_COLOR_HEIGHT = 30  # not less than 30px for a picture
     MAX_BOX_HEIGHT = 1400  # if more than 1400, if possible, close box
     pixels = image.load()  # this is not a list, nor is it list()'able
     
     lines = []
     for y in range(height):
+        if checkpoint is not None and y % WEBTOON_CHECKPOINT_LINES == 0:
+            checkpoint()
         is_white = True
         for x in range(width):
             cpixel = pixels[x, y]
@@ -837,17 +899,16 @@ def _split_webtoon(image):
                     break
             else:  # black background, do not look at black
                 if y == LINE_DEBUG:
-                    print("PIXEL: %s => %s" % (x, str(cpixel)))
+                    logger.debug('pixel: %s => %s', x, cpixel)
                 if not _is_quite_black(cpixel) and not cpixel == WHITE_PIXEL:
                     is_white = False
                     break
                 # else:
                 #    print "Line %s is white" % y
         if y == LINE_DEBUG:
-            print("%s IS WHITE LINE: %s" % (y, is_white))
+            logger.debug('%s is white line: %s', y, is_white)
         lines.append((y, is_white))
     
-    print("Number of white lines: %s" % (len([c for c in lines if c[1]])))
     
     start_of_box = None
     in_box = False
@@ -868,7 +929,7 @@ def _split_webtoon(image):
                 last_black_line = None
                 start_of_box = None
                 in_box = False
-                print("***" * 20, "Protection, split at", current_box_size)
+                logger.debug('protection, split at %s', current_box_size)
                 continue
         
         # we already start
@@ -880,7 +941,7 @@ def _split_webtoon(image):
                 continue
             # or we start a new one
             else:
-                print(' - Starting a box at %s' % y)
+                logger.debug('starting a box at %s', y)
                 in_box = True
                 last_black_line = y
                 start_of_box = y
@@ -896,6 +957,8 @@ def _split_webtoon(image):
             # Of if the box is very high
             distance_from_last_black = y - last_black_line
             if distance_from_last_black > MIN_COLOR_HEIGHT or current_box_size > MAX_BOX_HEIGHT:
+                if checkpoint is not None:
+                    checkpoint()
                 __parse_webtoon_block(image, start_of_box, width, y, split_images, is_black_background)
                 last_black_line = None
                 start_of_box = None
@@ -924,12 +987,52 @@ def guess_manga_or_webtoon_image(source):
 
 def _load_image(source):
     # type: (str) -> Image
+    member = split_member_path(source)
     try:
-        return Image.open(source)
+        if member is None:
+            return Image.open(source)
+        with open_source(source) as f:  # page of an archive: only this member in memory, never extracted
+            return Image.open(io.BytesIO(f.read()))
     except IOError:
         raise RuntimeError('Cannot read image file %s' % source)
 
 
+# The reduced decode must stay over the device size after the auto crop removed the borders
+REDUCED_DECODE_MARGIN = 1.25
+
+
+# Minimal size the source must keep so the final page is still downscaled to the device size
+def _get_reduced_decode_min_size(image_size, device_size, is_split):
+    # type: (tuple[int, int], tuple[int, int], bool) -> tuple[int, int]
+    width_img, height_img = image_size
+    page_width = width_img // 2 if is_split else width_img
+    width_dev, height_dev = device_size
+    # the page will be rotated if not in the device orientation
+    if (page_width > height_img) != (width_dev > height_dev):
+        width_dev, height_dev = height_dev, width_dev
+    width_min = int(ceil(width_dev * REDUCED_DECODE_MARGIN)) * (2 if is_split else 1)
+    height_min = int(ceil(height_dev * REDUCED_DECODE_MARGIN))
+    return width_min, height_min
+
+
+# Scans are often far bigger than the device, so all the analysis (crop, grey detection...) can be done
+# on a smaller image: JPEG are directly decoded at 1/2, 1/4 or 1/8 scale, others are reduced after decoding
+def _load_reduced_image(source, device_size, is_split):
+    # type: (str, tuple[int, int], bool) -> Image
+    image = _load_image(source)
+    min_size = _get_reduced_decode_min_size(image.size, device_size, is_split)
+    if image.format == 'JPEG':
+        image.draft(None, min_size)  # never under the asked size
+        image.load()
+        return image
+    
+    image.load()
+    factor = min(image.size[0] // min_size[0], image.size[1] // min_size[1])
+    if factor >= 2 and image.mode in ('L', 'RGB', 'RGBA'):
+        image = image.reduce(factor)
+    return image
+
+
 def save_image(image, target):
     # type: (Image, str) -> None
     try:
@@ -938,6 +1041,13 @@ def save_image(image, target):
         raise RuntimeError('Cannot write image file %s' % target)
 
 
+# Same as save_image but in memory, so the archive can directly get the page. The encoder is the profile one
+def encode_image(image, profile=None):
+    # type: (Image, DeviceProfile|None) -> bytes
+    encoder = profile.get_encoder() if profile is not None else _default_encoder
+    return encoder.encode(image)
+
+
 # Look if the image is more width than height, if not, means it's should not be split (like the front page of a manga,
 # when all the inner pages are double)
 def is_splitable(source):
@@ -950,57 +1060,230 @@ def is_splitable(source):
         raise RuntimeError('Cannot read image file %s' % source)
 
 
-def convert_image(source, split_right=False, split_left=False):
-    # type: (str,  bool, bool) -> list[Image]
+# NOTE: settings are given by the worker processes, else it's the current parameters
+def convert_image(source, split_right=False, split_left=False, settings=None, checkpoint=None):
+    # type: (str,  bool, bool, ConversionSettings|None, callable|None) -> list[Image]
     
-    device = parameters.get_device()
+    if settings is None:
+        settings = parameters.get_conversion_settings()
+    device = settings.device
     try:
-        size = EReaderData.get_size(device)
-        palette = EReaderData.get_palette(device)
+        profile = EReaderData.get_profile(device)
     except KeyError:
         raise RuntimeError('Unexpected output device %s' % device)
+    size = profile.get_size()
     
     # Load image from source path
-    image = _load_image(source)
+    with profiler.stage('load'):
+        if settings.is_reduced_decode and not settings.is_webtoon:  # webtoon split needs the real pixels
+            image = _load_reduced_image(source, size, split_left or split_right)
+        else:
+            image = _load_image(source)
+            image.load()  # PIL is lazy, force the decoding so it's counted here
     
     # Webtoon is special, manually take order
-    if parameters.is_webtoon():
+    if settings.is_webtoon:
         converted_images = []  # we can have more than 1 results
-        images = _split_webtoon(image)
+        with profiler.stage('webtoon-split'):
+            images = _split_webtoon(image, checkpoint=checkpoint)
         for image in images:
-            image = _format_image_to_rgb(image)
-            image = _apply_basic_grey(image)
-            image = _resize_image(image, size)
-            image = _fill_image_to_whole_size(image, size)  # note: after gray pass (adding white pixel here)
+            if checkpoint is not None:
+                checkpoint()
+            with profiler.stage('rgb'):
+                image = _format_image_to_rgb(image)
+            with profiler.stage('quantize'):
+                image = _apply_basic_grey(image)
+            with profiler.stage('resize'):
+                image = _resize_image(image, size)
+            with profiler.stage('fill'):
+                image = _fill_image_to_whole_size(image, size)  # note: after gray pass (adding white pixel here)
             converted_images.append(image)
         
         return converted_images
     
-    image = _format_image_to_rgb(image)
+    with profiler.stage('rgb'):
+        image = _format_image_mode(image)
     
     # Apply splits:
-    if split_right:  # flags & ImageFlags.SplitRight:
-        image = _split_right(image)
-    if split_left:
-        # if flags & ImageFlags.SplitRightLeft:
-        image = _split_left(image)
+    with profiler.stage('split'):
+        if split_right:  # flags & ImageFlags.SplitRight:
+            image = _split_right(image)
+        if split_left:
+            # if flags & ImageFlags.SplitRightLeft:
+            image = _split_left(image)
     
     # Auto crop (remove useless white) the image, but before manage size and co, clean the source so
-    image = _auto_crop_image(image)
+    with profiler.stage('crop'):
+        image = _auto_crop_image(image)
     # Always Orient based the size: if too large, go paysage
-    image = _orient_image(image, size)
+    with profiler.stage('orient'):
+        image = _orient_image(image, size)
     
     # Grey :
     #  * MANGA: if the image is mostly grey, we can apply a grey palette
     #  * COMICS/WEBTOONS: but if it was with colors, then the pillow got a better result (but FAR bigger, so not ok for manga)
     # Adapt to EReader palette
-    if _is_image_grey(image):
-        image = _apply_grey_palette(image, palette)  # palette are ok for manga black and white, and very small
-    else:
-        image = _apply_basic_grey(image)  # pillow is better for colors, but is very FAT
-        
+    with profiler.stage('grey-detect'):
+        is_grey = _is_image_grey(image)
+    with profiler.stage('quantize'):
+        if is_grey:
+            image = _apply_grey_palette(image, profile.get_palette(), lut=profile.get_palette_lut())  # palette are ok for manga black and white, and very small
+        else:
+            image = _apply_basic_grey(image)  # pillow is better for colors, but is very FAT
+    
     # Adapt to the EReader native resolution
-    image = _resize_image(image, size)
-    image = _fill_image_to_whole_size(image, size)  # note: after gray pass (adding white pixel here)
+    with profiler.stage('resize'):
+        image = _resize_image(image, size)
+    with profiler.stage('fill'):
+        image = _fill_image_to_whole_size(image, size)  # note: after gray pass (adding white pixel here)
     
     return [image]  # only one image if not webtoon
+
+
+# Pages that are already what the pipeline would give (a re-export of a converted series) are copied as they
+# are in the archive, without decode/encode. Only the header is read:
+#  * the profile encoder format: only PNG, we cannot know if a JPEG page has the profile quality
+#  * same size as the device (so same orientation)
+#  * written by the pipeline for this device (PAGE_DEVICE_KEY text chunk): the auto crop is not giving the
+#    same box twice on the same page, so the pixels cannot tell if the page was already cropped
+PASSTHROUGH_FORMATS = {'png': 'PNG'}  # encoder name -> Pillow format
+PASSTHROUGH_MODES = ('L', 'P', 'RGB')
+
+
+def _is_device_page(image, profile):
+    # type: (Image, DeviceProfile) -> bool
+    return (image.format == PASSTHROUGH_FORMATS.get(profile.get_encoder().name) and image.size == profile.get_size()
+            and image.info.get(PAGE_DEVICE_KEY) == profile.get_name())
+
+
+# Same for the transcode, where the greys are checked instead (the page can be from another device)
+def _is_conforming_header(image, profile):
+    # type: (Image, DeviceProfile) -> bool
+    return (image.format == PASSTHROUGH_FORMATS.get(profile.get_encoder().name) and image.mode in PASSTHROUGH_MODES
+            and image.size == profile.get_size() and 'transparency' not in image.info)
+
+
+# => the page as a L image if it has only greys of the device palette, else None (the grey pass would change it)
+def _get_device_grey_image(image, profile):
+    # type: (Image, DeviceProfile) -> Image|None
+    if image.mode == 'P':
+        palette = image.getpalette()
+        for _, index in image.getcolors(256):
+            red, green, blue = palette[3 * index:3 * index + 3]
+            if not (red == green == blue):
+                return None
+        image = image.convert('L')
+    elif image.mode == 'RGB':
+        red, green, blue = image.split()
+        if ImageChops.difference(red, green).getbbox() is not None or ImageChops.difference(red, blue).getbbox() is not None:
+            return None
+        image = red
+    device_greys = set(profile.get_palette()[::3])
+    if any(grey not in device_greys for (_, grey) in image.getcolors(256)):
+        return None
+    return image
+
+
+# => the source data if it can be copied as it is, else None. The pixels are never decoded
+def _get_passthrough_data(source, profile):
+    # type: (str, DeviceProfile) -> bytes|None
+    try:
+        with open_source(source) as f:
+            data = f.read()
+        image = Image.open(io.BytesIO(data))
+    except (IOError, RuntimeError):  # the conversion will give the real error
+        return None
+    if not _is_device_page(image, profile):
+        return None
+    return data
+
+
+def _get_settings_profile(settings):
+    # type: (ConversionSettings) -> DeviceProfile
+    try:
+        return EReaderData.get_profile(settings.device)
+    except KeyError:
+        raise RuntimeError('Unexpected output device %s' % settings.device)
+
+
+# (split right, split left) of each page given by the source
+def _get_source_splits(source, split_right_then_left, split_left_then_right):
+    # type: (str, bool, bool) -> list[tuple[bool, bool]]
+    # Asked for split: maybe we cannot (simple page, like the front page, on a split manga)
+    if (split_right_then_left or split_left_then_right) and is_splitable(source):
+        if split_right_then_left:
+            return [(True, False), (False, True)]
+        return [(False, True), (True, False)]  # just the other order
+    return [(False, False)]
+
+
+# A source file => its encoded pages, in the reading order. It's the unit of work of the worker processes.
+def convert_source(source, settings, split_right_then_left=False, split_left_then_right=False, checkpoint=None):
+    # type: (str, ConversionSettings, bool, bool, callable|None) -> list[bytes]
+    profile = _get_settings_profile(settings)
+    # a size budget can give another encoder than the profile one, then the source pages are not conforming
+    encoder = settings.encoder if settings.encoder is not None else profile.get_encoder()
+    page_device = settings.device if settings.encoder is None else ''  # only the profile pages can be copied later
+    if not settings.is_webtoon and settings.encoder is None:  # webtoon pages are always split again in blocks
+        with profiler.stage('passthrough'):
+            data = _get_passthrough_data(source, profile)
+        if data is not None:
+            logger.debug('convert %s => already conforming to %s, copied as it is', source, settings.device)
+            return [data]
+    
+    datas = []
+    for split_right, split_left in _get_source_splits(source, split_right_then_left, split_left_then_right):
+        converted_images = convert_image(source, split_right=split_right, split_left=split_left, settings=settings, checkpoint=checkpoint)
+        logger.debug('convert %s (split right=%s, split left=%s) => %s page(s)', source, split_right, split_left, len(converted_images))
+        for converted_image in converted_images:
+            try:
+                with profiler.stage('encode'):
+                    datas.append(encoder.encode(converted_image, device=page_device))
+            except RuntimeError:
+                logger.exception('Cannot encode a page of %s', source)
+                break
+    return datas
+
+
+# A source file => the size of its pages with each encoder. The source is converted only once, so a sample
+# of the sources can be measured with a lot of encoders (size budget)
+def measure_source(source, settings, encoders, split_right_then_left=False, split_left_then_right=False):
+    # type: (str, ConversionSettings, list[Encoder], bool, bool) -> list[int]
+    sizes = [0] * len(encoders)
+    for split_right, split_left in _get_source_splits(source, split_right_then_left, split_left_then_right):
+        for converted_image in convert_image(source, split_right=split_right, split_left=split_left, settings=settings):
+            with profiler.stage('measure'):
+                for idx, encoder in enumerate(encoders):
+                    sizes[idx] += get_encoded_size(converted_image, encoder)
+    return sizes
+
+
+# A page of an already converted book, for another device (transcode): copied as it is when it has the device
+# size, format and greys (like the conforming sources, without the crop check: the page is already cropped), else
+# only the last stages of the pipeline are done again (the page is already split and cropped)
+def fit_page(data, profile):
+    # type: (bytes, DeviceProfile) -> bytes
+    try:
+        image = Image.open(io.BytesIO(data))
+    except IOError:
+        raise RuntimeError('Cannot read page data')
+    size = profile.get_size()
+    with profiler.stage('load'):
+        image.load()
+    if _is_conforming_header(image, profile) and _get_device_grey_image(image, profile) is not None:
+        return data
+    with profiler.stage('rgb'):
+        image = _format_image_mode(image)
+    with profiler.stage('orient'):
+        image = _orient_image(image, size)
+    with profiler.stage('quantize'):
+        if _is_image_grey(image):
+            image = _apply_grey_palette(image, profile.get_palette(), lut=profile.get_palette_lut())
+        else:
+            image = _apply_basic_grey(image)
+    with profiler.stage('resize'):
+        image = _resize_image(image, size)
+    with profiler.stage('fill'):
+        image = _fill_image_to_whole_size(image, size)
+    with profiler.stage('encode'):
+        return profile.get_encoder().encode(image, device=profile.get_name())
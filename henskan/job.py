@@ -0,0 +1,293 @@
+# Copyright 2020+     Gabès Jean (naparuba@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import itertools
+import threading
+import time
+from enum import Enum
+
+from .encoders import Encoder
+from .parameters import Parameters, ConversionSettings
+from .volume import VOLUME_SPLIT_MODES
+
+
+class JOB_STATES(Enum):
+    QUEUED = 'QUEUED'
+    RUNNING = 'RUNNING'
+    PAUSED = 'PAUSED'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+    CANCELLED = 'CANCELLED'
+
+
+_job_ids = itertools.count(1)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# A conversion asked by the user: a copy of the parameters at the time it was queued, so the user can
+# prepare the next one while this one is running, and its progress
+class ConversionJob(object):
+    def __init__(self, title, output_directory, settings, chapters, images_by_chapter,
+                 split_right_then_left=False, split_left_then_right=False,
+                 volume_split_mode=VOLUME_SPLIT_MODES.NONE, volume_max_images=0, volume_max_bytes=0, size_budget_bytes=0):
+        # type: (str, str, ConversionSettings, list[str], dict[str, list[str]], bool, bool, VOLUME_SPLIT_MODES, int, int, int) -> None
+        self._id = next(_job_ids)
+        self._title = title
+        self._output_directory = output_directory
+        self._settings = settings
+        self._chapters = list(chapters)
+        self._images_by_chapter = {chapter: list(images) for (chapter, images) in images_by_chapter.items()}
+        self._split_right_then_left = split_right_then_left
+        self._split_left_then_right = split_left_then_right
+        self._volume_split_mode = volume_split_mode
+        self._volume_max_images = volume_max_images
+        self._volume_max_bytes = volume_max_bytes
+        self._size_budget_bytes = size_budget_bytes
+        self._predicted_size = 0  # of the biggest volume, by the size budget
+        
+        self._state = JOB_STATES.QUEUED
+        self._nb_done_images = 0
+        self._progress_text = ''
+        self._error = ''
+        self._start = 0.0
+        self._end = 0.0
+        
+        # cancel & pause are only asked here, the conversion is looking at them at its checkpoints
+        self._cancel_event = threading.Event()
+        self._resume_event = threading.Event()
+        self._resume_event.set()
+    
+    
+    @classmethod
+    def from_parameters(cls, params):
+        # type: (Parameters) -> ConversionJob
+        return cls(params.get_title(), params.get_output_directory(), params.get_conversion_settings(),
+                   params.get_chapters(), params.get_images_by_chapter(),
+                   split_right_then_left=params.is_split_right_then_left(), split_left_then_right=params.is_split_left_then_right(),
+                   volume_split_mode=params.get_volume_split_mode(), volume_max_images=params.get_volume_max_images(),
+                   volume_max_bytes=params.get_volume_max_bytes(), size_budget_bytes=params.get_size_budget_bytes())
+    
+    
+    def __repr__(self):
+        return f'ConversionJob(id={self._id}, title={self._title!r}, state={self._state.value})'
+    
+    
+    def get_id(self):
+        # type: () -> int
+        return self._id
+    
+    
+    def get_title(self):
+        # type: () -> str
+        return self._title
+    
+    
+    def get_output_directory(self):
+        # type: () -> str
+        return self._output_directory
+    
+    
+    def get_settings(self):
+        # type: () -> ConversionSettings
+        return self._settings
+    
+    
+    def get_device(self):
+        # type: () -> str
+        return self._settings.device
+    
+    
+    def is_webtoon(self):
+        # type: () -> bool
+        return self._settings.is_webtoon
+    
+    
+    def get_chapters(self):
+        # type: () -> list[str]
+        return self._chapters
+    
+    
+    def get_images_by_chapter(self):
+        # type: () -> dict[str, list[str]]
+        return self._images_by_chapter
+    
+    
+    def get_nb_images(self):
+        # type: () -> int
+        return sum(len(self._images_by_chapter.get(chapter, [])) for chapter in self._chapters)
+    
+    
+    def is_split_right_then_left(self):
+        # type: () -> bool
+        return self._split_right_then_left
+    
+    
+    def is_split_left_then_right(self):
+        # type: () -> bool
+        return self._split_left_then_right
+    
+    
+    def get_volume_split_mode(self):
+        # type: () -> VOLUME_SPLIT_MODES
+        return self._volume_split_mode
+    
+    
+    def get_volume_max_images(self):
+        # type: () -> int
+        return self._volume_max_images
+    
+    
+    def get_volume_max_bytes(self):
+        # type: () -> int
+        return self._volume_max_bytes
+    
+    
+    def get_size_budget_bytes(self):
+        # type: () -> int
+        return self._size_budget_bytes
+    
+    
+    # The size budget did choose the encoder of all the pages, set before the conversion of the pages
+    def set_budget_encoder(self, encoder, predicted_size):
+        # type: (Encoder, int) -> None
+        settings = self._settings
+        self._settings = ConversionSettings(settings.device, settings.is_webtoon, settings.is_reduced_decode, encoder=encoder)
+        self._predicted_size = predicted_size
+    
+    
+    def get_predicted_size(self):
+        # type: () -> int
+        return self._predicted_size
+    
+    
+    def get_state(self):
+        # type: () -> JOB_STATES
+        return self._state
+    
+    
+    def is_finished(self):
+        # type: () -> bool
+        return self._state in (JOB_STATES.DONE, JOB_STATES.FAILED, JOB_STATES.CANCELLED)
+    
+    
+    def set_running(self):
+        # type: () -> None
+        self._state = JOB_STATES.PAUSED if self.is_paused() else JOB_STATES.RUNNING
+        self._start = time.time()
+    
+    
+    def cancel(self):
+        # type: () -> None
+        if self.is_finished():
+            return
+        self._cancel_event.set()
+        self._resume_event.set()  # a paused job must wake up to see it's cancelled
+        if self._state == JOB_STATES.QUEUED:  # nothing to stop, the service will skip it
+            self.set_cancelled()
+    
+    
+    def is_cancel_requested(self):
+        # type: () -> bool
+        return self._cancel_event.is_set()
+    
+    
+    def set_cancelled(self):
+        # type: () -> None
+        self._state = JOB_STATES.CANCELLED
+        self._end = time.time()
+    
+    
+    # A queued job can be paused too, it will wait at its first page
+    def pause(self):
+        # type: () -> None
+        if self.is_finished() or self.is_cancel_requested():
+            return
+        self._resume_event.clear()
+        if self._state == JOB_STATES.RUNNING:
+            self._state = JOB_STATES.PAUSED
+    
+    
+    def resume(self):
+        # type: () -> None
+        self._resume_event.set()
+        if self._state == JOB_STATES.PAUSED:
+            self._state = JOB_STATES.RUNNING
+    
+    
+    def is_paused(self):
+        # type: () -> bool
+        return not self._resume_event.is_set()
+    
+    
+    # Called between pages (and in long sources): wait while paused, and stop here if cancelled
+    def checkpoint(self):
+        # type: () -> None
+        self._resume_event.wait()
+        if self._cancel_event.is_set():
+            raise JobCancelled(f'{self._title} was cancelled')
+    
+    
+    def set_done(self):
+        # type: () -> None
+        self._state = JOB_STATES.DONE
+        self._end = time.time()
+    
+    
+    def set_failed(self, error):
+        # type: (str) -> None
+        self._state = JOB_STATES.FAILED
+        self._error = error
+        self._end = time.time()
+    
+    
+    def get_error(self):
+        # type: () -> str
+        return self._error
+    
+    
+    def get_elapsed(self):
+        # type: () -> float
+        if self._start == 0.0:
+            return 0.0
+        return (self._end or time.time()) - self._start
+    
+    
+    def update_progress(self, nb_done_images, text):
+        # type: (int, str) -> None
+        self._nb_done_images = nb_done_images
+        self._progress_text = text
+    
+    
+    def get_nb_done_images(self):
+        # type: () -> int
+        return self._nb_done_images
+    
+    
+    def get_progress_pct(self):
+        # type: () -> int
+        if self._state == JOB_STATES.DONE:
+            return 100
+        nb_images = self.get_nb_images()
+        if nb_images == 0:
+            return 0
+        return min(100, int(100 * self._nb_done_images / nb_images))
+    
+    
+    def get_progress_text(self):
+        # type: () -> str
+        return self._progress_text
@@ -0,0 +1,132 @@
+# Copyright 2020+     Gabès Jean (naparuba@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import logging
+import os
+import sys
+import threading
+
+# Force the console level, like HENSKAN_LOG_LEVEL=DEBUG
+LOG_LEVEL_ENV = 'HENSKAN_LOG_LEVEL'
+
+DEFAULT_LEVEL = logging.INFO
+BATCH_LEVEL = logging.WARNING  # batch runs are quiet, only problems are shown
+
+# Recent detailed events, only shown when an error is logged
+RING_BUFFER_SIZE = 2000
+
+LOG_FORMAT = '%(asctime)s %(levelname)-7s [%(name)s] %(message)s'
+
+ROOT_LOGGER_NAME = 'henskan'
+
+
+# Keep the last records (not formatted, so it costs nearly nothing) and dump them when an error occurs, so
+# we have the context of the error without flooding the console all the time
+class RingBufferHandler(logging.Handler):
+    def __init__(self, capacity, stream=None):
+        # type: (int, object) -> None
+        super().__init__(logging.DEBUG)
+        self._records = collections.deque(maxlen=capacity)
+        self._stream = stream
+        self._dump_lock = threading.Lock()
+        self.dump_level = logging.ERROR
+        self.already_displayed_level = DEFAULT_LEVEL  # records at this level are already on the console
+    
+    
+    def emit(self, record):
+        # type: (logging.LogRecord) -> None
+        if record.levelno >= self.dump_level:
+            self.dump()
+            return
+        self._records.append(record)
+    
+    
+    def dump(self):
+        # type: () -> None
+        with self._dump_lock:
+            records = [record for record in self._records if record.levelno < self.already_displayed_level]
+            self._records.clear()
+            if not records:
+                return
+            stream = self._stream or sys.stderr
+            try:
+                stream.write(f'---- {len(records)} recent event(s) before the error ----\n')
+                for record in records:
+                    stream.write(self.format(record) + '\n')
+                stream.write('---- end of recent events ----\n')
+                stream.flush()
+            except Exception:
+                self.handleError(records[-1])
+    
+    
+    def get_records(self):
+        # type: () -> list[logging.LogRecord]
+        return list(self._records)
+
+
+def _get_level_from_env():
+    # type: () -> int|None
+    level_name = os.environ.get(LOG_LEVEL_ENV, '').strip().upper()
+    if not level_name:
+        return None
+    level = logging.getLevelName(level_name)
+    if isinstance(level, int):
+        return level
+    return None
+
+
+_root_logger = logging.getLogger(ROOT_LOGGER_NAME)
+_root_logger.setLevel(logging.DEBUG)  # the ring buffer wants everything, the console handler is filtering
+_root_logger.propagate = False
+
+ring_buffer = RingBufferHandler(RING_BUFFER_SIZE)
+ring_buffer.setFormatter(logging.Formatter(LOG_FORMAT))
+_root_logger.addHandler(ring_buffer)  # before the console, so the context is displayed before the error
+
+_console_handler = logging.StreamHandler()
+_console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+_root_logger.addHandler(_console_handler)
+
+
+def set_level(level):
+    # type: (int) -> None
+    _console_handler.setLevel(level)
+    ring_buffer.already_displayed_level = level
+
+
+def set_batch_mode(is_batch):
+    # type: (bool) -> None
+    # the environment always wins, it's the way to debug a batch run
+    env_level = _get_level_from_env()
+    if env_level is not None:
+        set_level(env_level)
+        return
+    set_level(BATCH_LEVEL if is_batch else DEFAULT_LEVEL)
+
+
+def get_logger(name):
+    # type: (str) -> logging.Logger
+    if name != ROOT_LOGGER_NAME and not name.startswith(ROOT_LOGGER_NAME + '.'):
+        name = f'{ROOT_LOGGER_NAME}.{name}'
+    return logging.getLogger(name)
+
+
+def dump_recent_events():
+    # type: () -> None
+    ring_buffer.dump()
+
+
+set_batch_mode(False)
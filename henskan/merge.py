@@ -0,0 +1,83 @@
+# Copyright 2020+     Gabès Jean (naparuba@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Merge CBZ archives (like the volumes by chapter) into one omnibus, without converting the pages again:
+#   python -m henskan.merge "One Piece 1-3.cbz" "One Piece 1.cbz" "One Piece 2.cbz" "One Piece 3.cbz"
+
+import argparse
+import os
+import time
+import zipfile
+
+from .archive_cbz import ArchiveCBZ, read_comic_info, read_raw_member
+from .log import get_logger
+from .source import get_file_extension, list_zip_image_names
+
+logger = get_logger(__name__)
+
+
+# The pages are copied as they are compressed in the archives (no decode, no recompress), and renumbered after
+# the pages of the previous archives. Each archive keeps its bookmarks, or is a chapter with its file name.
+# => path of the written book (the .cbz extension is added if missing)
+def merge_cbz(input_paths, output_path, title=''):
+    # type: (list[str], str, str) -> str
+    book_path = output_path[:-len('.cbz')] if output_path.lower().endswith('.cbz') else output_path
+    if any(os.path.abspath(input_path) == os.path.abspath(book_path + '.cbz') for input_path in input_paths):
+        raise ValueError(f'Cannot merge {book_path}.cbz into itself')
+    t0 = time.time()
+    archive = ArchiveCBZ(book_path, title or os.path.basename(book_path))
+    page_number = 0
+    try:
+        for input_path in input_paths:
+            try:
+                zip_file = zipfile.ZipFile(input_path)
+            except (OSError, zipfile.BadZipFile) as exp:
+                raise RuntimeError(f'Cannot read archive {input_path}: {exp}')
+            with zip_file:
+                image_names = list_zip_image_names(zip_file)
+                if not image_names:
+                    logger.warning('No image in %s, it is skipped', input_path)
+                    continue
+                _, bookmarks = read_comic_info(zip_file)
+                if not bookmarks:
+                    bookmarks = [(0, os.path.splitext(os.path.basename(input_path))[0])]
+                for image_index, chapter_title in bookmarks:
+                    archive.add_chapter(chapter_title, page_number + image_index)
+                for image_name in image_names:
+                    zinfo = zip_file.getinfo(image_name)
+                    arcname = '%05d%s' % (page_number, get_file_extension(image_name))
+                    archive.add_raw_page(page_number, arcname, zinfo, read_raw_member(zip_file, zinfo))
+                    page_number += 1
+            logger.debug('Merged %s: %s pages', input_path, len(image_names))
+    except BaseException:
+        archive.abort()
+        raise
+    archive.close()
+    logger.info('Merged %s archives (%s pages) into %s.cbz in %.3fs', len(input_paths), page_number, book_path, time.time() - t0)
+    return book_path + '.cbz'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge CBZ archives into one, without converting the pages again')
+    parser.add_argument('output', help='the merged CBZ file')
+    parser.add_argument('inputs', nargs='+', help='the CBZ files, in the reading order')
+    parser.add_argument('--title', default='', help='title of the merged book (default: the output file name)')
+    args = parser.parse_args()
+    
+    print(merge_cbz(args.inputs, args.output, title=args.title))
+
+
+if __name__ == '__main__':
+    main()
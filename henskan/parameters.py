@@ -16,10 +16,13 @@
 
 import json
 import os
-import time
 from pathlib import Path
 
+from .log import get_logger
 from .util import natural_key
+from .volume import VOLUME_SPLIT_MODES
+
+logger = get_logger(__name__)
 
 if os.name == 'nt':
     BASE_HENSKAN_DIR = os.path.join(str(Path.home()), 'Documents', 'henskan')
@@ -43,9 +46,45 @@ DELETED = os.path.join(BASE_HENSKAN_DIR, 'deleted_images')
 if not os.path.exists(DELETED):
     os.mkdir(DELETED)
 
+# Stats of the last run of the application, by stage, erased at each run
+LAST_RUN_PROFILE_PATH = os.path.join(BASE_HENSKAN_DIR, 'last_run_profile.json')
+
+
+# What a page conversion needs to know, so it can be done outside of the parameters singleton (like in a worker
+# process). Must stay picklable.
+class ConversionSettings(object):
+    def __init__(self, device, is_webtoon, is_reduced_decode, encoder=None):
+        # type: (str, bool, bool, object) -> None
+        self.device = device
+        self.is_webtoon = is_webtoon
+        self.is_reduced_decode = is_reduced_decode
+        self.encoder = encoder  # None: the profile one, else set by the size budget
+    
+    
+    def __repr__(self):
+        return (f'ConversionSettings(device={self.device!r}, is_webtoon={self.is_webtoon}, is_reduced_decode={self.is_reduced_decode}, '
+                f'encoder={self.encoder!r})')
+
+
+# The choices of the volume_split_combo_box, in its order: (label, mode, max source images, max bytes)
+VOLUME_SPLIT_PRESETS = [
+    ('One single file', VOLUME_SPLIT_MODES.NONE, 0, 0),
+    ('One file by chapter', VOLUME_SPLIT_MODES.CHAPTERS, 0, 0),
+    ('Split every 500 source images', VOLUME_SPLIT_MODES.IMAGES, 500, 0),
+    ('Split every 200 MB', VOLUME_SPLIT_MODES.SIZE, 0, 200 * 1024 * 1024),
+]
+
+# The choices of the size_budget_combo_box, in its order: (label, max bytes by output file), 0 = no budget
+SIZE_BUDGET_PRESETS = [
+    ('No size limit', 0),
+    ('Max 50 MB by file', 50 * 1024 * 1024),
+    ('Max 100 MB by file', 100 * 1024 * 1024),
+    ('Max 200 MB by file', 200 * 1024 * 1024),
+]
+
 
 class Parameters(object):
-    DefaultDevice = 'Kobo Libra H2O'
+    DefaultDevice = 'Kobo Libra H2O'  # because it's mine ^^
     DefaultTitle = 'Untitled'
     
     _chapters: list[str]
@@ -60,9 +99,19 @@ class Parameters(object):
     
     _is_webtoon: bool
     
+    _is_reduced_decode: bool
+    
     _split_right_then_left = False
     _split_left_then_right = False
     
+    _volume_split_mode: VOLUME_SPLIT_MODES
+    _volume_split_index: int
+    _volume_max_images: int
+    _volume_max_bytes: int
+    
+    _size_budget_index: int
+    _size_budget_bytes: int
+    
     _output_directory: str
     _default_document_directory: str
     
@@ -72,20 +121,37 @@ class Parameters(object):
     
     
     def clean(self):
+        self.clean_series()
+        
+        self._device = self.DefaultDevice
+        self._device_index = -1  # found by the device name in the registry, when asked
+        
+        self._is_reduced_decode = True
+        
+        self._volume_split_mode = VOLUME_SPLIT_MODES.NONE
+        self._volume_split_index = 0
+        self._volume_max_images = 0
+        self._volume_max_bytes = 0
+        
+        self._size_budget_index = 0
+        self._size_budget_bytes = 0
+        
+        self._default_document_directory = BASE_HENSKAN_DIR
+        self._output_directory = self._default_document_directory  # value used only at first launch, or if saved directory is missing
+    
+    
+    # Once a series is queued, the next one is prepared from scratch, but with the same device, output
+    # directory and volume split, they are rarely changed between series
+    def clean_series(self):
         self._images = []
         self._chapters = []
         self._images_by_chapter = {}
         
         self._title = self.DefaultTitle
-        self._device = self.DefaultDevice
-        self._device_index = 12
         
-        self._split_left_then_right = False
+        self._split_right_then_left = False
         self._split_left_then_right = False
         self._is_webtoon = False
-        
-        self._default_document_directory = BASE_HENSKAN_DIR
-        self._output_directory = self._default_document_directory  # value used only at first launch, or if saved directory is missing
     
     
     def __get_previous_parameter_path(self):
@@ -104,31 +170,45 @@ class Parameters(object):
                     # Accept only if the directory still exists
                     if output_directory and os.path.exists(output_directory) and os.path.isdir(output_directory):
                         self._output_directory = output_directory
-                        print(f'Loaded previous output directory: {output_directory}')
+                        logger.info('Loaded previous output directory: %s', output_directory)
                     device = data.get('device', None)
-                    device_index = data.get('device_index', None)
-                    if device and EReaderData.is_device_exists(device) and device_index is not None:
+                    if device and EReaderData.is_device_exists(device):
                         self._device = device
-                        self._device_index = device_index
-                        print(f'Loaded previous device: {device} {device_index}')
+                        # the index in the device list is from the registry, user profiles can change it
+                        self._device_index = EReaderData.get_devices().index(device)
+                        logger.info('Loaded previous device: %s %s', device, self._device_index)
+                    volume_split_mode = data.get('volume_split_mode', None)
+                    if volume_split_mode in VOLUME_SPLIT_MODES.__members__:
+                        self.set_volume_split(VOLUME_SPLIT_MODES[volume_split_mode], data.get('volume_split_index', 0),
+                                              max_images=data.get('volume_max_images', 0), max_bytes=data.get('volume_max_bytes', 0))
+                        logger.info('Loaded previous volume split: %s', volume_split_mode)
+                    size_budget_bytes = data.get('size_budget_bytes', 0)
+                    if isinstance(size_budget_bytes, int) and size_budget_bytes > 0:
+                        self.set_size_budget(size_budget_bytes, data.get('size_budget_index', 0))
+                        logger.info('Loaded previous size budget: %s bytes', size_budget_bytes)
         except Exception as exp:
-            print(f'Error in loading previous parameters: {exp}')
+            logger.warning('Error in loading previous parameters: %s', exp)
     
     
     def save_parameters(self):
         previous_parameter_path = self.__get_previous_parameter_path()
-        print(f'Saving parameters to {previous_parameter_path}')
         try:
             with open(previous_parameter_path, 'w') as f:
                 data = {
                     'output_directory': self._output_directory,
                     'device':           self._device,
                     'device_index':     self._device_index,
+                    'volume_split_mode':  self._volume_split_mode.value,
+                    'volume_split_index': self._volume_split_index,
+                    'volume_max_images':   self._volume_max_images,
+                    'volume_max_bytes':   self._volume_max_bytes,
+                    'size_budget_index':  self._size_budget_index,
+                    'size_budget_bytes':  self._size_budget_bytes,
                 }
                 json.dump(data, f)
-                print(f'Saved parameters to {previous_parameter_path}')
+                logger.info('Saved parameters to %s', previous_parameter_path)
         except Exception as exp:
-            print(f'Error in saving parameters: {exp}')
+            logger.warning('Error in saving parameters: %s', exp)
     
     
     def is_ready_for_convert(self):
@@ -163,12 +243,33 @@ class Parameters(object):
         self._is_webtoon = is_webtoon
     
     
+    # Decode big sources at a smaller scale (still over the device size), so the analysis is faster
+    def is_reduced_decode(self):
+        # type: () -> bool
+        return self._is_reduced_decode
+    
+    
+    def set_reduced_decode(self, b):
+        # type: (bool) -> None
+        self._is_reduced_decode = b
+    
+    
     def get_device(self):
         return self._device
     
     
+    def get_conversion_settings(self):
+        # type: () -> ConversionSettings
+        return ConversionSettings(self._device, self._is_webtoon, self._is_reduced_decode)
+    
+    
+    # Index in the device list, it's from the registry: user profiles can change it
     def get_device_index(self):
-        return self._device_index
+        # type: () -> int
+        from .image import EReaderData  # Avoid circular import
+        if self._device_index < 0 and EReaderData.is_device_exists(self._device):
+            self._device_index = EReaderData.get_devices().index(self._device)
+        return max(0, self._device_index)
     
     
     def set_device(self, device, index):
@@ -176,6 +277,52 @@ class Parameters(object):
         self._device_index = index
     
     
+    # Output can be split into several files (volumes), by chapters, number of source images or size
+    def set_volume_split(self, mode, index, max_images=0, max_bytes=0):
+        # type: (VOLUME_SPLIT_MODES, int, int, int) -> None
+        self._volume_split_mode = mode
+        self._volume_split_index = index
+        self._volume_max_images = max_images
+        self._volume_max_bytes = max_bytes
+    
+    
+    def get_volume_split_mode(self):
+        # type: () -> VOLUME_SPLIT_MODES
+        return self._volume_split_mode
+    
+    
+    def get_volume_split_index(self):
+        # type: () -> int
+        return self._volume_split_index
+    
+    
+    def get_volume_max_images(self):
+        # type: () -> int
+        return self._volume_max_images
+    
+    
+    def get_volume_max_bytes(self):
+        # type: () -> int
+        return self._volume_max_bytes
+    
+    
+    # Max size of each output file, the pages encoding is adapted to fit (0: no budget)
+    def set_size_budget(self, max_bytes, index):
+        # type: (int, int) -> None
+        self._size_budget_bytes = max_bytes
+        self._size_budget_index = index
+    
+    
+    def get_size_budget_bytes(self):
+        # type: () -> int
+        return self._size_budget_bytes
+    
+    
+    def get_size_budget_index(self):
+        # type: () -> int
+        return self._size_budget_index
+    
+    
     def is_split_left_then_right(self):
         return self._split_left_then_right
     
@@ -196,16 +343,15 @@ class Parameters(object):
     
     def add_image(self, image_path, chapter_name):
         # type: (str, str) -> None
-        t0 = time.time()
         self._images.append(image_path)
         if chapter_name not in self._images_by_chapter:
             self._images_by_chapter[chapter_name] = []
         self._images_by_chapter[chapter_name].append(image_path)
-        print(f'[{time.time() - t0:.3f}s] Parameters:: Added image: {image_path} (current size: {len(self._images)})')
+        logger.debug('Added image: %s (current size: %s)', image_path, len(self._images))
     
     
     def remove_images(self, images_to_delete):
-        print(f'Cleaning images : {images_to_delete=}')
+        logger.debug('Cleaning images: %s', images_to_delete)
         update = {}
         for chapter_name, images in self._images_by_chapter.items():
             nb_start = len(images)
@@ -213,7 +359,7 @@ class Parameters(object):
             update[chapter_name] = images
             nb_after_clean = len(images)
             if nb_start != nb_after_clean:
-                print(f'Cleaned {nb_start - nb_after_clean} images in chapter {chapter_name}')
+                logger.info('Cleaned %s images in chapter %s', nb_start - nb_after_clean, chapter_name)
         
         self._images_by_chapter.update(update)
     
@@ -221,7 +367,7 @@ class Parameters(object):
     def add_chapter(self, chapter):
         # type: (str) -> None
         self._chapters.append(chapter)
-        print(f'Parameters:: Added chapter: {chapter} (current size: {len(self._chapters)})')
+        logger.debug('Added chapter: %s (current size: %s)', chapter, len(self._chapters))
     
     
     def get_images(self):
@@ -245,15 +391,13 @@ class Parameters(object):
         
         sorted_images = sorted(set(self._images), key=natural_key)
         self._images = sorted_images
-        print(f'Parameters:: Sorted images: {self._images}')
+        
+        # Also sort chapters, a directory without images is not one
+        self._chapters = sorted({chapter for chapter in self._chapters if self._images_by_chapter.get(chapter)}, key=natural_key)
         
         # also sort in the chapters
         for chapter in self._chapters:
             self._images_by_chapter[chapter] = sorted(set(self._images_by_chapter[chapter]), key=natural_key)
-            print(f'Parameters:: Sorted images for chapter {chapter}: {self._images_by_chapter[chapter]}')
-
-        # Also sort chapters
-        self._chapters = sorted(set(self._chapters), key=natural_key)
-        print(f'Parameters:: Sorted chapters: {self._chapters}')
+        logger.debug('Sorted %s images in %s chapters', len(self._images), len(self._chapters))
 
 parameters = Parameters()
@@ -0,0 +1,270 @@
+# Copyright 2020+     Gabès Jean (naparuba@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Read back the PDF written by our PDFWriter (and only them: any other PDF is a source for the pipeline), to give
+# its pages and outlines to another archive without decoding the pages:
+#  * DCTDecode images are the JPEG pages as they were given
+#  * FlateDecode images with the PNG predictors are the IDAT data of the PNG pages, so the PNG is rebuilt around them
+# Only the objects offsets are read at open, the pages are read one by one.
+
+import collections.abc
+import io
+import re
+import struct
+import zlib
+
+from PIL import Image
+
+from .log import get_logger
+from .pdf_writer import PNG_SIGNATURE
+
+logger = get_logger(__name__)
+
+# Bytes read at the end of the file to find the xref offset
+TRAILER_SEARCH_SIZE = 1024
+
+# Bytes read at once when looking for the end of an object
+OBJECT_READ_SIZE = 4096
+
+# PDF color space => PNG color type
+COLOR_SPACE_PNG_TYPES = {
+    b'DeviceGray': 0,
+    b'DeviceRGB':  2,
+    b'Indexed':    3,
+}
+
+_OBJECT_HEADER = re.compile(rb'(\d+) 0 obj\n')
+_PDF_STRING = rb'(\((?:\\.|[^\\)])*\)|<[0-9A-Fa-f]*>)'
+_STRING_ESCAPES = {ord('n'): b'\n', ord('r'): b'\r', ord('t'): b'\t', ord('b'): b'\b', ord('f'): b'\f'}
+
+
+def _get_reference(dictionary, key):
+    # type: (bytes, bytes) -> int|None
+    match = re.search(rb'/%s (\d+) 0 R' % key, dictionary)
+    return int(match.group(1)) if match else None
+
+
+def _get_int(dictionary, key):
+    # type: (bytes, bytes) -> int|None
+    match = re.search(rb'/%s (\d+)' % key, dictionary)
+    return int(match.group(1)) if match else None
+
+
+def _decode_pdf_string(raw):
+    # type: (bytes) -> str
+    if raw.startswith(b'<'):
+        value = bytes.fromhex(raw[1:-1].decode('ascii'))
+    else:
+        value = bytearray()
+        pos = 1
+        while pos < len(raw) - 1:
+            char = raw[pos]
+            if char != ord('\\'):
+                value.append(char)
+                pos += 1
+                continue
+            escaped = raw[pos + 1]
+            octal = re.match(rb'[0-7]{1,3}', raw[pos + 1:pos + 4])
+            if octal:
+                value.append(int(octal.group(0), 8) & 0xFF)
+                pos += 1 + len(octal.group(0))
+                continue
+            value += _STRING_ESCAPES.get(escaped, bytes([escaped]))
+            pos += 2
+        value = bytes(value)
+    if value.startswith(b'\xfe\xff'):
+        return value[2:].decode('utf-16-be', errors='replace')
+    return value.decode('latin-1')
+
+
+def _get_string(dictionary, key):
+    # type: (bytes, bytes) -> str|None
+    match = re.search(rb'/%s %s' % (key, _PDF_STRING), dictionary)
+    return _decode_pdf_string(match.group(1)) if match else None
+
+
+def _png_chunk(chunk_type, data):
+    # type: (bytes, bytes) -> bytes
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+class PDFReader(object):
+    def __init__(self, path):
+        # type: (str) -> None
+        self._path = path
+        try:
+            self._file = open(path, 'rb')
+        except OSError as exp:
+            raise RuntimeError(f'Cannot read PDF {path}: {exp}')
+        try:
+            self._offsets, trailer = self._read_xref()
+            info = self._read_object(_get_reference(trailer, b'Info'))[0]
+            if _get_string(info, b'Producer') != 'Henskan':
+                raise ValueError('not produced by Henskan')
+            self._title = _get_string(info, b'Title') or ''
+            self._catalog = self._read_object(_get_reference(trailer, b'Root'))[0]
+            self._page_ids = self._read_page_ids(_get_reference(self._catalog, b'Pages'))
+        except (ValueError, TypeError, KeyError, IndexError, struct.error) as exp:
+            self._file.close()
+            raise RuntimeError(f'{path} is not a PDF written by Henskan ({exp}), it can only be converted as a source')
+        logger.debug('[PDF] file: %s open for reading, %s pages', path, len(self._page_ids))
+    
+    
+    def _read_xref(self):
+        # type: () -> tuple[dict[int, int], bytes]
+        self._file.seek(0, io.SEEK_END)
+        file_size = self._file.tell()
+        self._file.seek(max(0, file_size - TRAILER_SEARCH_SIZE))
+        end = self._file.read()
+        match = re.search(rb'startxref\n(\d+)\n%%EOF', end)
+        if match is None:
+            raise ValueError('no startxref')
+        self._file.seek(int(match.group(1)))
+        header = self._file.readline() + self._file.readline()
+        match = re.match(rb'xref\n0 (\d+)\n$', header)
+        if match is None:
+            raise ValueError('no xref table')
+        nb_objects = int(match.group(1))
+        entries = self._file.read(nb_objects * 20)
+        offsets = {}
+        for object_id in range(1, nb_objects):
+            entry = entries[object_id * 20:(object_id + 1) * 20]
+            if entry[17:18] == b'n':
+                offsets[object_id] = int(entry[:10])
+        trailer = self._file.read(TRAILER_SEARCH_SIZE)
+        if not trailer.startswith(b'trailer'):
+            raise ValueError('no trailer')
+        return offsets, trailer
+    
+    
+    # => (dictionary, stream or None)
+    def _read_object(self, object_id):
+        # type: (int|None) -> tuple[bytes, bytes|None]
+        if object_id is None:
+            raise ValueError('missing object reference')
+        self._file.seek(self._offsets[object_id])
+        content = self._file.read(OBJECT_READ_SIZE)
+        match = _OBJECT_HEADER.match(content)
+        if match is None or int(match.group(1)) != object_id:
+            raise ValueError(f'bad object {object_id}')
+        content = content[match.end():]
+        while b'\nendobj' not in content and b'>>\nstream\n' not in content:
+            chunk = self._file.read(OBJECT_READ_SIZE)
+            if not chunk:
+                raise ValueError(f'truncated object {object_id}')
+            content += chunk
+        stream_start = content.find(b'>>\nstream\n')
+        object_end = content.find(b'\nendobj')
+        if stream_start == -1 or (object_end != -1 and object_end < stream_start):
+            return content[:object_end], None
+        dictionary = content[:stream_start + 2]
+        length = _get_int(dictionary, b'Length')
+        stream = content[stream_start + len(b'>>\nstream\n'):]
+        if len(stream) < length:
+            stream += self._file.read(length - len(stream))
+        return dictionary, stream[:length]
+    
+    
+    # The page tree is only a few levels (PAGE_TREE_MAX_KIDS pages by node)
+    def _read_page_ids(self, node_id):
+        # type: (int) -> list[int]
+        dictionary = self._read_object(node_id)[0]
+        if re.search(rb'/Type /Page\b', dictionary):
+            return [node_id]
+        kids = re.search(rb'/Kids \[([^\]]*)\]', dictionary)
+        if kids is None:
+            raise ValueError(f'bad page tree node {node_id}')
+        page_ids = []
+        for kid_id in re.findall(rb'(\d+) 0 R', kids.group(1)):
+            page_ids.extend(self._read_page_ids(int(kid_id)))
+        return page_ids
+    
+    
+    def get_title(self):
+        # type: () -> str
+        return self._title
+    
+    
+    def get_nb_pages(self):
+        # type: () -> int
+        return len(self._page_ids)
+    
+    
+    # [(page index, title)], in the outlines order
+    def get_outlines(self):
+        # type: () -> list[tuple[int, str]]
+        outlines_id = _get_reference(self._catalog, b'Outlines')
+        if outlines_id is None:
+            return []
+        page_indexes = {page_id: page_index for (page_index, page_id) in enumerate(self._page_ids)}
+        outlines = []
+        item_id = _get_reference(self._read_object(outlines_id)[0], b'First')
+        while item_id is not None:
+            item = self._read_object(item_id)[0]
+            destination = re.search(rb'/Dest \[(\d+) 0 R', item)
+            title = _get_string(item, b'Title')
+            if destination is not None and title is not None and int(destination.group(1)) in page_indexes:
+                outlines.append((page_indexes[int(destination.group(1))], title))
+            item_id = _get_reference(item, b'Next')
+        return outlines
+    
+    
+    def _get_page_data(self, page_id):
+        # type: (int) -> bytes
+        page = self._read_object(page_id)[0]
+        image_id = re.search(rb'/XObject << /\w+ (\d+) 0 R', page)
+        if image_id is None:
+            raise ValueError(f'no image in page {page_id}')
+        dictionary, stream = self._read_object(int(image_id.group(1)))
+        image_filter = re.search(rb'/Filter /(\w+)', dictionary).group(1)
+        if image_filter == b'DCTDecode':
+            return stream
+        if image_filter != b'FlateDecode':
+            raise ValueError(f'unknown image filter {image_filter}')
+        width, height = _get_int(dictionary, b'Width'), _get_int(dictionary, b'Height')
+        bit_depth = _get_int(dictionary, b'BitsPerComponent')
+        color_space = re.search(rb'/ColorSpace (?:/(\w+)|\[/Indexed /(\w+) (\d+) <([0-9A-Fa-f]*)>\])', dictionary)
+        if b'/Predictor 15' not in dictionary:  # the decoded pages (webp...): raw pixels, no PNG to rebuild
+            mode = 'L' if color_space.group(1) == b'DeviceGray' else 'RGB'
+            image = Image.frombytes(mode, (width, height), zlib.decompress(stream))
+            with io.BytesIO() as buffer:
+                image.save(buffer, format='PNG')
+                return buffer.getvalue()
+        palette = b''
+        if color_space.group(1) is None:  # indexed
+            lookup = bytes.fromhex(color_space.group(4).decode('ascii'))
+            palette = bytes(grey for grey in lookup for _ in range(3)) if color_space.group(2) == b'DeviceGray' else lookup
+            color_type = COLOR_SPACE_PNG_TYPES[b'Indexed']
+        else:
+            color_type = COLOR_SPACE_PNG_TYPES[color_space.group(1)]
+        header = struct.pack('>IIBBBBB', width, height, bit_depth, color_type, 0, 0, 0)
+        png = PNG_SIGNATURE + _png_chunk(b'IHDR', header)
+        if palette:
+            png += _png_chunk(b'PLTE', palette)
+        return png + _png_chunk(b'IDAT', stream) + _png_chunk(b'IEND', b'')
+    
+    
+    # The page data (PNG or JPEG), in the pages order
+    def iter_pages(self):
+        # type: () -> collections.abc.Iterator[bytes]
+        for page_index, page_id in enumerate(self._page_ids):
+            try:
+                yield self._get_page_data(page_id)
+            except (ValueError, TypeError, AttributeError, KeyError, zlib.error) as exp:
+                raise RuntimeError(f'Cannot read the page {page_index + 1} of {self._path}: {exp}')
+    
+    
+    def close(self):
+        self._file.close()
@@ -0,0 +1,363 @@
+# Copyright 2020+     Gabès Jean (naparuba@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Minimal PDF writer, only for what Henskan need: one image by page, and a table of content.
+# Pages are already encoded (PNG or JPEG) and already at the e-reader size, so we are not decoding them:
+#  * JPEG data is given as is to the PDF (DCTDecode)
+#  * PNG IDAT data is already a zlib stream, with PNG predictors, that the PDF FlateDecode filter can read directly
+# Each page is written (and flushed) to the file when added, only the objects offsets are kept in memory, and
+# the page tree, outlines and xref are written at the end.
+
+import io
+import os
+import struct
+from array import array
+import time
+import zlib
+
+from PIL import Image
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# PNG color type => number of colors by pixel in the PDF
+PNG_COLOR_TYPES = {
+    0: 1,  # greyscale
+    2: 3,  # RGB
+    3: 1,  # palette
+}
+
+JPEG_COLOR_SPACES = {
+    1: b'/DeviceGray',
+    3: b'/DeviceRGB',
+    4: b'/DeviceCMYK',
+}
+
+# JPEG markers that are giving the image size
+JPEG_SOF_MARKERS = (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF)
+
+# Pages are grouped in intermediate nodes, so readers don't have to load a huge /Kids array to open a page
+PAGE_TREE_MAX_KIDS = 64
+
+# Report the finalization progress each time this number of xref entries are written
+XREF_PROGRESS_STEP = 1000
+
+
+class PDFImage(object):
+    def __init__(self, width, height, dictionary, stream):
+        # type: (int, int, bytes, bytes) -> None
+        self.width = width
+        self.height = height
+        self.dictionary = dictionary  # without the /Length, added at write time
+        self.stream = stream
+
+
+def _pdf_string(s):
+    # type: (str) -> bytes
+    # ASCII can be written as is (with escapes), else must be in UTF-16 with BOM
+    try:
+        raw = s.encode('ascii')
+        return b'(' + raw.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)').replace(b'\r', b'\\r').replace(b'\n', b'\\n') + b')'
+    except UnicodeEncodeError:
+        return b'<' + (b'\xfe\xff' + s.encode('utf-16-be')).hex().upper().encode('ascii') + b'>'
+
+
+def _pdf_number(f):
+    # type: (float) -> bytes
+    if f == int(f):
+        return b'%d' % f
+    return (b'%.4f' % f).rstrip(b'0')
+
+
+def _png_to_pdf_image(data):
+    # type: (bytes) -> PDFImage|None
+    if not data.startswith(PNG_SIGNATURE):
+        return None
+    pos = len(PNG_SIGNATURE)
+    header = None
+    palette = None
+    idat_parts = []
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack('>I4s', data[pos:pos + 8])
+        chunk_data = data[pos + 8:pos + 8 + length]
+        pos += 12 + length  # length + type + data + crc
+        if chunk_type == b'IHDR':
+            header = struct.unpack('>IIBBBBB', chunk_data)
+        elif chunk_type == b'PLTE':
+            palette = chunk_data
+        elif chunk_type == b'IDAT':
+            idat_parts.append(chunk_data)
+        elif chunk_type == b'tRNS':
+            return None  # transparency is not managed, let the generic path flatten it
+        elif chunk_type == b'IEND':
+            break
+    if header is None or not idat_parts:
+        return None
+    width, height, bit_depth, color_type, _, _, interlace = header
+    # Interlaced or alpha channel images cannot be given as is to the PDF
+    if interlace != 0 or color_type not in PNG_COLOR_TYPES or bit_depth > 8:
+        return None
+    colors = PNG_COLOR_TYPES[color_type]
+    if color_type == 3:
+        if palette is None:
+            return None
+        nb_colors = len(palette) // 3
+        # Our palettes are greys, so we can have a 3 times smaller lookup table
+        if all(palette[i] == palette[i + 1] == palette[i + 2] for i in range(0, len(palette), 3)):
+            color_space = b'[/Indexed /DeviceGray %d <%s>]' % (nb_colors - 1, palette[::3].hex().encode('ascii'))
+        else:
+            color_space = b'[/Indexed /DeviceRGB %d <%s>]' % (nb_colors - 1, palette.hex().encode('ascii'))
+    elif color_type == 0:
+        color_space = b'/DeviceGray'
+    else:
+        color_space = b'/DeviceRGB'
+    dictionary = (b'/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s /BitsPerComponent %d /Filter /FlateDecode '
+                  b'/DecodeParms << /Predictor 15 /Colors %d /BitsPerComponent %d /Columns %d >>') % (
+                     width, height, color_space, bit_depth, colors, bit_depth, width)
+    return PDFImage(width, height, dictionary, b''.join(idat_parts))
+
+
+def _jpeg_to_pdf_image(data):
+    # type: (bytes) -> PDFImage|None
+    if not data.startswith(b'\xff\xd8'):
+        return None
+    pos = 2
+    is_adobe = False
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # padding
+            pos += 1
+            continue
+        segment_length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if marker == 0xEE and data[pos + 4:pos + 9] == b'Adobe':
+            is_adobe = True
+        if marker in JPEG_SOF_MARKERS:
+            bits, height, width, components = struct.unpack('>BHHB', data[pos + 4:pos + 10])
+            if components not in JPEG_COLOR_SPACES:
+                return None
+            dictionary = b'/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s /BitsPerComponent %d /Filter /DCTDecode' % (
+                width, height, JPEG_COLOR_SPACES[components], bits)
+            # Adobe CMYK jpeg are stored inverted
+            if components == 4 and is_adobe:
+                dictionary += b' /Decode [1 0 1 0 1 0 1 0]'
+            return PDFImage(width, height, dictionary, data)
+        pos += 2 + segment_length
+    return None
+
+
+# Last chance: the format is not directly readable by the PDF, so we must decode it
+def _decoded_to_pdf_image(data):
+    # type: (bytes) -> PDFImage
+    image = Image.open(io.BytesIO(data))
+    if image.mode not in ('L', 'RGB'):
+        image = image.convert('L' if image.mode in ('1', 'LA', 'I', 'I;16') else 'RGB')
+    color_space = b'/DeviceGray' if image.mode == 'L' else b'/DeviceRGB'
+    width, height = image.size
+    dictionary = b'/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s /BitsPerComponent 8 /Filter /FlateDecode' % (
+        width, height, color_space)
+    return PDFImage(width, height, dictionary, zlib.compress(image.tobytes()))
+
+
+def get_pdf_image(data):
+    # type: (bytes) -> PDFImage
+    pdf_image = _png_to_pdf_image(data)
+    if pdf_image is None:
+        pdf_image = _jpeg_to_pdf_image(data)
+    if pdf_image is None:
+        try:
+            pdf_image = _decoded_to_pdf_image(data)
+        except IOError:
+            raise RuntimeError('Cannot read image data for PDF')
+    return pdf_image
+
+
+class PDFWriter(object):
+    CATALOG_ID = 1
+    PAGES_ID = 2
+    INFO_ID = 3
+    
+    
+    def __init__(self, path, page_size, title='', author='', subject=''):
+        # type: (str, tuple[int, int], str, str, str) -> None
+        self._path = path
+        self._page_size = page_size
+        self._title = title
+        self._author = author
+        self._subject = subject
+        
+        # object id -> offset in the file, 0 = reserved but not written. Compact arrays, as there are 3 objects by page
+        self._offsets = array('Q', [0] * (self.INFO_ID + 1))
+        self._page_ids = array('L')
+        self._leaf_node_ids = array('L')  # page tree nodes that are direct parents of the pages
+        self._outlines = []  # (title, page index)
+        
+        self._file = open(path, 'wb')
+        self._file.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    
+    
+    def _new_id(self):
+        # type: () -> int
+        self._offsets.append(0)
+        return len(self._offsets) - 1
+    
+    
+    def _write_object(self, object_id, content, stream=None):
+        # type: (int, bytes, bytes|None) -> None
+        self._offsets[object_id] = self._file.tell()
+        self._file.write(b'%d 0 obj\n' % object_id)
+        if stream is None:
+            self._file.write(content)
+        else:
+            self._file.write(b'<< %s /Length %d >>\nstream\n' % (content, len(stream)))
+            self._file.write(stream)
+            self._file.write(b'\nendstream')
+        self._file.write(b'\nendobj\n')
+    
+    
+    # Image is centered and keep its aspect ratio, so even bad sized page are still fine
+    def add_page(self, data):
+        # type: (bytes) -> None
+        pdf_image = get_pdf_image(data)
+        page_width, page_height = self._page_size
+        scale = min(page_width / pdf_image.width, page_height / pdf_image.height)
+        draw_width = pdf_image.width * scale
+        draw_height = pdf_image.height * scale
+        x = (page_width - draw_width) / 2
+        y = (page_height - draw_height) / 2
+        
+        image_id = self._new_id()
+        self._write_object(image_id, pdf_image.dictionary, pdf_image.stream)
+        
+        content_id = self._new_id()
+        content = b'q %s 0 0 %s %s %s cm /Im0 Do Q' % (_pdf_number(draw_width), _pdf_number(draw_height), _pdf_number(x), _pdf_number(y))
+        self._write_object(content_id, b'', content)
+        
+        # new group of pages: its node is only reserved, it will be written at the end
+        if len(self._page_ids) % PAGE_TREE_MAX_KIDS == 0:
+            self._leaf_node_ids.append(self._new_id())
+        
+        page_id = self._new_id()
+        self._write_object(page_id, b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>' % (
+            self._leaf_node_ids[-1], page_width, page_height, image_id, content_id))
+        self._page_ids.append(page_id)
+        # the page is done, don't keep it in our buffers
+        self._file.flush()
+    
+    
+    # The outline entry will point to the next page that will be added
+    def add_outline(self, title):
+        # type: (str) -> None
+        self._outlines.append((title, len(self._page_ids)))
+    
+    
+    def get_nb_pages(self):
+        # type: () -> int
+        return len(self._page_ids)
+    
+    
+    def _write_outlines(self):
+        # type: () -> int|None
+        # Chapters without pages after them cannot be pointed
+        outlines = [(title, page_index) for (title, page_index) in self._outlines if page_index < len(self._page_ids)]
+        if not outlines:
+            return None
+        outlines_id = self._new_id()
+        item_ids = [self._new_id() for _ in outlines]
+        for idx, (title, page_index) in enumerate(outlines):
+            links = b''
+            if idx > 0:
+                links += b' /Prev %d 0 R' % item_ids[idx - 1]
+            if idx < len(outlines) - 1:
+                links += b' /Next %d 0 R' % item_ids[idx + 1]
+            self._write_object(item_ids[idx], b'<< /Title %s /Parent %d 0 R%s /Dest [%d 0 R /Fit] >>' % (
+                _pdf_string(title), outlines_id, links, self._page_ids[page_index]))
+        self._write_object(outlines_id, b'<< /Type /Outlines /First %d 0 R /Last %d 0 R /Count %d >>' % (item_ids[0], item_ids[-1], len(item_ids)))
+        return outlines_id
+    
+    
+    def _write_page_tree(self):
+        # Bottom level: the reserved nodes, with theirs pages
+        level = []  # (node id, kids ids, nb pages under the node)
+        for idx, node_id in enumerate(self._leaf_node_ids):
+            kids = self._page_ids[idx * PAGE_TREE_MAX_KIDS:(idx + 1) * PAGE_TREE_MAX_KIDS]
+            level.append((node_id, kids, len(kids)))
+        
+        # Then group nodes until the root can take them all
+        levels = [level]
+        while len(level) > PAGE_TREE_MAX_KIDS:
+            parent_level = []
+            for idx in range(0, len(level), PAGE_TREE_MAX_KIDS):
+                group = level[idx:idx + PAGE_TREE_MAX_KIDS]
+                parent_level.append((self._new_id(), [node_id for (node_id, _, _) in group], sum(count for (_, _, count) in group)))
+            level = parent_level
+            levels.append(level)
+        
+        # Write from the top, so each node know its parent
+        parent_ids = {node_id: self.PAGES_ID for (node_id, _, _) in level}
+        for level_index in range(len(levels) - 1, -1, -1):
+            for (node_id, kids, count) in levels[level_index]:
+                if level_index > 0:  # kids are nodes, not pages
+                    for kid in kids:
+                        parent_ids[kid] = node_id
+                self._write_object(node_id, b'<< /Type /Pages /Parent %d 0 R /Kids [%s] /Count %d >>' % (
+                    parent_ids[node_id], b' '.join(b'%d 0 R' % kid for kid in kids), count))
+        
+        root_kids = b' '.join(b'%d 0 R' % node_id for (node_id, _, _) in level)
+        self._write_object(self.PAGES_ID, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (root_kids, len(self._page_ids)))
+    
+    
+    # Without the end of the file, the pdf cannot be read, so it's removed
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+    
+    
+    # progress_callback(done, total) is called while writing the end of the file, can be long for big books
+    def close(self, progress_callback=None):
+        self._write_page_tree()
+        
+        outlines_id = self._write_outlines()
+        if outlines_id is not None:
+            self._write_object(self.CATALOG_ID, b'<< /Type /Catalog /Pages %d 0 R /Outlines %d 0 R /PageMode /UseOutlines >>' % (self.PAGES_ID, outlines_id))
+        else:
+            self._write_object(self.CATALOG_ID, b'<< /Type /Catalog /Pages %d 0 R >>' % self.PAGES_ID)
+        
+        creation_date = time.strftime('D:%Y%m%d%H%M%S')
+        self._write_object(self.INFO_ID, b'<< /Title %s /Author %s /Subject %s /Producer (Henskan) /CreationDate (%s) >>' % (
+            _pdf_string(self._title), _pdf_string(self._author), _pdf_string(self._subject), creation_date.encode('ascii')))
+        
+        # All objects are written, so we know the final xref size
+        nb_objects = len(self._offsets)
+        total = 1 + (nb_objects + XREF_PROGRESS_STEP - 1) // XREF_PROGRESS_STEP
+        done = 1
+        if progress_callback is not None:
+            progress_callback(done, total)
+        
+        xref_offset = self._file.tell()
+        self._file.write(b'xref\n0 %d\n' % nb_objects)
+        self._file.write(b'0000000000 65535 f \n')
+        for block_start in range(1, nb_objects, XREF_PROGRESS_STEP):
+            block_end = min(nb_objects, block_start + XREF_PROGRESS_STEP)
+            self._file.write(b''.join(b'%010d 00000 n \n' % self._offsets[object_id] for object_id in range(block_start, block_end)))
+            done += 1
+            if progress_callback is not None:
+                progress_callback(done, total)
+        self._file.write(b'trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+            nb_objects, self.CATALOG_ID, self.INFO_ID, xref_offset))
+        self._file.close()
@@ -0,0 +1,208 @@
+# Copyright 2020+     Gabès Jean (naparuba@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+
+from .archive import ARCHIVE_FORMATS
+from .encoders import Encoder, PNGEncoder, get_encoder
+from .log import get_logger
+from .parameters import BASE_HENSKAN_DIR
+
+logger = get_logger(__name__)
+
+PROFILES_FILE_NAME = 'profiles.json'
+
+# Shipped with henskan
+DEFAULT_PROFILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), PROFILES_FILE_NAME)
+# Users can add new e-readers (or change one) without code edits
+USER_PROFILES_PATH = os.path.join(BASE_HENSKAN_DIR, PROFILES_FILE_NAME)
+
+
+# Palettes are only greys: [0, 85, ...] => [0, 0, 0, 85, 85, 85, ...]
+def get_grey_palette(greys):
+    # type: (list[int]) -> list[int]
+    palette = []
+    for grey in greys:
+        palette.extend([grey, grey, grey])
+    return palette
+
+
+# Luminance (0-255) => index of the nearest grey of the palette
+def compute_palette_lut(palette):
+    # type: (list[int]) -> list[int]
+    greys = palette[0::3]
+    return [min(range(len(greys)), key=lambda idx: abs(greys[idx] - luminance)) for luminance in range(256)]
+
+
+# Everything a page conversion needs for a device, computed once at load time
+class DeviceProfile(object):
+    def __init__(self, name, size, palette, archive_format, encoder=None, deflate_level=None):
+        # type: (str, tuple[int, int], list[int], ARCHIVE_FORMATS, Encoder|None, int|None) -> None
+        self._name = name
+        self._size = size
+        self._palette = palette
+        self._palette_lut = compute_palette_lut(palette)
+        self._archive_format = archive_format
+        self._encoder = encoder if encoder is not None else PNGEncoder()
+        self._deflate_level = deflate_level  # CBZ only, None = the pages are stored
+    
+    
+    def get_name(self):
+        # type: () -> str
+        return self._name
+    
+    
+    def get_size(self):
+        # type: () -> tuple[int, int]
+        return self._size
+    
+    
+    def get_palette(self):
+        # type: () -> list[int]
+        return self._palette
+    
+    
+    def get_palette_lut(self):
+        # type: () -> list[int]
+        return self._palette_lut
+    
+    
+    def get_archive_format(self):
+        # type: () -> ARCHIVE_FORMATS
+        return self._archive_format
+    
+    
+    def get_encoder(self):
+        # type: () -> Encoder
+        return self._encoder
+    
+    
+    def get_deflate_level(self):
+        # type: () -> int|None
+        return self._deflate_level
+
+
+class ProfileRegistry(object):
+    def __init__(self):
+        self._palettes = {}  # name -> palette
+        self._profiles = {}  # name -> DeviceProfile, in the display order
+    
+    
+    def _parse_greys(self, greys, where):
+        # type: (object, str) -> list[int]
+        if not isinstance(greys, list) or not greys or len(greys) > 256 \
+                or not all(isinstance(grey, int) and 0 <= grey <= 255 for grey in greys):
+            raise ValueError(f'{where}: a palette must be a list of 1 to 256 greys between 0 and 255')
+        return get_grey_palette(greys)
+    
+    
+    def _parse_profile(self, entry, palettes, where):
+        # type: (dict, dict[str, list[int]], str) -> DeviceProfile
+        if not isinstance(entry, dict):
+            raise ValueError(f'{where}: a profile must be an object')
+        name = entry.get('name')
+        if not isinstance(name, str) or not name:
+            raise ValueError(f'{where}: a profile must have a name')
+        size = entry.get('size')
+        if not isinstance(size, list) or len(size) != 2 or not all(isinstance(v, int) and v > 0 for v in size):
+            raise ValueError(f'{where}: profile {name} must have a size like [1264, 1680]')
+        palette = entry.get('palette')
+        if isinstance(palette, str):  # named palette
+            if palette not in palettes:
+                raise ValueError(f'{where}: profile {name} has an unknown palette {palette}')
+            palette = palettes[palette]
+        else:
+            palette = self._parse_greys(palette, f'{where}: profile {name}')
+        archive_format = entry.get('format')
+        if archive_format not in ARCHIVE_FORMATS.__members__:
+            raise ValueError(f'{where}: profile {name} format must be one of {", ".join(ARCHIVE_FORMATS.__members__)}')
+        # "encoder": "jpeg", "jpeg": {"quality": 85}: the options are in an object with the encoder name
+        encoder_name = entry.get('encoder', 'png')
+        try:
+            encoder = get_encoder(encoder_name, entry.get(encoder_name))
+        except ValueError as exp:
+            raise ValueError(f'{where}: profile {name}: {exp}')
+        if archive_format == ARCHIVE_FORMATS.PDF.value and not encoder.is_pdf_compatible():
+            raise ValueError(f'{where}: profile {name}: {encoder_name} pages cannot be in a PDF')
+        # "deflate": 6: the CBZ pages are compressed in the archive
+        deflate_level = entry.get('deflate')
+        if deflate_level is not None:
+            if archive_format != ARCHIVE_FORMATS.CBZ.value:
+                raise ValueError(f'{where}: profile {name}: deflate is only for the CBZ profiles')
+            if not isinstance(deflate_level, int) or not 1 <= deflate_level <= 9:
+                raise ValueError(f'{where}: profile {name}: deflate must be between 1 and 9, not {deflate_level}')
+        return DeviceProfile(name, (size[0], size[1]), palette, ARCHIVE_FORMATS[archive_format], encoder=encoder, deflate_level=deflate_level)
+    
+    
+    # Profiles with an already known name are replaced (at the same place), new ones are added at the end.
+    # NOTE: the file is fully checked before changing anything, so a bad file does not break the registry
+    def load(self, path):
+        # type: (str) -> None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except OSError as exp:
+            raise RuntimeError(f'Cannot read profiles file {path}: {exp}')
+        except json.JSONDecodeError as exp:
+            raise ValueError(f'{path}: invalid JSON: {exp}')
+        if not isinstance(data, dict):
+            raise ValueError(f'{path}: must be an object with "palettes" and "profiles"')
+        
+        palettes = dict(self._palettes)
+        raw_palettes = data.get('palettes', {})
+        if not isinstance(raw_palettes, dict):
+            raise ValueError(f'{path}: "palettes" must be an object')
+        for palette_name, greys in raw_palettes.items():
+            palettes[palette_name] = self._parse_greys(greys, f'{path}: palette {palette_name}')
+        
+        raw_profiles = data.get('profiles', [])
+        if not isinstance(raw_profiles, list):
+            raise ValueError(f'{path}: "profiles" must be a list')
+        new_profiles = [self._parse_profile(entry, palettes, path) for entry in raw_profiles]
+        
+        self._palettes = palettes
+        for profile in new_profiles:
+            self._profiles[profile.get_name()] = profile
+        logger.debug('Loaded %s profiles from %s', len(new_profiles), path)
+    
+    
+    def get(self, name):
+        # type: (str) -> DeviceProfile
+        return self._profiles[name]
+    
+    
+    def exists(self, name):
+        # type: (str) -> bool
+        return name in self._profiles
+    
+    
+    def get_names(self):
+        # type: () -> list[str]
+        return list(self._profiles.keys())
+    
+    
+    def get_palette(self, palette_name):
+        # type: (str) -> list[int]
+        return self._palettes[palette_name]
+
+
+profiles = ProfileRegistry()
+profiles.load(DEFAULT_PROFILES_PATH)
+if os.path.exists(USER_PROFILES_PATH):
+    try:
+        profiles.load(USER_PROFILES_PATH)
+    except (RuntimeError, ValueError) as exp:
+        logger.warning('Ignoring the user profiles: %s', exp)
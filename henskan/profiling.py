@@ -0,0 +1,162 @@
+# Copyright 2020+     Gabès Jean (naparuba@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (in ms) of the histogram buckets, the last one take all the rest
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class StageStats(object):
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+    
+    
+    def add(self, duration):
+        # type: (float) -> None
+        self.count += 1
+        self.total += duration
+        self.min = duration if self.min is None else min(self.min, duration)
+        self.max = max(self.max, duration)
+        duration_ms = duration * 1000
+        for idx, bucket_ms in enumerate(HISTOGRAM_BUCKETS_MS):
+            if duration_ms <= bucket_ms:
+                self.histogram[idx] += 1
+                return
+        self.histogram[-1] += 1
+    
+    
+    # Add stats computed elsewhere (like in a worker process), in the to_dict() format
+    def merge_dict(self, data):
+        # type: (dict) -> None
+        if not data['count']:
+            return
+        self.count += data['count']
+        self.total += data['total']
+        self.min = data['min'] if self.min is None else min(self.min, data['min'])
+        self.max = max(self.max, data['max'])
+        for idx, nb in enumerate(data['histogram'].values()):  # same order as in to_dict()
+            self.histogram[idx] += nb
+    
+    
+    def to_dict(self):
+        # type: () -> dict
+        histogram = {}
+        for idx, bucket_ms in enumerate(HISTOGRAM_BUCKETS_MS):
+            histogram[f'<={bucket_ms}ms'] = self.histogram[idx]
+        histogram[f'>{HISTOGRAM_BUCKETS_MS[-1]}ms'] = self.histogram[-1]
+        return {
+            'count':     self.count,
+            'total':     round(self.total, 6),
+            'mean':      round(self.total / self.count, 6) if self.count else 0.0,
+            'min':       round(self.min or 0.0, 6),
+            'max':       round(self.max, 6),
+            'histogram': histogram,
+        }
+
+
+# Time spent by pipeline stage (load, crop, quantize, encode...), for a whole run, so we can
+# find which stage is slow on some sources
+class Profiler(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}  # stage name -> StageStats
+        self._local = threading.local()
+    
+    
+    @contextmanager
+    def stage(self, name):
+        # type: (str) -> None
+        before = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - before)
+    
+    
+    # Stages of the current thread go in a new profiler, so several jobs running at the same time
+    # do not mix their stats
+    @contextmanager
+    def capture(self):
+        # type: () -> Profiler
+        captured = Profiler()
+        previous = getattr(self._local, 'captured', None)
+        self._local.captured = captured
+        try:
+            yield captured
+        finally:
+            self._local.captured = previous
+    
+    
+    def record(self, name, duration):
+        # type: (str, float) -> None
+        captured = getattr(self._local, 'captured', None)
+        if captured is not None:
+            captured.record(name, duration)
+            return
+        with self._lock:
+            if name not in self._stages:
+                self._stages[name] = StageStats()
+            self._stages[name].add(duration)
+    
+    
+    # Stats of the worker processes are merged in the main profiler, so a run still has only one profile
+    def merge(self, stats):
+        # type: (dict[str, dict]) -> None
+        with self._lock:
+            for name, data in stats.items():
+                if name not in self._stages:
+                    self._stages[name] = StageStats()
+                self._stages[name].merge_dict(data)
+    
+    
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+    
+    
+    def get_stats(self):
+        # type: () -> dict[str, dict]
+        with self._lock:
+            return {name: stats.to_dict() for (name, stats) in self._stages.items()}
+    
+    
+    def get_summary(self):
+        # type: () -> str
+        lines = []
+        stats = self.get_stats()
+        for name in sorted(stats, key=lambda n: stats[n]['total'], reverse=True):
+            stage = stats[name]
+            lines.append(f'{name:<16} {stage["count"]:>6} calls  total:{stage["total"]:>8.3f}s  mean:{stage["mean"] * 1000:>8.1f}ms  max:{stage["max"] * 1000:>8.1f}ms')
+        return '\n'.join(lines)
+    
+    
+    def export_json(self, path, extra=None):
+        # type: (str, dict|None) -> None
+        data = {'stages': self.get_stats()}
+        if extra:
+            data.update(extra)
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+
+
+profiler = Profiler()
@@ -0,0 +1,380 @@
+# Copyright 2020+     Gabès Jean (naparuba@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import collections.abc
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .encoders import Encoder
+from .image import convert_source, measure_source
+from .job import ConversionJob, JOB_STATES, JobCancelled
+from .log import get_logger, set_batch_mode
+from .parameters import ConversionSettings
+from .profiling import Profiler, profiler
+from .worker import Worker
+
+logger = get_logger(__name__)
+
+# Keep a core for the UI and for the archive writing
+DEFAULT_NB_PROCESSES = max(1, (os.cpu_count() or 1) - 1)
+
+# Sources converted in advance by process: the processes never wait for the archive, and we do not
+# keep a whole book in memory
+SOURCES_AHEAD_BY_PROCESS = 2
+
+# Jobs converted at the same time. The processes are shared, so more jobs is only useful when a job is
+# waiting for its archive (like the PDF finalization)
+DEFAULT_MAX_RUNNING_JOBS = 1
+
+# Last cancelled jobs ids, shared with the processes so they can stop in the middle of a long source (webtoon)
+CANCELLED_JOBS_SLOTS = 64
+
+_cancelled_job_ids = None  # in the processes, the shared array given at their start
+
+
+# Called once in each worker process: import all the pipeline (and load the unwanted images hashes) now,
+# so the first page of a job is not paying for it
+def _init_process(cancelled_job_ids):
+    global _cancelled_job_ids
+    _cancelled_job_ids = cancelled_job_ids
+    set_batch_mode(True)
+    from .similarity import similarity  # noqa: the import is the warm-up
+
+
+def _warm_up():
+    # type: () -> int
+    return os.getpid()
+
+
+# The stats of this source only, they are merged in the job profile
+def _convert_source_task(source, settings, split_right_then_left, split_left_then_right, checkpoint):
+    # type: (str, ConversionSettings, bool, bool, callable) -> tuple[list[bytes], dict[str, dict]]
+    with profiler.capture() as captured:
+        datas = convert_source(source, settings, split_right_then_left=split_right_then_left, split_left_then_right=split_left_then_right,
+                               checkpoint=checkpoint)
+    return datas, captured.get_stats()
+
+
+def _convert_source_in_process(job_id, source, settings, split_right_then_left, split_left_then_right):
+    # type: (int, str, ConversionSettings, bool, bool) -> tuple[list[bytes], dict[str, dict]]
+    def checkpoint():
+        if job_id in _cancelled_job_ids[:]:
+            raise JobCancelled(f'job {job_id} was cancelled')
+    
+    return _convert_source_task(source, settings, split_right_then_left, split_left_then_right, checkpoint)
+
+
+def _measure_source_task(source, settings, encoders, split_right_then_left, split_left_then_right):
+    # type: (str, ConversionSettings, list[Encoder], bool, bool) -> list[int]
+    return measure_source(source, settings, encoders, split_right_then_left=split_right_then_left, split_left_then_right=split_left_then_right)
+
+
+# Without processes, the task is done in the calling thread, but given like the executor ones
+def _run_now(task, *args):
+    # type: (callable, object) -> Future
+    future = Future()
+    try:
+        future.set_result(task(*args))
+    except Exception as exp:
+        future.set_exception(exp)
+    return future
+
+
+# Long-lived conversion engine, owned by the application: warm worker processes for the pages, and a
+# queue of jobs taken in order by the service threads (one by running job).
+# NOTE: listeners are called from the service threads, the UI must go back to its own thread
+class ConversionService(object):
+    def __init__(self, nb_processes=DEFAULT_NB_PROCESSES, max_running_jobs=DEFAULT_MAX_RUNNING_JOBS, profile_path=None):
+        # type: (int, int, str|None) -> None
+        if max_running_jobs < 1:
+            raise ValueError(f'max_running_jobs must be at least 1, not {max_running_jobs}')
+        self._nb_processes = nb_processes  # 0 = convert in the service threads, no process
+        self._max_running_jobs = max_running_jobs
+        self._profile_path = profile_path  # the stages time of each job is saved there, None = not saved
+        self._executor = None  # type: ProcessPoolExecutor|None
+        self._executor_lock = threading.Lock()  # the running jobs can find it broken at the same time
+        self._queue = queue.Queue()
+        self._jobs = []  # type: list[ConversionJob]
+        self._jobs_lock = threading.Lock()
+        self._listeners = []
+        self._threads = []  # type: list[threading.Thread]
+        self._is_stopping = False
+        self._cancelled_job_ids = None
+        self._nb_cancelled_jobs = 0
+    
+    
+    def start(self):
+        # type: () -> None
+        if self._threads:
+            return
+        self._is_stopping = False
+        if self._nb_processes > 0:
+            self._cancelled_job_ids = multiprocessing.get_context('spawn').RawArray('q', CANCELLED_JOBS_SLOTS)
+            self._executor = self._new_executor()
+        for idx in range(self._max_running_jobs):
+            thread = threading.Thread(target=self._run, name=f'conversion-service-{idx}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info('Conversion service started with %s process(es), up to %s job(s) at the same time', self._nb_processes, self._max_running_jobs)
+    
+    
+    def _new_executor(self):
+        # type: () -> ProcessPoolExecutor
+        # spawn on all platforms: forking a process with Qt threads is not safe
+        executor = ProcessPoolExecutor(max_workers=self._nb_processes, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_process, initargs=(self._cancelled_job_ids,))
+        # Processes are started on demand, so ask for all of them now, while the user is choosing files
+        for _ in range(self._nb_processes):
+            executor.submit(_warm_up)
+        return executor
+    
+    
+    # A process did die (killed when out of memory, crash in a C library): its pool cannot be used anymore, so
+    # the job fails and the next ones are given new processes
+    def _restart_executor(self, broken_executor):
+        # type: (ProcessPoolExecutor) -> None
+        with self._executor_lock:
+            if self._executor is not broken_executor or self._is_stopping:  # already done by another job
+                return
+            logger.error('A conversion process did stop unexpectedly, the processes are restarted')
+            broken_executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._new_executor()
+    
+    
+    # Jobs not started are dropped, the running ones are cancelled
+    def stop(self):
+        # type: () -> None
+        if not self._threads:
+            return
+        self._is_stopping = True
+        for job in self.get_jobs():
+            if not job.is_finished():
+                self.cancel_job(job)
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+        logger.info('Conversion service stopped')
+    
+    
+    def get_nb_processes(self):
+        # type: () -> int
+        return self._nb_processes
+    
+    
+    # Threads an archive can use to compress its pages: the cores that the processes are leaving, shared by the
+    # running jobs
+    def get_nb_archive_threads(self):
+        # type: () -> int
+        return max(1, ((os.cpu_count() or 1) - self._nb_processes) // self._max_running_jobs)
+    
+    
+    def get_profile_path(self):
+        # type: () -> str|None
+        return self._profile_path
+    
+    
+    def add_listener(self, callback):
+        # type: (callable) -> None
+        self._listeners.append(callback)
+    
+    
+    def notify(self, job):
+        # type: (ConversionJob) -> None
+        for callback in self._listeners:
+            try:
+                callback(job)
+            except Exception:
+                logger.exception('Job listener failed for %s', job)
+    
+    
+    def add_job(self, job):
+        # type: (ConversionJob) -> ConversionJob
+        if not self._threads:
+            raise ValueError('The conversion service is not started')
+        with self._jobs_lock:
+            self._jobs.append(job)
+        logger.info('Queued %s', job)
+        self.notify(job)
+        self._queue.put(job)
+        return job
+    
+    
+    def get_jobs(self):
+        # type: () -> list[ConversionJob]
+        with self._jobs_lock:
+            return list(self._jobs)
+    
+    
+    # The job stops at its next checkpoint, its unfinished volume is deleted
+    def cancel_job(self, job):
+        # type: (ConversionJob) -> None
+        if job.is_finished():
+            return
+        logger.info('Cancelling %s', job)
+        job.cancel()
+        if self._cancelled_job_ids is not None:
+            with self._jobs_lock:
+                self._cancelled_job_ids[self._nb_cancelled_jobs % CANCELLED_JOBS_SLOTS] = job.get_id()
+                self._nb_cancelled_jobs += 1
+        self.notify(job)
+    
+    
+    # The job stops before its next page, the pages already sent to the processes are still converted
+    def pause_job(self, job):
+        # type: (ConversionJob) -> None
+        job.pause()
+        self.notify(job)
+    
+    
+    def resume_job(self, job):
+        # type: (ConversionJob) -> None
+        job.resume()
+        self.notify(job)
+    
+    
+    # Queued or running
+    def get_nb_pending_jobs(self):
+        # type: () -> int
+        with self._jobs_lock:
+            return len([job for job in self._jobs if not job.is_finished()])
+    
+    
+    def get_nb_waiting_jobs(self):
+        # type: () -> int
+        with self._jobs_lock:
+            return len([job for job in self._jobs if job.get_state() == JOB_STATES.QUEUED])
+    
+    
+    # For scripts and tests: block until all the queued jobs are finished
+    def wait_until_idle(self):
+        # type: () -> None
+        self._queue.join()
+    
+    
+    def _submit_source(self, executor, job, source):
+        # type: (ProcessPoolExecutor|None, ConversionJob, str) -> Future
+        settings = job.get_settings()
+        split_right_then_left = job.is_split_right_then_left()
+        split_left_then_right = job.is_split_left_then_right()
+        if executor is not None:
+            return executor.submit(_convert_source_in_process, job.get_id(), source, settings, split_right_then_left, split_left_then_right)
+        # no process: convert now, in this thread
+        return _run_now(_convert_source_task, source, settings, split_right_then_left, split_left_then_right, job.checkpoint)
+    
+    
+    # For the size budget: the pages size of each source with each encoder, the sources are converted by the processes
+    def measure_sources(self, job, sources, encoders):
+        # type: (ConversionJob, list[str], list[Encoder]) -> list[list[int]]
+        args = (job.get_settings(), encoders, job.is_split_right_then_left(), job.is_split_left_then_right())
+        executor = self._executor
+        futures = []
+        sample_sizes = []
+        try:
+            for source in sources:
+                if executor is None:
+                    futures.append((source, _run_now(_measure_source_task, source, *args)))
+                else:
+                    futures.append((source, executor.submit(_measure_source_task, source, *args)))
+            for source, future in futures:
+                job.checkpoint()
+                try:
+                    sample_sizes.append(future.result())
+                except BrokenProcessPool:
+                    raise
+                except RuntimeError as exp:
+                    raise RuntimeError(f'Error while measuring {source}: {exp}')
+        except BrokenProcessPool as exp:
+            self._restart_executor(executor)
+            raise RuntimeError(f'A conversion process did stop while measuring the pages: {exp}')
+        finally:
+            for _, future in futures:
+                future.cancel()
+        return sample_sizes
+    
+    
+    # The encoded pages of each source, in the sources order, while the next sources are converted by the processes
+    def iter_converted_sources(self, job, sources, job_profiler):
+        # type: (ConversionJob, list[str], Profiler) -> collections.abc.Iterator[list[bytes]]
+        nb_ahead = max(1, self._nb_processes) * SOURCES_AHEAD_BY_PROCESS
+        executor = self._executor
+        next_sources = iter(sources)
+        futures = collections.deque()
+        try:
+            for source in next_sources:
+                futures.append((source, self._submit_source(executor, job, source)))
+                if len(futures) >= nb_ahead:
+                    break
+            while futures:
+                source, future = futures.popleft()
+                next_source = next(next_sources, None)
+                if next_source is not None:
+                    futures.append((next_source, self._submit_source(executor, job, next_source)))
+                try:
+                    datas, stats = future.result()
+                except BrokenProcessPool:
+                    raise
+                except RuntimeError as exp:
+                    raise RuntimeError(f'Error while processing {source}: {exp}')
+                job_profiler.merge(stats)
+                yield datas
+        except BrokenProcessPool as exp:
+            self._restart_executor(executor)
+            raise RuntimeError(f'A conversion process did stop while converting the pages: {exp}')
+        finally:  # the job did fail or was cancelled: do not let the processes work for nothing
+            for _, future in futures:
+                future.cancel()
+    
+    
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                if self._is_stopping:
+                    logger.info('Dropping %s, the service is stopping', job)
+                    continue
+                if job.is_cancel_requested():  # cancelled while in the queue
+                    continue
+                self._run_job(job)
+            finally:
+                self._queue.task_done()
+    
+    
+    def _run_job(self, job):
+        # type: (ConversionJob) -> None
+        job.set_running()
+        self.notify(job)
+        try:
+            Worker(job, self).run()
+            job.set_done()
+        except JobCancelled:
+            logger.info('Conversion cancelled for %s', job)
+            job.set_cancelled()
+        except Exception as exp:
+            logger.exception('Conversion failed for %s', job)
+            job.set_failed(str(exp))
+        self.notify(job)
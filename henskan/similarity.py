@@ -19,7 +19,11 @@ import os
 import imagehash
 
 from .image import Image
+from .log import get_logger
 from .parameters import UNWANTED, DELETED
+from .profiling import profiler
+
+logger = get_logger(__name__)
 
 THRESHOLD = 6
 
@@ -33,46 +37,51 @@ class Similarity(object):
         self._clean()
         self._load()
         
-        self._sum_time = 0.0
         self._nb_deleted = 0
     
     
     def _clean(self):
         if not os.path.exists(DELETED):
-            print("CANNOT SAVE DELETED")
+            logger.warning('Cannot save deleted images, missing directory %s', DELETED)
             return
-        print(" * Cleaning deleted dir: %s" % DELETED)
+        logger.debug('Cleaning deleted dir: %s', DELETED)
         for f_path in os.listdir(DELETED):
             full_path = os.path.join(DELETED, f_path)
-            os.unlink(full_path)
+            try:
+                os.unlink(full_path)
+            except FileNotFoundError:  # all the worker processes are cleaning at the same time
+                pass
     
     
     def _load(self):
         t0 = time.time()
-        print(" * Loading unwanted images: %s" % UNWANTED)
         for f_path in os.listdir(UNWANTED):
             full_path = os.path.join(UNWANTED, f_path)
             try:
                 img = Image.open(full_path)
             except Exception as e:
-                print(" * Cannot open image %s: %s" % (full_path, e))
+                logger.debug('Cannot open unwanted image %s: %s', full_path, e)
                 continue
             hash = imagehash.average_hash(img, hash_size=HASH_SIZE)
             self._unwanted_hashes[f_path] = hash
-        print("   - %s hashed loaded in %.3fs" % (len(self._unwanted_hashes), time.time() - t0))
+        logger.info('%s unwanted images hashes loaded from %s in %.3fs', len(self._unwanted_hashes), UNWANTED, time.time() - t0)
     
     
     def _add_deleted_image(self, f_path, image, diff, do_move):
         self._nb_deleted += 1
-        print(" * Image is unwanted (from %s), deleted=%s" % (f_path, self._nb_deleted))
-        save_deleted_path = os.path.join(DELETED, 'unwanted_similarity_%s--diff_%s__%s.jpg' % (f_path, diff, self._nb_deleted))
+        logger.debug('Image is unwanted (from %s), deleted=%s', f_path, self._nb_deleted)
+        # the pid: several worker processes are saving in the same directory
+        save_deleted_path = os.path.join(DELETED, 'unwanted_similarity_%s--diff_%s__%s-%s.jpg' % (f_path, diff, os.getpid(), self._nb_deleted))
         if do_move:
             image.save(save_deleted_path)
     
     
     def is_valid_image(self, image, do_move=True):
-        elapsed_at_start = int(self._sum_time)
-        t0 = time.time()
+        with profiler.stage('similarity'):
+            return self._is_valid_image(image, do_move)
+    
+    
+    def _is_valid_image(self, image, do_move):
         hash = imagehash.average_hash(image, hash_size=HASH_SIZE)
         is_valid = True
         for (f_path, ref_hash) in self._unwanted_hashes.items():
@@ -82,9 +91,6 @@ class Similarity(object):
                 self._add_deleted_image(f_path, image, diff, do_move=do_move)
                 is_valid = False
                 break
-        self._sum_time += (time.time() - t0)
-        if int(self._sum_time) != elapsed_at_start:
-            print("[UNWANTED:] Consume time= %s" % int(self._sum_time))
         return is_valid
 
 
@@ -0,0 +1,238 @@
+# Copyright 2020+     Gabès Jean (naparuba@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import io
+import os
+import threading
+import zipfile
+
+try:
+    import pymupdf  # only for the PDF sources
+except ImportError:
+    pymupdf = None
+
+from .log import get_logger
+from .util import natural_key
+
+logger = get_logger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpeg', '.jpg', '.gif', '.png', '.webp', '.ppm')
+ZIP_EXTENSIONS = ('.cbz', '.zip')
+PDF_EXTENSIONS = ('.pdf',)
+ARCHIVE_EXTENSIONS = ZIP_EXTENSIONS + PDF_EXTENSIONS
+
+# Extension of the extracted stream, by PDF filter. JPEG (and JPEG 2000) streams are given as they are in the
+# PDF, the other ones are given as PNG by PyMuPDF
+PDF_FILTER_EXTENSIONS = {'DCTDecode': 'jpg', 'JPXDecode': 'jp2'}
+
+# Opened archives are kept, so we do not read again the central directory of a 2000 pages archive for each page
+MAX_OPEN_ARCHIVES = 8
+
+
+# A source page is a path string everywhere (parameters, jobs, worker processes...). A page in an archive is
+# a "virtual" path: the archive path, then the member name, like /manga/tome 1.cbz/012.jpg
+# For a PDF, the member is an embedded image: page number and image xref, like /manga/tome 1.pdf/00012_45.jpg
+def get_file_extension(path):
+    # type: (str) -> str
+    return os.path.splitext(path)[1].lower()
+
+
+def is_image_file(path):
+    # type: (str) -> bool
+    return get_file_extension(path) in IMAGE_EXTENSIONS
+
+
+def is_pdf_file(path):
+    # type: (str) -> bool
+    return get_file_extension(path) in PDF_EXTENSIONS
+
+
+def is_archive_file(path):
+    # type: (str) -> bool
+    return get_file_extension(path) in ARCHIVE_EXTENSIONS and os.path.isfile(path)
+
+
+def get_member_path(archive_path, member_name):
+    # type: (str, str) -> str
+    return f'{archive_path}/{member_name}'
+
+
+# => (archive path, member name), or None for a real file
+def split_member_path(path):
+    # type: (str) -> tuple[str, str]|None
+    if os.path.isfile(path):
+        return None
+    lower_path = path.lower()
+    for extension in ARCHIVE_EXTENSIONS:
+        idx = lower_path.find(extension + '/')
+        while idx != -1:
+            archive_path = path[:idx + len(extension)]
+            if os.path.isfile(archive_path):
+                return archive_path, path[idx + len(extension) + 1:]
+            idx = lower_path.find(extension + '/', idx + 1)
+    return None
+
+
+def _open_archive(archive_path):
+    # type: (str) -> zipfile.ZipFile|pymupdf.Document
+    if is_pdf_file(archive_path):
+        if pymupdf is None:
+            raise RuntimeError(f'Cannot read {archive_path}: PyMuPDF is needed for the PDF sources (pip install PyMuPDF)')
+        try:
+            return pymupdf.open(archive_path, filetype='pdf')
+        except Exception as exp:  # PyMuPDF errors are not all RuntimeError
+            raise RuntimeError(f'Cannot read PDF {archive_path}: {exp}')
+    try:
+        return zipfile.ZipFile(archive_path)
+    except (OSError, zipfile.BadZipFile) as exp:
+        raise RuntimeError(f'Cannot read archive {archive_path}: {exp}')
+
+
+class _ArchiveCache(object):
+    def __init__(self, max_size):
+        # type: (int) -> None
+        self._max_size = max_size
+        self._archives = collections.OrderedDict()  # path -> ZipFile or pymupdf Document, the last used at the end
+        # NOTE: PyMuPDF is not thread safe, so the PDF documents are only used with this lock
+        self.lock = threading.RLock()
+    
+    
+    def get(self, archive_path):
+        # type: (str) -> zipfile.ZipFile|pymupdf.Document
+        with self.lock:
+            archive = self._archives.get(archive_path)
+            if archive is not None:
+                self._archives.move_to_end(archive_path)
+                return archive
+            archive = _open_archive(archive_path)
+            self._archives[archive_path] = archive
+            if len(self._archives) > self._max_size:
+                # NOTE: the zip members already opened are still readable after the close
+                _, oldest = self._archives.popitem(last=False)
+                oldest.close()
+            return archive
+
+
+_archive_cache = _ArchiveCache(MAX_OPEN_ARCHIVES)
+
+
+# Images of the archive (sub-directories included), in the natural order. For a PDF: the images of
+# each page, in the pages order
+def list_archive_images(archive_path):
+    # type: (str) -> list[str]
+    if is_pdf_file(archive_path):
+        return [get_member_path(archive_path, member_name) for member_name in _list_pdf_images(archive_path)]
+    member_names = list_zip_image_names(_archive_cache.get(archive_path))
+    return [get_member_path(archive_path, member_name) for member_name in member_names]
+
+
+# Image members of an opened zip, in the natural order, without the macOS and hidden files
+def list_zip_image_names(archive):
+    # type: (zipfile.ZipFile) -> list[str]
+    member_names = [info.filename for info in archive.infolist()
+                    if not info.is_dir() and is_image_file(info.filename)
+                    and not info.filename.startswith('__MACOSX/') and not os.path.basename(info.filename).startswith('.')]
+    member_names.sort(key=natural_key)
+    return member_names
+
+
+def _list_pdf_images(pdf_path):
+    # type: (str) -> list[str]
+    member_names = []
+    with _archive_cache.lock:
+        document = _archive_cache.get(pdf_path)
+        for page_index in range(document.page_count):
+            # (xref, smask, width, height, bpc, colorspace, alt. colorspace, name, filter)
+            page_images = document.get_page_images(page_index)
+            if not page_images:
+                logger.warning('The page %s of %s has no image, it is skipped', page_index + 1, pdf_path)
+                continue
+            for page_image in page_images:
+                xref, image_filter = page_image[0], page_image[8]
+                extension = PDF_FILTER_EXTENSIONS.get(image_filter, 'png')
+                member_names.append(f'{page_index + 1:05d}_{xref}.{extension}')
+    return member_names
+
+
+def _get_pdf_image_xref(pdf_path, member_name):
+    # type: (str, str) -> int
+    try:
+        return int(os.path.splitext(member_name)[0].split('_')[1])
+    except (IndexError, ValueError):
+        raise RuntimeError(f'Cannot find {member_name} in the PDF {pdf_path}')
+
+
+# The image stream as it is in the PDF (a JPEG scan is not decoded), only the other filters are made PNG by PyMuPDF
+def _read_pdf_image(pdf_path, member_name):
+    # type: (str, str) -> bytes
+    xref = _get_pdf_image_xref(pdf_path, member_name)
+    with _archive_cache.lock:
+        document = _archive_cache.get(pdf_path)
+        try:
+            extracted = document.extract_image(xref)
+        except Exception as exp:
+            raise RuntimeError(f'Cannot extract {member_name} from the PDF {pdf_path}: {exp}')
+    if not extracted:
+        raise RuntimeError(f'Cannot find {member_name} in the PDF {pdf_path}')
+    return extracted['image']
+
+
+# The bytes of the image stream, from its dictionary: the image is not extracted just to know its size
+def _get_pdf_image_size(pdf_path, member_name):
+    # type: (str, str) -> int
+    xref = _get_pdf_image_xref(pdf_path, member_name)
+    with _archive_cache.lock:
+        document = _archive_cache.get(pdf_path)
+        try:
+            value_type, value = document.xref_get_key(xref, 'Length')
+        except Exception as exp:
+            raise RuntimeError(f'Cannot find {member_name} in the PDF {pdf_path}: {exp}')
+    if value_type != 'int':  # an indirect length
+        return len(_read_pdf_image(pdf_path, member_name))
+    return int(value)
+
+
+# A binary file object: the real file, or a stream of the archive member. Members are decompressed on the
+# fly, so a big archive is never loaded in memory
+def open_source(path):
+    # type: (str) -> object
+    member = split_member_path(path)
+    if member is None:
+        try:
+            return open(path, 'rb')
+        except OSError as exp:
+            raise RuntimeError(f'Cannot read image file {path}: {exp}')
+    archive_path, member_name = member
+    if is_pdf_file(archive_path):
+        return io.BytesIO(_read_pdf_image(archive_path, member_name))
+    try:
+        return _archive_cache.get(archive_path).open(member_name)
+    except KeyError:
+        raise RuntimeError(f'Cannot find {member_name} in the archive {archive_path}')
+
+
+def get_source_size(path):
+    # type: (str) -> int
+    member = split_member_path(path)
+    if member is None:
+        return os.path.getsize(path)
+    archive_path, member_name = member
+    if is_pdf_file(archive_path):
+        return _get_pdf_image_size(archive_path, member_name)
+    try:
+        return _archive_cache.get(archive_path).getinfo(member_name).file_size
+    except KeyError:
+        raise RuntimeError(f'Cannot find {member_name} in the archive {archive_path}')
@@ -0,0 +1,143 @@
+# Copyright 2020+     Gabès Jean (naparuba@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# A book already converted by Henskan (CBZ or PDF) => the same book for another e-reader (CBZ or PDF), without
+# converting the sources again:
+#   python -m henskan.transcode "One Piece 1.cbz" --device "Kindle Paperwhite 3"
+# Pages with the device size, format and greys are copied as they are, the other ones are only converted again
+# from the grey pass (no split, no crop).
+
+import argparse
+import collections.abc
+import os
+import time
+import zipfile
+
+from .archive import ARCHIVE_FORMATS
+from .archive_cbz import ArchiveCBZ, read_comic_info
+from .archive_pdf import ArchivePDF
+from .encoders import get_data_extension
+from .image import EReaderData, fit_page
+from .log import get_logger
+from .pdf_reader import PDFReader
+from .source import is_pdf_file, list_zip_image_names
+
+logger = get_logger(__name__)
+
+# Output format => extension added by the archive
+ARCHIVE_EXTENSIONS = {
+    ARCHIVE_FORMATS.CBZ: '.cbz',
+    ARCHIVE_FORMATS.PDF: '.pdf',
+}
+
+
+# Same as PDFReader, for a CBZ
+class _CBZReader(object):
+    def __init__(self, path):
+        # type: (str) -> None
+        try:
+            self._zip_file = zipfile.ZipFile(path)
+        except (OSError, zipfile.BadZipFile) as exp:
+            raise RuntimeError(f'Cannot read archive {path}: {exp}')
+        self._title, self._bookmarks = read_comic_info(self._zip_file)
+        self._image_names = list_zip_image_names(self._zip_file)
+    
+    
+    def get_title(self):
+        # type: () -> str
+        return self._title
+    
+    
+    def get_nb_pages(self):
+        # type: () -> int
+        return len(self._image_names)
+    
+    
+    def get_outlines(self):
+        # type: () -> list[tuple[int, str]]
+        return self._bookmarks
+    
+    
+    def iter_pages(self):
+        # type: () -> collections.abc.Iterator[bytes]
+        for image_name in self._image_names:
+            yield self._zip_file.read(image_name)
+    
+    
+    def close(self):
+        self._zip_file.close()
+
+
+# => path of the written book. The output is next to the input by default, with the device format extension
+def transcode(input_path, device, output_path=None, title=''):
+    # type: (str, str, str|None, str) -> str
+    if not EReaderData.is_device_exists(device):
+        raise ValueError(f'Unknown e-reader {device}')
+    profile = EReaderData.get_profile(device)
+    output_format = profile.get_archive_format()
+    if output_path is None:
+        output_path = os.path.splitext(input_path)[0]
+    book_path, extension = os.path.splitext(output_path)
+    if extension.lower() not in ARCHIVE_EXTENSIONS.values():  # no extension given, or a dot in the title
+        book_path = output_path
+    written_path = book_path + ARCHIVE_EXTENSIONS[output_format]
+    if os.path.abspath(written_path) == os.path.abspath(input_path):
+        raise ValueError(f'Cannot transcode {input_path} into itself, give another output path')
+    
+    t0 = time.time()
+    reader = PDFReader(input_path) if is_pdf_file(input_path) else _CBZReader(input_path)
+    try:
+        title = title or reader.get_title() or os.path.basename(book_path)
+        chapters_by_page = {}  # page index -> chapter titles
+        for page_index, chapter_title in reader.get_outlines():
+            chapters_by_page.setdefault(page_index, []).append(chapter_title)
+        
+        if output_format == ARCHIVE_FORMATS.PDF:
+            archive = ArchivePDF(book_path, title, device)
+        else:
+            archive = ArchiveCBZ(book_path, title, deflate_level=profile.get_deflate_level())
+        nb_converted_pages = 0
+        try:
+            for page_index, data in enumerate(reader.iter_pages()):
+                for chapter_title in chapters_by_page.get(page_index, []):
+                    archive.add_chapter(chapter_title)
+                page_data = fit_page(data, profile)
+                if page_data is not data:
+                    nb_converted_pages += 1
+                archive.add_page(page_index, '%05d.%s' % (page_index, get_data_extension(page_data)), page_data)
+        except BaseException:
+            archive.abort()
+            raise
+        archive.close()
+    finally:
+        reader.close()
+    logger.info('Transcoded %s into %s for %s in %.3fs: %s pages, %s converted again', input_path, written_path, device, time.time() - t0,
+                reader.get_nb_pages(), nb_converted_pages)
+    return written_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcode a book converted by Henskan for another e-reader, without converting it again')
+    parser.add_argument('input', help='the CBZ or PDF book')
+    parser.add_argument('--device', required=True, help='the new e-reader profile, its format (CBZ or PDF) is used')
+    parser.add_argument('--output', help='the new book path (default: next to the input)')
+    parser.add_argument('--title', default='', help='title of the new book (default: the input one)')
+    args = parser.parse_args()
+    
+    print(transcode(args.input, args.device, output_path=args.output, title=args.title))
+
+
+if __name__ == '__main__':
+    main()
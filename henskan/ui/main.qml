@@ -523,8 +523,7 @@ ApplicationWindow {
                     id: device_combo_box
                     objectName: "device_combo_box"
                     Layout.fillWidth: true
-                    model: ["Kindle 1", "Kindle 2/3/Touch", "Kindle 4 & 5", "Kindle DX/DXG", "Kindle Paperwhite 1 & 2", "Kindle Paperwhite 3/Voyage/Oasis", "Kobo Mini/Touch", "Kobo Glo", "Kobo Glo HD", "Kobo Aura", "Kobo Aura HD", "Kobo Aura H2O", "Kobo Libra H2O", "Kobo Elipsa 2E"]
-                    currentIndex: 12  // Kobo Libra H2O, because it's mine ^^
+                    model: ui_controller.device_names  // from the profile registry
                     onCurrentIndexChanged: {
                         console.log("Current index changed to", currentIndex, "model[currentIndex] =", model[currentIndex])
                         ui_controller.on_device_changed(model[currentIndex], currentIndex)
@@ -536,6 +535,40 @@ ApplicationWindow {
 
             }
 
+            // VOLUMES
+            RowLayout {
+                ComboBox {
+                    id: volume_split_combo_box
+                    objectName: "volume_split_combo_box"
+                    Layout.fillWidth: true
+                    model: ui_controller.volume_split_names  // from the parameters presets
+                    currentIndex: 0
+                    onCurrentIndexChanged: {
+                        ui_controller.on_volume_split_changed(currentIndex)
+                    }
+                    Material.accent: "green"  // border
+                    Material.foreground: "green"  // selected text
+                }
+
+            }
+
+            // SIZE BUDGET
+            RowLayout {
+                ComboBox {
+                    id: size_budget_combo_box
+                    objectName: "size_budget_combo_box"
+                    Layout.fillWidth: true
+                    model: ui_controller.size_budget_names  // from the parameters presets
+                    currentIndex: 0
+                    onCurrentIndexChanged: {
+                        ui_controller.on_size_budget_changed(currentIndex)
+                    }
+                    Material.accent: "green"  // border
+                    Material.foreground: "green"  // selected text
+                }
+
+            }
+
             // separator
             Rectangle {
                 Layout.fillWidth: true
@@ -638,6 +671,31 @@ ApplicationWindow {
 
 
             }
+
+            RowLayout { // Pause & cancel of the running conversion
+                id: job_control_row
+                objectName: "job_control_row"
+                Layout.alignment: Qt.AlignHCenter
+                visible: false  // only when a conversion is running
+
+                Button {
+                    id: pause_button
+                    objectName: "pause_button"
+                    text: "Pause"
+                    onClicked: {
+                        ui_controller.on_pause_clicked()
+                    }
+                }
+
+                Button {
+                    id: cancel_button
+                    objectName: "cancel_button"
+                    text: "Cancel"
+                    onClicked: {
+                        ui_controller.on_cancel_clicked()
+                    }
+                }
+            }
         }
 
     }
@@ -15,6 +15,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
 class UIComponent:
     def __init__(self, id, dom_element):
         self._id = id
@@ -71,7 +76,7 @@ class UIInput(UIComponent):
     
     def set_value(self, s):
         # type: (str) -> None
-        print(f'UIInput:: {self._id} => set_value: {s}')
+        logger.debug('UIInput:: %s => set_value: %s', self._id, s)
         self._value = s
         if not self._value:
             self.got_no_value()
@@ -110,11 +115,11 @@ class UIRectButton(UIButton):
 class UIRectButtonConvert(UIRectButton):
     def _change_image(self, image_path):
         img = self._find_child_id('col_convert_img')
-        print(f'img: {img}')
+        logger.debug('img: %s', img)
         if img:
             img.setProperty("source", image_path)
         else:
-            print(f'Cannot find image {image_path}')
+            logger.warning('Cannot find image %s', image_path)
     
     
     def disable(self):
@@ -144,7 +149,7 @@ class UIComboBox(UIComponent):
     
     def set_value(self, s, index):
         # type: (str, int) -> None
-        print(f'UIComboBox:: {self._id} => set_value: {s} {index}')
+        logger.debug('UIComboBox:: %s => set_value: %s %s', self._id, s, index)
         self._dom_element.setProperty("currentIndex", index)
 
 
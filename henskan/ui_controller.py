@@ -19,16 +19,21 @@ import os
 import random
 import re
 import time
-from typing import LiteralString
 
-from PyQt6.QtCore import QObject, pyqtSlot, pyqtSignal, QThread
+from PyQt6.QtCore import QObject, pyqtSlot, pyqtSignal, pyqtProperty, QUrl
+from PyQt6.QtGui import QDesktopServices
 from PyQt6.QtWidgets import QFileDialog
 
-from .image import guess_manga_or_webtoon_image, is_splitable
-from .parameters import parameters
+from .image import EReaderData, guess_manga_or_webtoon_image, is_splitable
+from .job import ConversionJob, JOB_STATES
+from .log import get_logger
+from .parameters import parameters, UNWANTED, DELETED, VOLUME_SPLIT_PRESETS, SIZE_BUDGET_PRESETS
+from .service import ConversionService
+from .source import is_archive_file, is_image_file, list_archive_images
 from .ui_component import UIInput, UIRectButton, UIComboBox, UIProgressBar, UIRectButtonConvert
 from .util import find_compact_title, natural_key
-from .worker import Worker
+
+logger = get_logger(__name__)
 
 COMPONENTS = {
     'title_input':                UIInput,
@@ -38,6 +43,8 @@ COMPONENTS = {
     'split_left_right_rectangle': UIRectButton,
     'split_right_left_rectangle': UIRectButton,
     'device_combo_box':           UIComboBox,
+    'volume_split_combo_box':     UIComboBox,
+    'size_budget_combo_box':      UIComboBox,
     
     'output_directory_input':     UIInput,
     
@@ -47,11 +54,25 @@ COMPONENTS = {
 
 
 class UIController(QObject):
-    def __init__(self, engine, file_path_model):
+    # the service is calling us from its thread, the signal is bringing the job back in the UI thread,
+    # with its state at this time (the job can be finished when we get the signal)
+    jobChanged = pyqtSignal(object, object)
+    
+    
+    def __init__(self, engine, file_path_model, conversion_service):
+        # type: (object, object, ConversionService) -> None
         super().__init__()
         self.engine = engine
         self._file_path_model = file_path_model
         
+        self._conversion_service = conversion_service
+        self.jobChanged.connect(self._on_job_changed)
+        self._conversion_service.add_listener(lambda job: self.jobChanged.emit(job, job.get_state()))
+        # shown when the queue is empty, not after each job
+        self._directories_to_show = []
+        # the one the pause & cancel buttons are for
+        self._current_job = None  # type: ConversionJob|None
+        
         self._components = {}
         
         self._col_parameters = None
@@ -60,6 +81,24 @@ class UIController(QObject):
         self._first_drop_done = False
     
     
+    # Devices of the device_combo_box, in the same order as the index
+    @pyqtProperty(list, constant=True)
+    def device_names(self):
+        return EReaderData.get_devices()
+    
+    
+    # Choices of the volume_split_combo_box, in the same order as the index
+    @pyqtProperty(list, constant=True)
+    def volume_split_names(self):
+        return [label for (label, _, _, _) in VOLUME_SPLIT_PRESETS]
+    
+    
+    # Choices of the size_budget_combo_box, in the same order as the index
+    @pyqtProperty(list, constant=True)
+    def size_budget_names(self):
+        return [label for (label, _) in SIZE_BUDGET_PRESETS]
+    
+    
     def load_components(self):
         for component_id, ui_component_klass in COMPONENTS.items():
             dom_element = self._find_dom_id(component_id)
@@ -78,6 +117,8 @@ class UIController(QObject):
         parameters.load_previous_parameters()
         
         self._set_device(parameters.get_device(), parameters.get_device_index())
+        self._set_volume_split(parameters.get_volume_split_index())
+        self._set_size_budget(parameters.get_size_budget_index())
     
     
     def _find_child(self, obj, look_name):
@@ -99,12 +140,12 @@ class UIController(QObject):
     
     @pyqtSlot(str)
     def on_title_changed(self, text):
-        print(f"Title changed: {text}")
+        logger.debug('Title changed: %s', text)
         self._set_title(text)
     
     
     def _set_title(self, text):
-        print(f'_set_title:: {text}')
+        logger.debug('_set_title:: %s', text)
         parameters.set_title(text)
         
         self._components['title_input'].set_value(text)
@@ -112,37 +153,16 @@ class UIController(QObject):
         self._check_for_convert_ready()
     
     
-    @staticmethod
-    def __get_file_extension(filename):
-        # type: (LiteralString | str| bytes) -> str
-        return os.path.splitext(filename)[1].lower()
-    
-    
-    def __is_image_file(self, filename):
-        # type: (LiteralString | str | bytes) -> bool
-        image_exts = ('.jpeg', '.jpg', '.gif', '.png', '.webp', 'ppm')
-        file_extension = self.__get_file_extension(filename)
-        return file_extension in image_exts
-    
-    
-    def start_converting(self):
-        for component in self._components.values():
-            component.disable_interaction()
-        
-        # But enable the progress bar
-        self._components['progress_bar'].enable()
-    
-    
     @pyqtSlot(str)
     def on_files_dropped(self, file_url_str):
         start = time.time()
-        print(f"File dropped: ZZ{file_url_str}ZZ  {type(file_url_str)}")
+        logger.debug('File dropped: %s', file_url_str)
         
         paths = []
         file_paths = file_url_str.split("\n")
         for file_path in file_paths:
             file_path = file_path.strip().replace("file:///", "", 1)
-            print(f'onFilesDropped::File path: {file_path}')
+            logger.debug('onFilesDropped::File path: %s', file_path)
             if not file_path:
                 continue
             paths.append(file_path)
@@ -151,12 +171,19 @@ class UIController(QObject):
         is_only_main_title_dir = len(paths) == 1
         
         paths.sort(key=lambda item: natural_key(item))
-        print(f'Loading Paths: {paths}')
+        logger.debug('Loading Paths: %s', paths)
         for file_path in paths:
             chapter_name = os.path.basename(file_path)
+            is_archive = is_archive_file(file_path)
+            if is_archive:  # Tome 1.cbz => Tome 1
+                chapter_name = os.path.splitext(chapter_name)[0]
+            if is_archive:  # a chapter only if there are images in it
+                if self.__add_archive(file_path, chapter_name):
+                    parameters.add_chapter(chapter_name)
+                continue
             if not is_only_main_title_dir:  # real chapter/tome name
                 parameters.add_chapter(chapter_name)
-            if self.__is_image_file(file_path):
+            if is_image_file(file_path):
                 self._file_path_model.add_file_path(file_path, chapter_name, 0.33)
             elif os.path.isdir(file_path):
                 if is_only_main_title_dir:
@@ -168,7 +195,7 @@ class UIController(QObject):
             self.__enable_other_cols()
         
         self._drop_done()
-        print(f'End of onFilesDropped in {time.time() - start:.3f}s')
+        logger.info('End of onFilesDropped in %.3fs', time.time() - start)
     
     
     def _drop_done(self):
@@ -208,16 +235,15 @@ class UIController(QObject):
         # type: () -> str
         
         chapters = parameters.get_chapters()
-        print('Guess title from chapters:', chapters)
         r = find_compact_title(chapters)
-        print(f'Guess title from chapters: {r}')
+        logger.debug('Guess title from chapters: %s', r)
         return r
     
     
     # We are looking for the less level directory that is common to ALL image paths
     # and this will give us the title
     def _guess_title(self):
-        print(f'UIController::_guess_title')
+        logger.debug('UIController::_guess_title')
         
         # First try with chapters
         title_from_chapters = self._guess_title_from_chapters()
@@ -228,29 +254,29 @@ class UIController(QObject):
         image_paths = parameters.get_images()
         
         if not image_paths:
-            print('No images')
+            logger.debug('No images')
             return
         
         # Get the common path
-        print(f'image_path: {image_paths}')
+        logger.debug('image_path: %s', image_paths)
         common_path = os.path.commonpath(image_paths)
-        print(f'Common path: {common_path}')
+        logger.debug('Common path: %s', common_path)
         
         # Get the title
         raw_title = os.path.basename(common_path)
-        print(f'raw_title: {raw_title}')
+        logger.debug('raw_title: %s', raw_title)
         
         # Clean all that is between [] and () in this string
         title = re.sub(r'\[.*?\]', '', raw_title)
         title = re.sub(r'\(.*?\)', '', title)
         title = title.strip()
         
-        print(f'Final title: {title}')
+        logger.debug('Final title: %s', title)
         self._set_title(title)
     
     
     def _guess_parameters(self):
-        print(f'UIController::_guess_parameters')
+        logger.debug('UIController::_guess_parameters')
         
         self._guess_title()
         
@@ -268,32 +294,32 @@ class UIController(QObject):
         nb_should_split = 0
         
         while len(sampled_images) < nb_random_need:
-            print(f'nb sampled_images: {len(sampled_images)}')
+            logger.debug('nb sampled_images: %s', len(sampled_images))
             image_path = random.choice(images)
             if image_path in sampled_images:
                 continue
             
-            print(f'Guessing {image_path}')
+            logger.debug('Guessing %s', image_path)
             try:
                 image_guess = guess_manga_or_webtoon_image(image_path)
             except Exception as exp:  # TODO: change a for with a while, so we can have the good number of images
-                print(f'Error while guessing: {exp}')
+                logger.warning('Error while guessing: %s', exp)
                 continue
                 # don't count it if it's an error
             sampled_images.add(image_path)
             if image_guess == 'webtoon':
                 nb_webtoon += 1
-                print(f'''{image_path} is a webtoon''')
+                logger.debug('%s is a webtoon', image_path)
                 continue
-            print(f'''{image_path} is a manga''')
+            logger.debug('%s is a manga', image_path)
             splitable = is_splitable(image_path)
             if splitable:
                 nb_should_split += 1
-                print(f'''{image_path} can be split''')
+                logger.debug('%s can be split', image_path)
             else:
-                print(f'''{image_path} can't be split''')
+                logger.debug("%s can't be split", image_path)
         
-        print(f'nb_webtoon: {nb_webtoon}  nb_should_split: {nb_should_split}')
+        logger.debug('nb_webtoon: %s  nb_should_split: %s', nb_webtoon, nb_should_split)
         
         # If more than half of the images are webtoon, then we set webtoon
         if nb_webtoon > quorum_size:
@@ -337,33 +363,57 @@ class UIController(QObject):
         file_names = os.listdir(directory)
         for filename in file_names:
             file_path = os.path.join(directory, filename)
-            if self.__is_image_file(file_path):
+            if is_image_file(file_path):
                 if not was_main_chapter_added:  # don't add chapters more than once!
                     parameters.add_chapter(main_chapter)
                     was_main_chapter_added = True
-                print(f'UIController::__add_main_directory:: found an IMAGE {filename=} so in main chapter {main_chapter=}')
+                logger.debug('UIController::__add_main_directory:: found an IMAGE filename=%s so in main chapter main_chapter=%s', filename, main_chapter)
                 self._file_path_model.add_file_path(file_path, main_chapter, 0.33)
             elif os.path.isdir(file_path):
                 chapter_name = filename  # this is a direct sub-dir, so use it as chapter name
                 parameters.add_chapter(chapter_name)
-                print(f'UIController::__add_main_directory:: found a CHAPTER {chapter_name=}')
+                logger.debug('UIController::__add_main_directory:: found a CHAPTER chapter_name=%s', chapter_name)
                 self.__add_directory(file_path, chapter_name)
+            elif is_archive_file(file_path):  # a cbz by tome, it's a chapter too
+                chapter_name = os.path.splitext(filename)[0]
+                logger.debug('UIController::__add_main_directory:: found an ARCHIVE chapter_name=%s', chapter_name)
+                if self.__add_archive(file_path, chapter_name):
+                    parameters.add_chapter(chapter_name)
     
     
     def __add_directory(self, directory, chapter_name):
         # type: (str, str) -> None
-        print(f'UIController::__add_directory {directory=} {chapter_name=}')
+        logger.debug('UIController::__add_directory directory=%s chapter_name=%s', directory, chapter_name)
         
         for root, _, subfiles in os.walk(directory):
             for filename in subfiles:
                 file_path = os.path.join(root, filename)
-                if self.__is_image_file(file_path):
+                if is_image_file(file_path):
                     self._file_path_model.add_file_path(file_path, chapter_name, 0.33)
+                elif is_archive_file(file_path):
+                    self.__add_archive(file_path, chapter_name)
+    
+    
+    # Pages are read from the archive when converting, nothing is extracted
+    # => the member paths of the images, empty if the archive is skipped
+    def __add_archive(self, archive_path, chapter_name):
+        # type: (str, str) -> list[str]
+        logger.debug('UIController::__add_archive archive_path=%s chapter_name=%s', archive_path, chapter_name)
+        try:
+            member_paths = list_archive_images(archive_path)
+        except RuntimeError as exp:
+            logger.warning('Skipping archive: %s', exp)
+            return []
+        if not member_paths:
+            logger.warning('Skipping archive: no image in %s', archive_path)
+        for member_path in member_paths:
+            self._file_path_model.add_file_path(member_path, chapter_name, 0.33)
+        return member_paths
     
     
     @pyqtSlot()
     def on_button_manga(self):
-        print(f"onButtonManga clicked")
+        logger.debug('onButtonManga clicked')
         if not parameters.is_webtoon():
             return
         parameters.set_is_webtoon(False)
@@ -382,7 +432,7 @@ class UIController(QObject):
     
     @pyqtSlot()
     def on_button_webtoon(self):
-        print(f"onButtonWebtoon clicked")
+        logger.debug('onButtonWebtoon clicked')
         if parameters.is_webtoon():
             return  # already is
         parameters.set_is_webtoon(True)
@@ -400,20 +450,20 @@ class UIController(QObject):
     
     
     def _enable_manga_split_display(self):
-        print(f'UIController::_enable_manga_split_display')
+        logger.debug('UIController::_enable_manga_split_display')
         self._find_dom_id('split_webtoon_row').setProperty("visible", False)
         self._find_dom_id('split_manga_row').setProperty("visible", True)
     
     
     def _enable_webtoon_split_display(self):
-        print(f'UIController::_enable_webtoon_split_display')
+        logger.debug('UIController::_enable_webtoon_split_display')
         self._find_dom_id('split_webtoon_row').setProperty("visible", True)
         self._find_dom_id('split_manga_row').setProperty("visible", False)
     
     
     @pyqtSlot()
     def on_button_no_split(self):
-        print(f"onButtonNoSplit clicked")
+        logger.debug('onButtonNoSplit clicked')
         self._enable_no_split()
         self._send_message_to_manga_split_row('No image split')
     
@@ -429,7 +479,7 @@ class UIController(QObject):
     
     @pyqtSlot()
     def on_button_split_right_then_left(self):
-        print(f"onButtonSplitRightThenLeft clicked")
+        logger.debug('onButtonSplitRightThenLeft clicked')
         self._enable_split_right_then_left()
         self._send_message_to_manga_split_row('Split page right, then left')
     
@@ -445,7 +495,7 @@ class UIController(QObject):
     
     @pyqtSlot()
     def on_button_split_left_then_right(self):
-        print(f"onButtonSplitLeftThenRight clicked")
+        logger.debug('onButtonSplitLeftThenRight clicked')
         self._enable_split_left_then_right()
         self._send_message_to_manga_split_row('Split page left, then right')
     
@@ -461,22 +511,107 @@ class UIController(QObject):
     
     @pyqtSlot()
     def on_convert_clicked(self):
-        print("Submit button clicked")
+        logger.debug('Submit button clicked')
+        
+        # We did finish the setup, we can now save the parameters
+        parameters.save_parameters()
         
-        self.thread = QThread()
-        self.worker = Worker()
-        self.worker.moveToThread(self.thread)
-        self.worker.updateProgress.connect(self.update_progress_bar)
-        self.worker.add_ui_controller(self)
-        self.worker.add_progress_text(self._find_dom_id('progress_text'))
-        self.thread.started.connect(self.worker.run)
+        # sort images before processing
+        parameters.sort_images()
         
-        self.thread.start()
+        # the job is a copy of the parameters, so the user can prepare the next series while this one is converted
+        self._conversion_service.add_job(ConversionJob.from_parameters(parameters))
+        self._prepare_next_series()
+    
+    
+    # Back to the drop step, but the device, output directory and volume split are kept
+    def _prepare_next_series(self):
+        self._find_dom_id('title_input').setProperty('text', '')  # before the clean, it's calling on_title_changed
+        parameters.clean_series()
+        self._file_path_model.clear()
+        self._first_drop_done = False
+        
+        for component_id in ('manga_rectangle', 'webtoon_rectangle', 'no_split_rectangle', 'split_left_right_rectangle', 'split_right_left_rectangle'):
+            self._components[component_id].set_not_active()
+        self._col_parameters.setProperty("visible", False)
+        self._check_for_convert_ready()
+    
+    
+    @pyqtSlot(object, object)
+    def _on_job_changed(self, job, state):
+        # type: (ConversionJob, JOB_STATES) -> None
+        if state == JOB_STATES.QUEUED:
+            text = 'Queued'
+        elif state == JOB_STATES.FAILED:
+            text = f'Failed: {job.get_error()}'
+        elif state == JOB_STATES.CANCELLED:
+            text = 'Cancelled'
+        elif state == JOB_STATES.PAUSED:
+            text = 'Paused'
+        else:
+            self.update_progress_bar(job.get_progress_pct())
+            text = job.get_progress_text()
+        text = f'{job.get_title()}: {text}'
+        nb_waiting = self._conversion_service.get_nb_waiting_jobs()
+        if job.get_state() == JOB_STATES.QUEUED:  # not waiting for itself
+            nb_waiting -= 1
+        if nb_waiting:
+            text += f'<br/>{nb_waiting} series waiting'
+        self._find_dom_id('progress_text').setProperty('text', text)
+        self._update_job_control(job, state)
+        
+        if state == JOB_STATES.DONE:
+            # Show the output directory so the user can quickly access it
+            self._add_directory_to_show(job.get_output_directory())
+            # If webtoon, also show useful directory to analyse the splits
+            if job.is_webtoon():
+                self._add_directory_to_show(UNWANTED)
+                self._add_directory_to_show(DELETED)
+        if state in (JOB_STATES.DONE, JOB_STATES.FAILED) and self._conversion_service.get_nb_pending_jobs() == 0:
+            for directory in self._directories_to_show:
+                QDesktopServices.openUrl(QUrl.fromLocalFile(directory))
+            self._directories_to_show = []
+    
+    
+    def _update_job_control(self, job, state):
+        # type: (ConversionJob, JOB_STATES) -> None
+        if state in (JOB_STATES.RUNNING, JOB_STATES.PAUSED):
+            self._current_job = job
+        elif job is not self._current_job:
+            return
+        is_running = state in (JOB_STATES.RUNNING, JOB_STATES.PAUSED)
+        if not is_running:
+            self._current_job = None
+        self._find_dom_id('job_control_row').setProperty('visible', is_running)
+        self._find_dom_id('pause_button').setProperty('text', 'Resume' if state == JOB_STATES.PAUSED else 'Pause')
+    
+    
+    @pyqtSlot()
+    def on_pause_clicked(self):
+        job = self._current_job
+        if job is None:
+            return
+        if job.is_paused():
+            self._conversion_service.resume_job(job)
+        else:
+            self._conversion_service.pause_job(job)
+    
+    
+    @pyqtSlot()
+    def on_cancel_clicked(self):
+        if self._current_job is not None:
+            self._conversion_service.cancel_job(self._current_job)
+    
+    
+    def _add_directory_to_show(self, directory):
+        # type: (str) -> None
+        if directory not in self._directories_to_show:
+            self._directories_to_show.append(directory)
     
     
     @pyqtSlot(int)
     def update_progress_bar(self, value):
-        print(f'Backend::updateProgressBar:: Progress: {value}')
+        logger.debug('Backend::updateProgressBar:: Progress: %s', value)
         # Find the ProgressBar QML object by its objectName
         progress_bar = self._find_child(self.engine.rootObjects()[0], "progress_bar")
         if progress_bar:
@@ -486,7 +621,9 @@ class UIController(QObject):
     
     @pyqtSlot(str, int)
     def on_device_changed(self, str_value, index):
-        print(f"Selected value: {str_value} {index}")
+        logger.debug('Selected value: %s %s', str_value, index)
+        if not self._components:  # the combo box is created, load_components will select the device
+            return
         self._set_device(str_value, index)
     
     
@@ -496,6 +633,36 @@ class UIController(QObject):
         self._components['device_combo_box'].set_value(value, index)
     
     
+    @pyqtSlot(int)
+    def on_volume_split_changed(self, index):
+        logger.debug('Selected volume split: %s', index)
+        self._set_volume_split(index)
+    
+    
+    def _set_volume_split(self, index):
+        if not 0 <= index < len(VOLUME_SPLIT_PRESETS):
+            index = 0
+        _, mode, max_images, max_bytes = VOLUME_SPLIT_PRESETS[index]
+        parameters.set_volume_split(mode, index, max_images=max_images, max_bytes=max_bytes)
+        
+        self._components['volume_split_combo_box'].set_value(mode.value, index)
+    
+    
+    @pyqtSlot(int)
+    def on_size_budget_changed(self, index):
+        logger.debug('Selected size budget: %s', index)
+        self._set_size_budget(index)
+    
+    
+    def _set_size_budget(self, index):
+        if not 0 <= index < len(SIZE_BUDGET_PRESETS):
+            index = 0
+        _, max_bytes = SIZE_BUDGET_PRESETS[index]
+        parameters.set_size_budget(max_bytes, index)
+        
+        self._components['size_budget_combo_box'].set_value(str(max_bytes), index)
+    
+    
     directorySelected = pyqtSignal(str)
     
     
@@ -508,9 +675,9 @@ class UIController(QObject):
     
     def _set_output_directory(self, directory):
         if not directory or not os.path.exists(directory) or not os.path.isdir(directory):
-            print(f'Wrong output directory: {directory}')
+            logger.warning('Wrong output directory: %s', directory)
             return
-        print(f"Selected directory: {directory}")
+        logger.debug('Selected directory: %s', directory)
         parameters.set_output_directory(directory)
         # Update the UI
         self._components['output_directory_input'].set_value(directory)
@@ -526,12 +693,13 @@ class UIController(QObject):
     
     
     def _enable_convert(self):
-        print('UIController::_enable_convert')
+        logger.debug('UIController::_enable_convert')
         self._components['convert_rect_button'].enable()
         self._components['progress_bar'].enable()
     
     
     def _disable_convert(self):
-        print('UIController::_disable_convert')
+        logger.debug('UIController::_disable_convert')
         self._components['convert_rect_button'].disable()
-        self._components['progress_bar'].disable()
+        if self._conversion_service.get_nb_pending_jobs() == 0:  # still showing the progress of the queued series
+            self._components['progress_bar'].disable()
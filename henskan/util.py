@@ -17,6 +17,10 @@
 import os.path
 import re
 
+from .log import get_logger
+
+logger = get_logger(__name__)
+
 
 # Sort function use to sort files in a natural order, by lowering
 # characters, and manage multi levels of integers (tome 1/ page 1.jpg, etc etc)
@@ -32,6 +36,15 @@ def natural_key(string_):
     return l
 
 
+# nb items taken at the same distance from each other, so a sample is not only the first chapter
+def spread_sample(items, nb):
+    # type: (list, int) -> list
+    if len(items) <= nb:
+        return list(items)
+    step = len(items) / nb
+    return [items[int(idx * step)] for idx in range(nb)]
+
+
 def get_ui_path(relative):
     # type: (str) -> str
     my_dir = os.path.abspath(os.path.dirname(__file__))
@@ -40,7 +53,6 @@ def get_ui_path(relative):
 
 def _find_base_dir_without_tome_number(directory_name):
     # type: (str) -> str
-    print(f'\n{directory_name=}')
     lookup_patterns = [r'\sT\d+.*',  # ELDEN RING – T02
                        r'\sTome\s*\d+.*',  # ELDEN RING – Tome 2
                        r'\s*\d+$',  # ELDEN RING – Le chemin vers l’Arbre-Monde - 1
@@ -49,10 +61,8 @@ def _find_base_dir_without_tome_number(directory_name):
     
     # Extract the base title by removing volume/chapter , and remove ALL that is AFTER T03 or Tome03
     for lookup_pattern in lookup_patterns:
-        print('lookup_pattern:', lookup_pattern)
         dir_base_title = re.sub(lookup_pattern, '', directory_name, flags=re.IGNORECASE).strip()
         if dir_base_title == directory_name:
-            print(f'lookup_pattern: {lookup_pattern=} not found, still {dir_base_title=}')
             continue  # not found
         return dir_base_title
     
@@ -89,18 +99,18 @@ def find_compact_title(directory_names):
         dir_base_title = _find_base_dir_without_tome_number(directory_name)
         
         if not base_title:
-            print(f'First match {directory_name=} => {dir_base_title=}')
+            logger.debug('First match %s => %s', directory_name, dir_base_title)
             base_title = dir_base_title
             continue
         # All subdirectory must match the same base title
         if base_title != dir_base_title:
-            print(f'Error: cannot find a common base title for sub directories {base_title=} != {dir_base_title=}')
+            logger.debug('Cannot find a common base title for sub directories %s != %s', base_title, dir_base_title)
             return ''
     
     if not base_title:
         return ''
     
-    print(f'Base title: {base_title=}')
+    logger.debug('Base title: %s', base_title)
     
     # Extract volume numbers
     volume_numbers = [int(re.search(r'\d+', chapter, flags=re.IGNORECASE).group()) for chapter in directory_names if re.search(r'\d+', chapter)]
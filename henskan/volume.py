@@ -0,0 +1,98 @@
+# Copyright 2020+     Gabès Jean (naparuba@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from enum import Enum
+
+
+class VOLUME_SPLIT_MODES(Enum):
+    NONE = 'NONE'  # one big file
+    CHAPTERS = 'CHAPTERS'  # one file by chapter/tome
+    IMAGES = 'IMAGES'  # group chapters, up to a number of source images (a split double page is 2 pages on the e-reader)
+    SIZE = 'SIZE'  # group chapters, up to a size on disk (decided while converting)
+
+
+# A volume is an independent output file: its own chapters and images, so it can be written and
+# closed without looking at the others
+class Volume(object):
+    def __init__(self, number):
+        # type: (int) -> None
+        self._number = number
+        self._chapters = []  # (chapter name, images)
+    
+    
+    def add_chapter(self, chapter, images):
+        # type: (str, list[str]) -> None
+        self._chapters.append((chapter, images))
+    
+    
+    def get_number(self):
+        # type: () -> int
+        return self._number
+    
+    
+    def get_chapters(self):
+        # type: () -> list[tuple[str, list[str]]]
+        return self._chapters
+    
+    
+    def get_nb_images(self):
+        # type: () -> int
+        return sum(len(images) for (_, images) in self._chapters)
+    
+    
+    def is_empty(self):
+        # type: () -> bool
+        return self.get_nb_images() == 0
+
+
+def get_volume_name(title, volume_number, mode):
+    # type: (str, int, VOLUME_SPLIT_MODES) -> str
+    if mode == VOLUME_SPLIT_MODES.NONE:
+        return title
+    return f'{title} - Vol {volume_number:02d}'
+
+
+# Chapters are driving the boundaries: we fill a volume with whole chapters while it's possible,
+# and only cut inside a chapter if it's bigger than a volume.
+# NOTE: SIZE cannot be known before conversion, so it's a single volume here and the worker is splitting it
+def plan_volumes(chapters, images_by_chapter, mode, max_images=0):
+    # type: (list[str], dict[str, list[str]], VOLUME_SPLIT_MODES, int) -> list[Volume]
+    volumes = [Volume(1)]
+    
+    if mode == VOLUME_SPLIT_MODES.CHAPTERS:
+        for chapter in chapters:
+            if not volumes[-1].is_empty():
+                volumes.append(Volume(len(volumes) + 1))
+            volumes[-1].add_chapter(chapter, images_by_chapter[chapter])
+    
+    elif mode == VOLUME_SPLIT_MODES.IMAGES and max_images > 0:
+        for chapter in chapters:
+            images = images_by_chapter[chapter]
+            # The whole chapter cannot fit in the current volume, but can in a new one
+            if not volumes[-1].is_empty() and volumes[-1].get_nb_images() + len(images) > max_images:
+                volumes.append(Volume(len(volumes) + 1))
+            # Too big chapter: must be cut
+            while len(images) > max_images:
+                volumes[-1].add_chapter(chapter, images[:max_images])
+                images = images[max_images:]
+                volumes.append(Volume(len(volumes) + 1))
+            if images:
+                volumes[-1].add_chapter(chapter, images)
+    
+    else:
+        for chapter in chapters:
+            volumes[-1].add_chapter(chapter, images_by_chapter[chapter])
+    
+    return [volume for volume in volumes if not volume.is_empty()] or volumes[:1]
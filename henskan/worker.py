@@ -16,129 +16,92 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import shutil
 import time
-import traceback
-from typing import Any
-
-from PyQt6.QtCore import QObject, pyqtSignal, QThread, QUrl
-from PyQt6.QtGui import QDesktopServices
 
 from .archive import ARCHIVE_FORMATS
 from .archive_cbz import ArchiveCBZ
 from .archive_pdf import ArchivePDF
-from .image import EReaderData, convert_image, save_image, is_splitable
-from .parameters import parameters, UNWANTED, DELETED
+from .budget import BUDGET_SAMPLE_SOURCES, choose_encoder, get_budget_encoders
+from .encoders import get_data_extension
+from .image import EReaderData
+from .job import ConversionJob
+from .log import get_logger
+from .profiling import Profiler
+from .util import spread_sample
+from .volume import VOLUME_SPLIT_MODES, Volume, plan_volumes, get_volume_name
 
+logger = get_logger(__name__)
 
-class Worker(QObject):
-    updateProgress = pyqtSignal(int)  # will be called
-    
-    _progress_text: Any
-    _ui_controller: Any
-    
-    
-    def add_ui_controller(self, ui_controller):
-        self._ui_controller = ui_controller
-    
-    
-    def add_progress_text(self, progress_text_dom):
-        self._progress_text = progress_text_dom
+
+# Write the volumes of a job, in the conversion service thread: the pages are converted by the service
+# processes, we only put them in the archives (in order) and update the job progress
+class Worker(object):
+    def __init__(self, job, service):
+        # type: (ConversionJob, ConversionService) -> None
+        self._job = job
+        self._service = service
+        self._archive = None
+        self._book_path = ''
+        self._page_number = 0
+        self._archive_size = 0
+        self._volume_number = 0
+        self._total_size = 0
+        self._total_nb_pages = 0
+        self._max_volume_size = 0  # pages bytes of the biggest volume, for the size budget report
+        self._profiler = Profiler()  # by job, several jobs can run at the same time
     
     
     def set_progress_text(self, text):
-        self._progress_text.setProperty("text", text)
+        # type: (str) -> None
+        self._job.update_progress(self._job.get_nb_done_images(), text)
+        self._service.notify(self._job)
     
     
-    def _convert_and_save(self, source, target, split_right=False, split_left=False):
-        # type: (str, str, bool, bool) -> None
-        begin = time.time()
-        
-        converted_images = convert_image(source, split_right=split_right, split_left=split_left)
-        
-        if split_right:
-            print(f"  - Split right {source}")
-        if split_left:
-            print(f"  - Split left  {source}")
-        
-        print(f"* convert for {source} => {target}({len(converted_images)})")
-        
-        # If we have only one image, we can directly use the target
-        if len(converted_images) == 1:
-            try:
-                save_image(converted_images[0], target)
-            except:
-                print(f'convertAndSave:: ERROR in saveImage: {traceback.format_exc()}')
-                return
+    def _save_pages(self, source, datas):
+        # type: (str, list[bytes]) -> None
+        # Pages are encoded in memory and directly given to the archive, no more temporary files
+        for data in datas:
             if self._archive is not None:
-                self._archive.add(target)
-        
-        else:
-            print(f"* convert2 for {target} => {converted_images}")
-            base_target = target.replace('.png', '')
-            for (idx, converted_image) in enumerate(converted_images):
-                n_target = '%s_%04d.png' % (base_target, idx)
-                print(f"Want to saves {converted_image} with target: {n_target}")
-                try:
-                    save_image(converted_image, n_target)
-                except:
-                    print(f'convertAndSave:: ERROR in saveImage: {traceback.format_exc()}')
-                    return
-                if self._archive is not None:
-                    self._archive.add(n_target)
-        
-        print(f" * Convert & save in {time.time() - begin:.3f}s for {target}")
+                with self._profiler.stage('archive-add'):
+                    # the page format is the profile encoder one (png, jpg or webp)
+                    self._archive.add_page(self._page_number, '%05d.%s' % (self._page_number, get_data_extension(data)), data)
+            self._page_number += 1
+            self._archive_size += len(data)
+            self._total_size += len(data)
+            self._total_nb_pages += 1
+        logger.debug('saved %s page(s) for %s', len(datas), source)
     
     
-    def _tick(self, image_path):
-        index = self._index_value
-        pages_split = self._split_page_offset
-        target = os.path.join(self._book_path, '%05d.png' % (index + pages_split))
-        source = image_path  # parameters._images[index]
-        
-        if index == 0:
-            try:
-                if not os.path.isdir(self._book_path):
-                    os.makedirs(self._book_path)
-            except OSError:
-                print(f'Cannot create directory {self._book_path} {traceback.format_exc()}')
-                raise
-        
-        print(f'Processing {os.path.split(source)[1]}...')
-        
+    # Time spent in each stage of the conversion, so we can see what was slow for this run. It is only
+    # saved if the service has a profile path (the application one), not by the tests
+    def _export_profile(self, nb_images, elapsed):
+        # type: (int, float) -> None
+        logger.info('Time by stage:\n%s', self._profiler.get_summary())
+        profile_path = self._service.get_profile_path()
+        if profile_path is None:
+            return
+        extra = {
+            'title':        self._job.get_title(),
+            'device':       self._job.get_device(),
+            'is_webtoon':   self._job.is_webtoon(),
+            'nb_images':    nb_images,
+            'nb_pages':     self._total_nb_pages,
+            'nb_processes': self._service.get_nb_processes(),
+            'size_budget':  self._job.get_size_budget_bytes(),
+            'predicted_size': self._job.get_predicted_size(),
+            'max_volume_size': self._max_volume_size,
+            'elapsed':      round(elapsed, 3),
+        }
         try:
-            # Asked for split: maybe we cannot
-            if parameters.is_split_left_then_right() or parameters.is_split_right_then_left():
-                can_be_split = is_splitable(source)  # is image large enough to be split?
-                if can_be_split:
-                    # Generate 2 images: right, then left
-                    if parameters.is_split_right_then_left():
-                        self._convert_and_save(source, target, split_right=True)
-                        
-                        # Change target for left page
-                        target = os.path.join(self._book_path, '%05d.png' % (index + pages_split + 1))
-                        self._split_page_offset += 1
-                        self._convert_and_save(source, target, split_left=True)
-                    
-                    # just the other order
-                    else:
-                        self._convert_and_save(source, target, split_left=True)
-                        
-                        # Change target for left page
-                        target = os.path.join(self._book_path, '%05d.png' % (index + pages_split + 1))
-                        self._split_page_offset += 1
-                        self._convert_and_save(source, target, split_right=True)
-                
-                else:  # simple page (un-splitable) on a split manga
-                    self._convert_and_save(source, target)
-            else:
-                # Convert page
-                self._convert_and_save(source, target)
-        
-        except RuntimeError:
-            raise RuntimeError(f'Error while processing {source} {traceback.format_exc()}')
-        
-        self._index_value += 1
+            self._profiler.export_json(profile_path, extra=extra)
+            logger.info('Profile saved in %s', profile_path)
+        except OSError as exp:
+            logger.warning('Cannot save profile in %s: %s', profile_path, exp)
+    
+    
+    def _display_finalize_progress(self, done, total):
+        # type: (int, int) -> None
+        self.set_progress_text(f'Finalizing {os.path.basename(self._book_path)}: {done}/{total}')
     
     
     def _display_sec_into_humain(self, sec):
@@ -151,76 +114,141 @@ class Worker(QObject):
             return f'{sec / 3600:.0f}h'
     
     
-    def run(self):
-        self._index_value = 0
-        self._split_page_offset = 0
-        
-        directory = parameters.get_output_directory()
-        self._split_page_offset = 0
-        self._book_path = os.path.join(directory, parameters.get_title())
+    def _open_archive(self, volume_number):
+        # type: (int) -> None
+        name = get_volume_name(self._job.get_title(), volume_number, self._job.get_volume_split_mode())
+        self._book_path = os.path.join(self._job.get_output_directory(), name)
+        self._page_number = 0
+        self._archive_size = 0
+        self._volume_number = volume_number
         self._archive = None
-        device = parameters.get_device()
+        device = self._job.get_device()
         output_format = EReaderData.get_archive_format(device)
         if ARCHIVE_FORMATS.CBZ == output_format:
-            self._archive = ArchiveCBZ(self._book_path)
+            self._archive = ArchiveCBZ(self._book_path, name, deflate_level=EReaderData.get_profile(device).get_deflate_level(),
+                                       nb_deflate_threads=self._service.get_nb_archive_threads())
         elif ARCHIVE_FORMATS.PDF == output_format:
-            self._archive = ArchivePDF(self._book_path, parameters.get_title(), parameters.get_device())
+            self._archive = ArchivePDF(self._book_path, name, device)
+    
+    
+    def _close_archive(self):
+        if self._archive is not None:
+            with self._profiler.stage('archive-close'):
+                self._archive.close(progress_callback=self._display_finalize_progress)
+            self._archive = None
+        self._max_volume_size = max(self._max_volume_size, self._archive_size)
+    
+    
+    # Only the current volume is removed, the already closed ones are complete
+    def _abort_archive(self):
+        if self._archive is not None:
+            self._archive.abort()
+            self._archive = None
+    
+    
+    # In SIZE mode we cannot know the volumes before the conversion, so we look at the size
+    # already written, and the mean page size to guess if the next images will fit
+    def _is_volume_full(self, nb_next_images, nb_converted_images):
+        # type: (int, int) -> bool
+        if self._job.get_volume_split_mode() != VOLUME_SPLIT_MODES.SIZE or self._archive_size == 0:
+            return False
+        max_bytes = self._job.get_volume_max_bytes()
+        if max_bytes <= 0:
+            return False
+        mean_size_by_image = self._total_size / max(1, nb_converted_images)
+        return self._archive_size + mean_size_by_image * nb_next_images > max_bytes
+    
+    
+    # A sample of the sources is converted (by the service processes) and measured with each encoder, then
+    # all the pages are encoded with the best looking one that fits in the budget
+    def _apply_size_budget(self, volumes):
+        # type: (list[Volume]) -> None
+        job = self._job
+        if job.get_volume_split_mode() == VOLUME_SPLIT_MODES.SIZE:
+            logger.info('Size budget ignored for %s: the volumes are already split by size', job.get_title())
+            return
+        max_bytes = job.get_size_budget_bytes()
+        sources = [image_path for volume in volumes for (_, images) in volume.get_chapters() for image_path in images]
+        sample = spread_sample(sources, BUDGET_SAMPLE_SOURCES)
+        self.set_progress_text(f'Estimating the size of {job.get_title()}')
+        encoders = get_budget_encoders(EReaderData.get_profile(job.get_device()))
+        with self._profiler.stage('size-budget'):
+            sample_sizes = self._service.measure_sources(job, sample, encoders)
+        nb_volume_sources = max(volume.get_nb_images() for volume in volumes)
+        encoder, predicted_size = choose_encoder(encoders, sample_sizes, nb_volume_sources, max_bytes)
+        job.set_budget_encoder(encoder, predicted_size)
+        logger.info('Size budget of %s MB by file: using %s, %.1f MB predicted for the biggest file', max_bytes // (1024 * 1024), encoder,
+                    predicted_size / (1024 * 1024))
+    
+    
+    def _next_volume(self):
+        self._close_archive()
+        self._open_archive(self._volume_number + 1)
+    
+    
+    def run(self):
+        job = self._job
         
-        # We did finish the setup, we can now save the parameters
-        parameters.save_parameters()
-        self._ui_controller.start_converting()
+        logger.debug('Chapter & images: %s', job.get_images_by_chapter())
         
-        # sort images before processing
-        parameters.sort_images()
+        # Chapters are the default boundaries of the volumes
+        volumes = plan_volumes(job.get_chapters(), job.get_images_by_chapter(), job.get_volume_split_mode(),
+                               max_images=job.get_volume_max_images())
+        logger.info('Output will be in %s volume(s)', len(volumes))
         
-        print(f'Chapter & images: {parameters._images_by_chapter}')
+        if job.get_size_budget_bytes() > 0:
+            self._apply_size_budget(volumes)
         
-        nb_images = len(parameters.get_images())
-        images_by_chapter = parameters.get_images_by_chapter()
+        nb_images = job.get_nb_images()
         start = time.time()
+        # The service is converting the next sources while we are writing the current one
+        sources = [image_path for volume in volumes for (_, images) in volume.get_chapters() for image_path in images]
+        converted_sources = self._service.iter_converted_sources(job, sources, self._profiler)
         # Now work!
         i = 0
         
-        for chapter in parameters.get_chapters():  # note: already sorted
-            images_in_chapter = images_by_chapter[chapter]  # already sorted too
-            self._archive.add_chapter(chapter)  # let the archive know we have a new chapter/tome
-            for image_path in images_in_chapter:
-                print(f' SAVING:: {chapter} => {image_path}')
-                i += 1
-                self._tick(image_path)
-                pct_float = float(i) / len(parameters.get_images())
-                pct = min(100, int(pct_float * 100))
-                self.updateProgress.emit(pct)
-                elapsed = time.time() - start
-                if i >= 5:
-                    estimated_time = elapsed / pct_float
-                    print(f'Estimated time: {estimated_time} = {elapsed} / {pct_float}')
-                    remaining_time_float = max(0.0, estimated_time - elapsed)
-                    estimated_time_str = f'Estimated time: {self._display_sec_into_humain(remaining_time_float)}'
-                else:
-                    estimated_time_str = ''
-                
-                self.set_progress_text(f'Processing {i + 1}/{nb_images}<br/>{estimated_time_str}')
-                QThread.msleep(1)
-        print(f'Worker::run::Finished processing images')
-        
-        # Close the CBZ/PDF
-        if self._archive is not None:
-            self._archive.close()
-        
-        if os.path.exists(self._book_path):
-            print(f'Cleaning temporary directory {self._book_path}')
-            shutil.rmtree(self._book_path)
-        
-        self.updateProgress.emit(100)  # Be sure to round to 100 the update
-        self.set_progress_text(f'Finish after {self._display_sec_into_humain(time.time() - start)}')
-        
-        # Show the output directory so the user can quickly access it
-        QDesktopServices.openUrl(QUrl.fromLocalFile(directory))
-        
-        # If webtoon, also show useful directory to analyse the splits
-        if parameters.is_webtoon():
-            QDesktopServices.openUrl(QUrl.fromLocalFile(UNWANTED))
-            QDesktopServices.openUrl(QUrl.fromLocalFile(DELETED))
-        
-        print(f'Worker::run::Exiting')
+        try:
+            for volume in volumes:
+                self._open_archive(self._volume_number + 1)
+                for chapter, images_in_chapter in volume.get_chapters():  # note: already sorted
+                    # Do not cut a chapter if it can fit in the next volume
+                    if self._is_volume_full(len(images_in_chapter), i):
+                        self._next_volume()
+                    self._archive.add_chapter(chapter)  # let the archive know we have a new chapter/tome
+                    for image_path in images_in_chapter:
+                        job.checkpoint()  # wait here if paused, stop here if cancelled
+                        if self._is_volume_full(1, i):  # chapter bigger than a volume
+                            self._next_volume()
+                            self._archive.add_chapter(chapter)
+                        logger.debug('saving %s => %s', chapter, image_path)
+                        self._save_pages(image_path, next(converted_sources))
+                        i += 1
+                        pct_float = float(i) / nb_images
+                        elapsed = time.time() - start
+                        if i >= 5:
+                            estimated_time = elapsed / pct_float
+                            remaining_time_float = max(0.0, estimated_time - elapsed)
+                            estimated_time_str = f'Estimated time: {self._display_sec_into_humain(remaining_time_float)}'
+                        else:
+                            estimated_time_str = ''
+                        
+                        job.update_progress(i, f'Processing {min(i + 1, nb_images)}/{nb_images}<br/>{estimated_time_str}')
+                        self._service.notify(job)
+                # Each volume is closed before the next one, so it's available as soon as possible
+                self._close_archive()
+        except BaseException:
+            # cancelled or failed: no half written file in the output directory
+            self._abort_archive()
+            raise
+        finally:
+            converted_sources.close()  # on error, the sources in advance are cancelled
+        logger.info('Finished processing %s images in %.3fs', nb_images, time.time() - start)
+        
+        self._export_profile(nb_images, time.time() - start)
+        
+        finish_text = f'Finish after {self._display_sec_into_humain(time.time() - start)}'
+        if job.get_predicted_size() > 0:
+            logger.info('Size budget: %.1f MB predicted, %.1f MB for the biggest file', job.get_predicted_size() / (1024 * 1024),
+                        self._max_volume_size / (1024 * 1024))
+            finish_text += f'<br/>{self._max_volume_size / (1024 * 1024):.1f} MB (predicted {job.get_predicted_size() / (1024 * 1024):.1f} MB)'
+        job.update_progress(i, finish_text)
@@ -0,0 +1,154 @@
+# Copyright 2020+     Gabès Jean (naparuba@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Minimal ZIP writer, only for what Henskan need: entries that are already compressed (or stored) with their crc,
+# like the pages deflated by the threads of the CBZ archive, or copied from another zip without inflate/deflate.
+# ZipFile cannot be given compressed data, so we write the local headers and the central directory ourselves:
+#  * each entry is written (local header + data) when added, only its central directory record is kept in memory
+#  * the central directory is written at the end, with the zip64 records when the file is too big for zip32
+
+import struct
+import time
+from zipfile import ZIP_STORED
+
+# Struct of the zip records, without their variable parts (name, extra fields)
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+LOCAL_HEADER_SIGNATURE = b'PK\003\004'
+_CENTRAL_DIRECTORY = struct.Struct('<4s4B4HL2L5H2L')
+_CENTRAL_DIRECTORY_SIGNATURE = b'PK\001\002'
+_END_OF_CENTRAL_DIRECTORY = struct.Struct('<4s4H2LH')
+_END_OF_CENTRAL_DIRECTORY_SIGNATURE = b'PK\005\006'
+_ZIP64_END_OF_CENTRAL_DIRECTORY = struct.Struct('<4sQ2H2L4Q')
+_ZIP64_END_OF_CENTRAL_DIRECTORY_SIGNATURE = b'PK\006\006'
+_ZIP64_LOCATOR = struct.Struct('<4sLQL')
+_ZIP64_LOCATOR_SIGNATURE = b'PK\006\007'
+_ZIP64_EXTRA_ID = 0x0001
+
+# Over theses, the sizes/offsets/count are in the zip64 records (same limits as ZipFile)
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_FILECOUNT_LIMIT = (1 << 16) - 1
+
+_VERSION = 20  # deflate
+_ZIP64_VERSION = 45
+_UTF8_FLAG = 0x800
+_UNIX_SYSTEM = 3  # for the file attributes
+_FILE_ATTRIBUTES = 0o600 << 16  # -rw------- like ZipFile.writestr
+
+
+def _get_dos_date_time(date_time):
+    # type: (tuple[int, int, int, int, int, int]) -> tuple[int, int]
+    year, month, day, hour, minute, second = date_time
+    return (max(0, year - 1980) << 9) | (month << 5) | day, (hour << 11) | (minute << 5) | (second // 2)
+
+
+class _Entry(object):
+    def __init__(self, encoded_name, flags, compress_type, dos_date, dos_time, crc, compress_size, file_size, header_offset):
+        # type: (bytes, int, int, int, int, int, int, int, int) -> None
+        self.encoded_name = encoded_name
+        self.flags = flags
+        self.compress_type = compress_type
+        self.dos_date = dos_date
+        self.dos_time = dos_time
+        self.crc = crc
+        self.compress_size = compress_size
+        self.file_size = file_size
+        self.header_offset = header_offset
+
+
+class ZipWriter(object):
+    def __init__(self, path):
+        # type: (str) -> None
+        self._entries = []  # type: list[_Entry]
+        self._file = open(path, 'wb')
+    
+    
+    # entry_data is written as it is: compressed with compress_type (ZIP_STORED/ZIP_DEFLATED raw stream), crc and
+    # file_size are the ones of the uncompressed data
+    def write_entry(self, name, crc, entry_data, compress_type=ZIP_STORED, file_size=None, date_time=None):
+        # type: (str, int, bytes, int, int|None, tuple|None) -> None
+        if file_size is None:
+            file_size = len(entry_data)
+        if date_time is None:
+            date_time = time.localtime(time.time())[:6]
+        try:
+            encoded_name, flags = name.encode('ascii'), 0
+        except UnicodeEncodeError:
+            encoded_name, flags = name.encode('utf-8'), _UTF8_FLAG
+        dos_date, dos_time = _get_dos_date_time(date_time)
+        entry = _Entry(encoded_name, flags, compress_type, dos_date, dos_time, crc, len(entry_data), file_size, self._file.tell())
+        
+        extra = b''
+        version = _VERSION
+        compress_size, file_size = entry.compress_size, entry.file_size
+        if compress_size > ZIP64_LIMIT or file_size > ZIP64_LIMIT:
+            extra = struct.pack('<2H2Q', _ZIP64_EXTRA_ID, 16, file_size, compress_size)
+            compress_size = file_size = 0xFFFFFFFF
+            version = _ZIP64_VERSION
+        self._file.write(LOCAL_HEADER.pack(LOCAL_HEADER_SIGNATURE, version, 0, flags, compress_type, dos_time, dos_date, crc,
+                                           compress_size, file_size, len(encoded_name), len(extra)))
+        self._file.write(encoded_name)
+        self._file.write(extra)
+        self._file.write(entry_data)
+        self._entries.append(entry)
+    
+    
+    def _write_central_directory_record(self, entry):
+        # type: (_Entry) -> None
+        zip64_fields = []
+        file_size, compress_size, header_offset = entry.file_size, entry.compress_size, entry.header_offset
+        if file_size > ZIP64_LIMIT:
+            zip64_fields.append(file_size)
+            file_size = 0xFFFFFFFF
+        if compress_size > ZIP64_LIMIT:
+            zip64_fields.append(compress_size)
+            compress_size = 0xFFFFFFFF
+        if header_offset > ZIP64_LIMIT:
+            zip64_fields.append(header_offset)
+            header_offset = 0xFFFFFFFF
+        extra = b''
+        version = _VERSION
+        if zip64_fields:
+            extra = struct.pack('<2H%dQ' % len(zip64_fields), _ZIP64_EXTRA_ID, 8 * len(zip64_fields), *zip64_fields)
+            version = _ZIP64_VERSION
+        self._file.write(_CENTRAL_DIRECTORY.pack(_CENTRAL_DIRECTORY_SIGNATURE, version, _UNIX_SYSTEM, version, 0, entry.flags, entry.compress_type,
+                                                 entry.dos_time, entry.dos_date, entry.crc, compress_size, file_size,
+                                                 len(entry.encoded_name), len(extra), 0, 0, 0, _FILE_ATTRIBUTES, header_offset))
+        self._file.write(entry.encoded_name)
+        self._file.write(extra)
+    
+    
+    def close(self):
+        directory_offset = self._file.tell()
+        for entry in self._entries:
+            self._write_central_directory_record(entry)
+        directory_end = self._file.tell()
+        nb_entries, directory_size = len(self._entries), directory_end - directory_offset
+        
+        if nb_entries > ZIP_FILECOUNT_LIMIT or directory_offset > ZIP64_LIMIT or directory_size > ZIP64_LIMIT:
+            self._file.write(_ZIP64_END_OF_CENTRAL_DIRECTORY.pack(_ZIP64_END_OF_CENTRAL_DIRECTORY_SIGNATURE,
+                                                                  _ZIP64_END_OF_CENTRAL_DIRECTORY.size - 12, _ZIP64_VERSION, _ZIP64_VERSION,
+                                                                  0, 0, nb_entries, nb_entries, directory_size, directory_offset))
+            self._file.write(_ZIP64_LOCATOR.pack(_ZIP64_LOCATOR_SIGNATURE, 0, directory_end, 1))
+            nb_entries = min(nb_entries, 0xFFFF)
+            directory_size = min(directory_size, 0xFFFFFFFF)
+            directory_offset = min(directory_offset, 0xFFFFFFFF)
+        self._file.write(_END_OF_CENTRAL_DIRECTORY.pack(_END_OF_CENTRAL_DIRECTORY_SIGNATURE, 0, 0, nb_entries, nb_entries,
+                                                        directory_size, directory_offset, 0))
+        self._file.close()
+    
+    
+    # Only the file descriptor is closed, the caller is removing the unfinished file
+    def abort(self):
+        self._file.close()
@@ -1,3 +1,4 @@
+import multiprocessing
 import os
 import sys
 
@@ -9,9 +10,13 @@ from PyQt6.QtQml import QQmlApplicationEngine
 
 from henskan.ui_controller import UIController
 from henskan.file_path_model import FilePathModel
+from henskan.service import ConversionService
+from henskan.parameters import LAST_RUN_PROFILE_PATH
 import henskan
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # the conversion processes of the packaged app
+    
     lib_dir = os.path.dirname(henskan.__file__)
     app = QApplication(sys.argv)
     app.setWindowIcon(QIcon(os.path.join(lib_dir, 'img', 'splash.jpg')))
@@ -24,8 +29,13 @@ if __name__ == "__main__":
     file_path_model = FilePathModel()
     
     
+    # Conversion processes are started now, they will be warm when the user will click on convert
+    conversion_service = ConversionService(profile_path=LAST_RUN_PROFILE_PATH)
+    conversion_service.start()
+    app.aboutToQuit.connect(conversion_service.stop)
+    
     # Create the backend object
-    ui_controller = UIController(engine, file_path_model)
+    ui_controller = UIController(engine, file_path_model, conversion_service)
     print(f"UI Controller: {ui_controller}")
     
     # Expose the backend object to QML
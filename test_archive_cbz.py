@@ -0,0 +1,221 @@
+import os
+import random
+import tempfile
+import threading
+import unittest
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+from henskan import zip_writer
+from henskan.archive_cbz import ArchiveCBZ, COMIC_INFO_NAME
+
+
+class _ArchiveTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._book_path = os.path.join(self._tmp_dir.name, 'book')
+    
+    
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+    
+    
+    def _read_names(self):
+        with ZipFile(self._book_path + '.cbz') as zf:
+            return zf.namelist()
+    
+    
+    def _read_comic_info(self):
+        with ZipFile(self._book_path + '.cbz') as zf:
+            return zf.read(COMIC_INFO_NAME).decode('utf-8')
+
+
+class TestArchiveCBZ(_ArchiveTestCase):
+    
+    def test_pages_are_written_in_order(self):
+        archive = ArchiveCBZ(self._book_path, 'Book', pending_window=4)
+        page_numbers = list(range(20))
+        random.Random(42).shuffle(page_numbers)
+        # several producers, each one giving pages in a random order
+        producers = [threading.Thread(target=lambda numbers: [archive.add_page(n, '%05d.png' % n, b'page %d' % n) for n in sorted(numbers)],
+                                      args=(page_numbers[i::3],)) for i in range(3)]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join()
+        archive.close()
+        
+        names = self._read_names()
+        self.assertEqual(['%05d.png' % n for n in range(20)], names[:-1])
+        self.assertEqual(COMIC_INFO_NAME, names[-1])
+        with ZipFile(self._book_path + '.cbz') as zf:
+            self.assertEqual(b'page 7', zf.read('00007.png'))
+    
+    
+    def test_close_progress_without_lock(self):
+        archive = ArchiveCBZ(self._book_path, comic_info=False)
+        for page_number in range(3):
+            archive.add_page(page_number, '%05d.png' % page_number, b'x')
+        is_lock_free = []
+        
+        def _try_lock():
+            is_lock_free.append(archive._condition.acquire(blocking=False))
+            if is_lock_free[-1]:
+                archive._condition.release()
+        
+        def _progress(done, total):
+            # the writer lock must be free while we are in the callback (the lock is reentrant: try from another thread)
+            thread = threading.Thread(target=_try_lock)
+            thread.start()
+            thread.join()
+        
+        archive.close(progress_callback=_progress)
+        self.assertTrue(all(is_lock_free))
+    
+    
+    def test_duplicate_page(self):
+        archive = ArchiveCBZ(self._book_path)
+        archive.add_page(0, '00000.png', b'0')
+        with self.assertRaises(ValueError):
+            archive.add_page(0, '00000.png', b'0')
+        archive.close()
+    
+    
+    def test_chapters_bookmarks(self):
+        archive = ArchiveCBZ(self._book_path, 'Book')
+        archive.add_chapter('Tome 1')
+        archive.add_page(0, '00000.png', b'0')
+        archive.add_page(1, '00001.png', b'1')
+        archive.add_chapter('Tome 2')
+        archive.add_page(2, '00002.png', b'2')
+        archive.close()
+        
+        comic_info = self._read_comic_info()
+        self.assertIn('<Title>Book</Title>', comic_info)
+        self.assertIn('<PageCount>3</PageCount>', comic_info)
+        self.assertIn('<Page Image="0" Bookmark="Tome 1" />', comic_info)
+        self.assertIn('<Page Image="2" Bookmark="Tome 2" />', comic_info)
+    
+    
+    def test_without_comic_info(self):
+        archive = ArchiveCBZ(self._book_path, comic_info=False)
+        archive.add_page(0, '00000.png', b'0')
+        archive.close()
+        self.assertEqual(['00000.png'], self._read_names())
+    
+    
+    def test_missing_page_does_not_block_close(self):
+        archive = ArchiveCBZ(self._book_path, comic_info=False)
+        archive.add_page(0, '00000.png', b'0')
+        archive.add_page(2, '00002.png', b'2')
+        archive.close()
+        self.assertEqual(['00000.png', '00002.png'], self._read_names())
+    
+    
+    def test_concurrent_add(self):
+        archive = ArchiveCBZ(self._book_path, comic_info=False, pending_window=2)
+        paths = []
+        for idx in range(12):
+            paths.append(os.path.join(self._tmp_dir.name, 'image%02d.png' % idx))
+            with open(paths[-1], 'wb') as f:
+                f.write(b'%d' % idx)
+        producers = [threading.Thread(target=lambda names: [archive.add(name) for name in names], args=(paths[i::3],)) for i in range(3)]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join()
+        archive.close()
+        self.assertEqual(sorted(os.path.basename(path) for path in paths), sorted(self._read_names()))
+    
+    
+    def test_abort_wakes_up_blocked_producers(self):
+        archive = ArchiveCBZ(self._book_path, pending_window=2)
+        errors = []
+        
+        def _add_after_hole():
+            try:
+                archive.add_page(5, '00005.png', b'5')  # the page 0 never comes
+            except RuntimeError as exp:
+                errors.append(exp)
+        
+        producer = threading.Thread(target=_add_after_hole)
+        producer.start()
+        producer.join(0.2)
+        self.assertTrue(producer.is_alive())
+        archive.abort()
+        producer.join(5)
+        self.assertFalse(producer.is_alive())
+        self.assertEqual(1, len(errors))
+    
+    
+    def test_abort_removes_the_file(self):
+        archive = ArchiveCBZ(self._book_path)
+        for page_number in range(5):
+            archive.add_page(page_number, '%05d.png' % page_number, b'x' * 1000)
+        archive.abort()
+        self.assertFalse(os.path.exists(self._book_path + '.cbz'))
+
+
+class TestArchiveCBZDeflate(_ArchiveTestCase):
+    
+    def test_deflated_pages(self):
+        archive = ArchiveCBZ(self._book_path, 'Book', pending_window=4, deflate_level=6, nb_deflate_threads=3)
+        pages = [b'page %d ' % n * 1000 for n in range(20)]
+        page_numbers = list(range(20))
+        random.Random(42).shuffle(page_numbers)
+        producers = [threading.Thread(target=lambda numbers: [archive.add_page(n, '%05d.png' % n, pages[n]) for n in sorted(numbers)],
+                                      args=(page_numbers[i::3],)) for i in range(3)]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join()
+        archive.add_page(20, '00020.jpg', os.urandom(1000))  # not smaller once deflated
+        archive.close()
+        
+        with ZipFile(self._book_path + '.cbz') as zf:
+            self.assertIsNone(zf.testzip())  # crc are ok
+            self.assertEqual(['%05d.png' % n for n in range(20)] + ['00020.jpg', COMIC_INFO_NAME], zf.namelist())
+            self.assertEqual(pages[7], zf.read('00007.png'))
+            self.assertEqual(ZIP_DEFLATED, zf.getinfo('00007.png').compress_type)
+            self.assertLess(zf.getinfo('00007.png').compress_size, len(pages[7]))
+            self.assertEqual(ZIP_STORED, zf.getinfo('00020.jpg').compress_type)
+            self.assertIn('<PageCount>21</PageCount>', zf.read(COMIC_INFO_NAME).decode('utf-8'))
+    
+    
+    def test_bad_level(self):
+        with self.assertRaises(ValueError):
+            ArchiveCBZ(self._book_path, deflate_level=10)
+
+
+class TestZipWriter(_ArchiveTestCase):
+    
+    def tearDown(self):
+        zip_writer.ZIP64_LIMIT = (1 << 31) - 1
+        zip_writer.ZIP_FILECOUNT_LIMIT = (1 << 16) - 1
+        super().tearDown()
+    
+    
+    def _write_book(self, pages):
+        archive = ArchiveCBZ(self._book_path, 'Book', comic_info=False, deflate_level=6, nb_deflate_threads=2)
+        for page_number, data in enumerate(pages):
+            archive.add_page(page_number, '%05d_été.png' % page_number, data)
+        archive.close()
+        with ZipFile(self._book_path + '.cbz') as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(['%05d_été.png' % n for n in range(len(pages))], zf.namelist())
+            self.assertEqual(pages, [zf.read(name) for name in zf.namelist()])
+    
+    
+    def test_zip32(self):
+        self._write_book([b'page %d ' % n * 1000 for n in range(5)] + [os.urandom(1000)])
+    
+    
+    def test_zip64(self):
+        # a few small pages are enough to have the sizes, offsets and count over the limits
+        zip_writer.ZIP64_LIMIT = 100
+        zip_writer.ZIP_FILECOUNT_LIMIT = 3
+        self._write_book([b'page %d ' % n * 50 for n in range(5)] + [os.urandom(1000)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import io
+import os
+import re
+import tempfile
+import unittest
+
+from PIL import Image
+
+from henskan import pdf_writer
+from henskan.pdf_writer import PDFWriter, get_pdf_image
+
+
+def _encode(image, image_format, **params):
+    with io.BytesIO() as buffer:
+        image.save(buffer, format=image_format, **params)
+        return buffer.getvalue()
+
+
+class TestPDFWriter(unittest.TestCase):
+    
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._pdf_path = os.path.join(self._tmp_dir.name, 'book.pdf')
+    
+    
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+    
+    
+    def test_png_idat_is_not_recompressed(self):
+        image = Image.linear_gradient('L').resize((60, 80))
+        data = _encode(image, 'PNG')
+        pdf_image = get_pdf_image(data)
+        self.assertIn(b'/Predictor 15', pdf_image.dictionary)
+        self.assertIn(pdf_image.stream, data)
+    
+    
+    def test_palette_png_is_indexed(self):
+        image = Image.linear_gradient('L').resize((60, 80)).quantize(16)
+        pdf_image = get_pdf_image(_encode(image, 'PNG'))
+        self.assertIn(b'/Indexed /DeviceGray', pdf_image.dictionary)
+        self.assertIn(b'/BitsPerComponent 4', pdf_image.dictionary)
+    
+    
+    def test_jpeg_passthrough(self):
+        data = _encode(Image.new('RGB', (60, 80), 'red'), 'JPEG')
+        pdf_image = get_pdf_image(data)
+        self.assertIn(b'/DCTDecode', pdf_image.dictionary)
+        self.assertEqual((60, 80), (pdf_image.width, pdf_image.height))
+        self.assertEqual(data, pdf_image.stream)
+    
+    
+    def test_other_formats_are_decoded(self):
+        data = _encode(Image.new('RGBA', (60, 80), 'blue'), 'PNG')
+        pdf_image = get_pdf_image(data)
+        self.assertIn(b'/DeviceRGB', pdf_image.dictionary)
+        self.assertNotIn(b'/Predictor', pdf_image.dictionary)
+    
+    
+    def test_document_structure(self):
+        writer = PDFWriter(self._pdf_path, (60, 80), title='Tome 1 – été')
+        writer.add_outline('Chapter 1')
+        writer.add_page(_encode(Image.new('L', (60, 80), 128), 'PNG'))
+        writer.add_page(_encode(Image.new('RGB', (60, 80), 'red'), 'JPEG'))
+        writer.add_outline('Chapter 2')
+        writer.add_page(_encode(Image.new('RGB', (30, 80), 'red'), 'PNG'))
+        writer.add_outline('Empty chapter')
+        writer.close()
+        
+        with open(self._pdf_path, 'rb') as f:
+            content = f.read()
+        self.assertTrue(content.startswith(b'%PDF-1.4'))
+        self.assertIn(b'/Count 3', content)
+        self.assertIn(b'/Title (Chapter 2)', content)
+        self.assertNotIn(b'Empty chapter', content)
+        # All xref entries must point to their objects
+        xref_offset = int(re.search(rb'startxref\n(\d+)', content).group(1))
+        entries = re.findall(rb'(\d{10}) 00000 n ', content[xref_offset:])
+        for object_id, offset in enumerate(entries, start=1):
+            self.assertTrue(content[int(offset):].startswith(b'%d 0 obj' % object_id))
+    
+    
+    def test_page_tree_and_finalize_progress(self):
+        old_max_kids = pdf_writer.PAGE_TREE_MAX_KIDS
+        pdf_writer.PAGE_TREE_MAX_KIDS = 2  # so we have several levels
+        try:
+            writer = PDFWriter(self._pdf_path, (60, 80))
+            for _ in range(9):
+                writer.add_page(_encode(Image.new('L', (60, 80), 128), 'PNG'))
+            progress = []
+            writer.close(progress_callback=lambda done, total: progress.append((done, total)))
+        finally:
+            pdf_writer.PAGE_TREE_MAX_KIDS = old_max_kids
+        
+        self.assertTrue(progress)
+        self.assertEqual(progress[-1][0], progress[-1][1])
+        with open(self._pdf_path, 'rb') as f:
+            content = f.read()
+        objects = {int(object_id): body for (object_id, body) in re.findall(rb'(\d+) 0 obj\n(.*?)\nendobj', content, re.DOTALL)}
+        self.assertIn(b'/Kids [', objects[PDFWriter.PAGES_ID])
+        self.assertIn(b'/Count 9', objects[PDFWriter.PAGES_ID])
+        # each page must be in the kids of its parent, and each node count its pages
+        pages = {object_id: body for (object_id, body) in objects.items() if b'/Type /Page ' in body}
+        self.assertEqual(9, len(pages))
+        for page_id, body in pages.items():
+            parent_id = int(re.search(rb'/Parent (\d+) 0 R', body).group(1))
+            self.assertIn(b'%d 0 R' % page_id, objects[parent_id])
+        nodes = [body for body in objects.values() if b'/Type /Pages' in body]
+        self.assertTrue(all(len(re.findall(rb'\d+ 0 R', re.search(rb'/Kids \[(.*?)\]', body).group(1))) <= 2 for body in nodes))
+    
+    
+    def test_abort_removes_the_file(self):
+        writer = PDFWriter(self._pdf_path, (60, 80))
+        writer.add_page(_encode(Image.new('L', (60, 80), 128), 'PNG'))
+        writer.abort()
+        self.assertFalse(os.path.exists(self._pdf_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
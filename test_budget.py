@@ -0,0 +1,108 @@
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+
+from PIL import Image
+
+from henskan.benchmark import generate_samples
+from henskan.budget import choose_encoder, get_budget_encoders
+from henskan.encoders import JPEGEncoder, PNGEncoder, WebPEncoder
+from henskan.image import EReaderData
+from henskan.job import ConversionJob, JOB_STATES
+from henskan.parameters import ConversionSettings
+from henskan.service import ConversionService
+from henskan.util import spread_sample
+
+
+class TestChooseEncoder(unittest.TestCase):
+    
+    def setUp(self):
+        self._encoders = [PNGEncoder(), JPEGEncoder(quality=90), JPEGEncoder(quality=40)]
+        # 2 sample sources, sizes by encoder
+        self._sample_sizes = [[1000, 600, 200], [3000, 1400, 400]]
+    
+    
+    def test_first_fitting(self):
+        # 10 sources: 20000, 10000 and 3000 bytes predicted
+        self.assertEqual((self._encoders[0], 20000), choose_encoder(self._encoders, self._sample_sizes, 10, 100000))
+        self.assertEqual((self._encoders[1], 10000), choose_encoder(self._encoders, self._sample_sizes, 10, 15000))
+        # the margin: 10000 is too close to 10200
+        self.assertEqual((self._encoders[2], 3000), choose_encoder(self._encoders, self._sample_sizes, 10, 10200))
+    
+    
+    def test_nothing_fits(self):
+        self.assertEqual((self._encoders[2], 3000), choose_encoder(self._encoders, self._sample_sizes, 10, 100))
+    
+    
+    def test_no_sample(self):
+        self.assertEqual((self._encoders[0], 0), choose_encoder(self._encoders, [], 10, 100))
+    
+    
+    def test_budget_encoders(self):
+        encoders = get_budget_encoders(EReaderData.get_profile('Kobo Libra H2O'))
+        self.assertEqual('png(level=6,default)', encoders[0].get_description())
+        self.assertTrue(all(encoder.is_pdf_compatible() for encoder in get_budget_encoders(EReaderData.get_profile('Kindle 1'))))
+        self.assertFalse(any(isinstance(encoder, WebPEncoder) for encoder in encoders))
+    
+    
+    def test_spread_sample(self):
+        self.assertEqual([0, 25, 50, 75], spread_sample(list(range(100)), 4))
+        self.assertEqual([1, 2], spread_sample([1, 2], 4))
+
+
+class TestPngGreys(unittest.TestCase):
+    
+    def test_greys(self):
+        page = Image.linear_gradient('L').resize((300, 400))
+        data = PNGEncoder(greys=4).encode(page)
+        decoded = Image.open(io.BytesIO(data))
+        self.assertEqual('P', decoded.mode)
+        self.assertEqual([0, 85, 170, 255], sorted(grey for (_, grey) in decoded.convert('L').getcolors()))
+        self.assertLess(len(data), len(PNGEncoder().encode(page)))
+        with self.assertRaises(ValueError):
+            PNGEncoder(greys=32)
+
+
+class TestSizeBudgetJob(unittest.TestCase):
+    
+    @classmethod
+    def setUpClass(cls):
+        cls._tmp_dir = tempfile.TemporaryDirectory()
+        samples = generate_samples(cls._tmp_dir.name, 3)
+        cls._images_by_chapter = {'ch1': samples['manga_double'], 'ch2': samples['colour']}
+    
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmp_dir.cleanup()
+    
+    
+    def _run_job(self, title, size_budget_bytes):
+        settings = ConversionSettings('Kobo Libra H2O', False, True)
+        job = ConversionJob(title, self._tmp_dir.name, settings, list(self._images_by_chapter), self._images_by_chapter,
+                            split_right_then_left=True, size_budget_bytes=size_budget_bytes)
+        service = ConversionService(0)
+        service.start()
+        try:
+            service.add_job(job)
+            service.wait_until_idle()
+        finally:
+            service.stop()
+        self.assertEqual(JOB_STATES.DONE, job.get_state())
+        with zipfile.ZipFile(os.path.join(self._tmp_dir.name, f'{title}.cbz')) as archive:
+            return job, {info.filename: info.file_size for info in archive.infolist() if info.filename != 'ComicInfo.xml'}
+    
+    
+    def test_budget(self):
+        large_job, large_pages = self._run_job('large_budget', 100 * 1024 * 1024)
+        self.assertGreater(large_job.get_predicted_size(), 0)
+        self.assertIn('png(level=6,default)', repr(large_job.get_settings()))  # the profile encoder fits
+        self.assertTrue(all(name.endswith('.png') for name in large_pages))
+        
+        # nothing fits in 1 byte: the smallest encoder of the sample
+        small_job, small_pages = self._run_job('small_budget', 1)
+        self.assertNotIn('png(level=6,default)', repr(small_job.get_settings()))
+        self.assertEqual(len(large_pages), len(small_pages))
+        self.assertLess(sum(small_pages.values()), sum(large_pages.values()))
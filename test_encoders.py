@@ -0,0 +1,70 @@
+import io
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+
+from henskan.benchmark import get_sample_sources, run_encoders_benchmark, ENCODER_CANDIDATES
+from henskan.encoders import JPEGEncoder, PNGEncoder, WebPEncoder, get_data_extension, get_encoder
+from henskan.image import _apply_grey_palette, Palette16
+
+
+class TestEncoders(unittest.TestCase):
+    
+    def setUp(self):
+        self._page = _apply_grey_palette(Image.linear_gradient('L').resize((300, 400)), Palette16)
+    
+    
+    def test_formats(self):
+        for encoder, extension, mode in ((PNGEncoder(), 'png', 'P'), (JPEGEncoder(quality=80), 'jpg', 'L'), (WebPEncoder(), 'webp', 'RGB')):
+            data = encoder.encode(self._page)
+            self.assertEqual(extension, get_data_extension(data))
+            decoded = Image.open(io.BytesIO(data))
+            self.assertEqual((300, 400), decoded.size)
+            self.assertEqual(mode, decoded.mode)
+        self.assertFalse(WebPEncoder().is_pdf_compatible())
+    
+    
+    def test_progressive_jpeg(self):
+        data = JPEGEncoder(progressive=True).encode(self._page)
+        self.assertTrue(Image.open(io.BytesIO(data)).info.get('progressive'))
+        self.assertFalse(Image.open(io.BytesIO(JPEGEncoder().encode(self._page))).info.get('progressive'))
+    
+    
+    def test_get_encoder(self):
+        self.assertEqual('png(level=9,rle)', get_encoder('png', {'compress_level': 9, 'strategy': 'rle'}).get_description())
+        self.assertEqual('webp(quality=80)', get_encoder('webp', {'lossless': False, 'quality': 80}).get_description())
+        for name, options in (('bmp', None), ('jpeg', {'quality': 0}), ('jpeg', {'speed': 1}), ('png', 'fast')):
+            with self.assertRaises(ValueError):
+                get_encoder(name, options)
+
+
+class TestEncodersBenchmark(unittest.TestCase):
+    
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        for idx in range(10):
+            Image.linear_gradient('L').resize((600, 800)).save(os.path.join(self._tmp_dir.name, f'{idx}.png'))
+    
+    
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+    
+    
+    def test_sample_sources(self):
+        sources = get_sample_sources(self._tmp_dir.name, 5)
+        self.assertEqual(['0.png', '2.png', '4.png', '6.png', '8.png'], [os.path.basename(source) for source in sources])
+        self.assertEqual(10, len(get_sample_sources(self._tmp_dir.name, 20)))
+    
+    
+    def test_run(self):
+        results = run_encoders_benchmark(get_sample_sources(self._tmp_dir.name, 1), 'Kobo Libra H2O')
+        self.assertEqual(1, results['nb_pages'])
+        self.assertEqual(len(ENCODER_CANDIDATES), len(results['encoders']))
+        for encoder in results['encoders'].values():
+            self.assertGreater(encoder['bytes_per_page'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
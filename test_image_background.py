@@ -0,0 +1,46 @@
+import random
+import unittest
+
+from PIL import Image, ImageDraw
+
+from henskan.image import BACKGROUND, classify_background
+
+
+def _get_strip(background):
+    strip = Image.new('RGB', (800, 3000), background)
+    draw = ImageDraw.Draw(strip)
+    for y in range(100, 2800, 700):
+        draw.rectangle((60, y, 740, y + 500), fill=(180, 90, 40))
+    return strip
+
+
+class TestBackground(unittest.TestCase):
+    
+    def test_white(self):
+        background, confidence = classify_background(_get_strip((255, 255, 255)))
+        self.assertEqual(BACKGROUND.WHITE, background)
+        self.assertGreater(confidence, 0.5)
+    
+    
+    def test_noisy_black(self):
+        # jpeg like noise: the most common color is not exactly black
+        strip = _get_strip((0, 0, 0))
+        pixels = strip.load()
+        rnd = random.Random(0)
+        for x in range(0, 800, 3):
+            for y in range(0, 3000, 3):
+                if pixels[x, y] == (0, 0, 0):
+                    pixels[x, y] = (rnd.randint(0, 6), rnd.randint(0, 6), rnd.randint(0, 6))
+        background, confidence = classify_background(strip)
+        self.assertEqual(BACKGROUND.BLACK, background)
+        self.assertGreater(confidence, 0.5)
+        self.assertEqual(BACKGROUND.BLACK, classify_background(strip.convert('L'))[0])
+    
+    
+    def test_colored(self):
+        background, _ = classify_background(Image.new('RGB', (800, 3000), (40, 120, 200)))
+        self.assertEqual(BACKGROUND.OTHER, background)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+
+from PIL import Image, ImageDraw
+
+from henskan import image as henskan_image
+from henskan.image import AnalysisProxy, _auto_crop_image, _find_page_number_cut, set_analysis_proxy
+
+
+def _get_page():
+    page = Image.new('RGB', (1600, 2400), (255, 255, 255))
+    draw = ImageDraw.Draw(page)
+    draw.rectangle((200, 300, 1400, 2000), outline=(0, 0, 0), width=6, fill=(120, 120, 120))
+    draw.rectangle((780, 2250, 820, 2280), fill=(0, 0, 0))  # page number
+    return page
+
+
+# Same page, with the noise of a bad scan: no white part anymore, nothing can be cut
+def _get_noisy_page():
+    noise = Image.effect_noise((1600, 2400), 60).convert('RGB')
+    return Image.blend(_get_page(), noise, 0.1)
+
+
+def _get_proxy_page_number_cut(page):
+    proxy = AnalysisProxy(page)
+    cut = _find_page_number_cut(proxy.get_image(), proxy.to_proxy_variance(5.0), line_step=int(round(proxy.to_proxy_length(2))),
+                                column_step=int(round(proxy.to_proxy_length(5))))
+    return proxy.to_original_bottom_cut(cut)
+
+
+class TestAnalysisProxy(unittest.TestCase):
+    
+    def tearDown(self):
+        set_analysis_proxy(800, margin=4)
+    
+    
+    def test_box_mapping(self):
+        set_analysis_proxy(800, margin=4)
+        proxy = AnalysisProxy(_get_page())
+        self.assertEqual((534, 800), proxy.get_image().size)
+        self.assertEqual((295, 296, 1407, 2008), proxy.to_original_box((100, 100, 468, 668)))
+        # never outside the original image
+        self.assertEqual((0, 0, 1600, 2400), proxy.to_original_box((0, 0, 534, 800)))
+        self.assertEqual(26, proxy.to_original_bottom_cut(10))
+    
+    
+    def test_no_proxy(self):
+        set_analysis_proxy(0)
+        page = _get_page()
+        proxy = AnalysisProxy(page)
+        self.assertIs(page, proxy.get_image())
+        self.assertEqual((1, 2, 3, 4), proxy.to_original_box((1, 2, 3, 4)))
+    
+    
+    def test_crop_is_the_same_as_full_analysis(self):
+        set_analysis_proxy(0)
+        full_box = _auto_crop_image(_get_page()).size
+        set_analysis_proxy(800, margin=4)
+        proxy_box = _auto_crop_image(_get_page()).size
+        self.assertLessEqual(abs(full_box[0] - proxy_box[0]), 2 * henskan_image.ANALYSIS_PROXY_MARGIN)
+        self.assertLessEqual(abs(full_box[1] - proxy_box[1]), 2 * henskan_image.ANALYSIS_PROXY_MARGIN)
+        # the page number is removed in both cases
+        self.assertLess(proxy_box[1], 2000)
+    
+    
+    def test_page_number_cut_is_the_same_as_full_analysis(self):
+        set_analysis_proxy(800, margin=4)
+        page = _get_page()
+        full_cut = _find_page_number_cut(page, 5.0)
+        self.assertGreater(full_cut, 300)
+        # the proxy cut is a bit smaller (by the margin), never bigger
+        self.assertLessEqual(_get_proxy_page_number_cut(page), full_cut)
+        self.assertLessEqual(full_cut - _get_proxy_page_number_cut(page), henskan_image.ANALYSIS_PROXY_MARGIN + 3)  # + a proxy pixel
+        # the noise is averaged by the proxy, but it must not look like an empty bottom
+        noisy_page = _get_noisy_page()
+        self.assertEqual(_find_page_number_cut(noisy_page, 5.0), _get_proxy_page_number_cut(noisy_page))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+
+from henskan.image import _get_reduced_decode_min_size, _load_reduced_image
+
+
+class TestReducedDecode(unittest.TestCase):
+    
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+    
+    
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+    
+    
+    def _save(self, name, size):
+        path = os.path.join(self._tmp_dir.name, name)
+        Image.linear_gradient('L').resize(size).convert('RGB').save(path)
+        return path
+    
+    
+    def test_min_size(self):
+        self.assertEqual((750, 1000), _get_reduced_decode_min_size((2000, 3000), (600, 800), False))
+        # double page, each half must be big enough
+        self.assertEqual((1500, 1000), _get_reduced_decode_min_size((4000, 3000), (600, 800), True))
+        # landscape page will be rotated
+        self.assertEqual((1000, 750), _get_reduced_decode_min_size((4000, 3000), (600, 800), False))
+    
+    
+    def test_jpeg_draft(self):
+        path = self._save('scan.jpg', (4800, 3400))
+        image = _load_reduced_image(path, (600, 800), True)
+        self.assertEqual((2400, 1700), image.size)
+        # the device is too big to reduce
+        image = _load_reduced_image(path, (1440, 1872), True)
+        self.assertEqual((4800, 3400), image.size)
+    
+    
+    def test_png_reduce(self):
+        path = self._save('scan.png', (2400, 3200))
+        image = _load_reduced_image(path, (600, 800), False)
+        self.assertEqual((800, 1067), image.size)
+        self.assertGreaterEqual(image.size[0], 750)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import io
+import struct
+import unittest
+
+from PIL import Image, ImageDraw
+
+from henskan.image import (EReaderData, _apply_grey_palette, encode_image, _fill_image_to_whole_size, _format_image_mode, _get_palette_lut, _is_image_grey, _orient_image,
+                           Palette4, Palette15a, Palette16)
+
+
+class TestGreyDetection(unittest.TestCase):
+    
+    def test_grey_image(self):
+        image = Image.linear_gradient('L').convert('RGB')
+        self.assertTrue(_is_image_grey(image))
+        self.assertTrue(_is_image_grey(image.convert('L')))
+    
+    
+    def test_few_colors_is_still_grey(self):
+        image = Image.linear_gradient('L').convert('RGB')
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((0, 0, 255, 15), fill=(255, 0, 0))  # ~6% of red
+        self.assertTrue(_is_image_grey(image))
+        draw.rectangle((0, 0, 255, 40), fill=(255, 0, 0))  # ~16% of red
+        self.assertFalse(_is_image_grey(image))
+    
+    
+    def test_bad_image_is_not_grey(self):
+        with io.BytesIO() as buffer:
+            Image.effect_noise((256, 256), 64).convert('RGB').save(buffer, format='PNG')
+            data = buffer.getvalue()
+        truncated = Image.open(io.BytesIO(data[:len(data) // 2]))  # only fails when the pixels are read
+        self.assertFalse(_is_image_grey(truncated))
+
+
+class TestGreyPalette(unittest.TestCase):
+    
+    def test_lut_is_nearest_palette_color(self):
+        lut = _get_palette_lut(Palette4)
+        self.assertEqual(256, len(lut))
+        self.assertEqual(0, lut[0])
+        self.assertEqual(0, lut[0x2a])
+        self.assertEqual(1, lut[0x2b])
+        self.assertEqual(3, lut[255])
+        # no 0xee in this palette
+        self.assertEqual(13, _get_palette_lut(Palette15a)[0xee])
+        self.assertEqual(14, _get_palette_lut(Palette15a)[0xef])
+    
+    
+    def test_apply_palette(self):
+        image = Image.linear_gradient('L').convert('RGB')
+        indexed_image = _apply_grey_palette(image, Palette16)
+        self.assertEqual('P', indexed_image.mode)
+        self.assertEqual(Palette16, indexed_image.getpalette())
+        self.assertEqual(set(range(16)), set(indexed_image.getdata()))
+        # colors are the nearest of the palette
+        for luminance, color in zip(image.convert('L').getdata(), indexed_image.convert('L').getdata()):
+            self.assertLessEqual(abs(luminance - color), 0x11 // 2 + 1)
+
+
+class TestModePreserved(unittest.TestCase):
+    
+    def test_grey_source_stays_grey(self):
+        self.assertEqual('L', _format_image_mode(Image.new('1', (10, 10))).mode)
+        grey_palette = _apply_grey_palette(Image.linear_gradient('L'), Palette16)
+        self.assertEqual('L', _format_image_mode(grey_palette).mode)
+        self.assertEqual('RGB', _format_image_mode(Image.new('RGBA', (10, 10))).mode)
+    
+    
+    def test_fill_keeps_palette(self):
+        # Palette15a has no 0xee, its white is still 0xff
+        indexed_image = _apply_grey_palette(Image.new('L', (20, 40), 0), Palette15a)
+        filled_image = _fill_image_to_whole_size(indexed_image, (60, 80))
+        self.assertEqual('P', filled_image.mode)
+        self.assertEqual(Palette15a, filled_image.getpalette())
+        self.assertEqual(255, filled_image.convert('L').getpixel((59, 79)))
+        self.assertEqual(0, filled_image.convert('L').getpixel((10, 0)))
+        self.assertEqual('L', _fill_image_to_whole_size(Image.new('L', (20, 40)), (60, 80)).mode)
+    
+    
+    def test_orient_is_exact(self):
+        image = Image.linear_gradient('L').resize((300, 200))
+        rotated_image = _orient_image(image, (600, 800))
+        self.assertEqual((200, 300), rotated_image.size)
+        self.assertEqual(image.getpixel((299, 0)), rotated_image.getpixel((0, 0)))
+        self.assertEqual(sorted(image.getdata()), sorted(rotated_image.getdata()))
+
+
+
+# => (bit depth, color type) of the PNG header
+def _get_png_format(data):
+    _, _, bit_depth, color_type, _, _, _ = struct.unpack('>IIBBBBB', data[16:29])
+    return bit_depth, color_type
+
+
+class TestPackedPng(unittest.TestCase):
+    
+    def test_palette_page_is_4_bits(self):
+        indexed_image = _apply_grey_palette(Image.linear_gradient('L'), Palette16)
+        data = encode_image(indexed_image, EReaderData.get_profile('Kobo Libra H2O'))
+        self.assertEqual((4, 3), _get_png_format(data))
+        self.assertEqual(list(indexed_image.getdata()), list(Image.open(io.BytesIO(data)).getdata()))
+    
+    
+    def test_few_greys_page_is_packed(self):
+        image = Image.linear_gradient('L').point(lambda x: x // 32 * 32)  # 8 greys
+        data = encode_image(image)
+        self.assertEqual((4, 3), _get_png_format(data))
+        self.assertEqual(list(image.getdata()), list(Image.open(io.BytesIO(data)).convert('L').getdata()))
+        # too many greys: stays a 8 bits grey page
+        self.assertEqual((8, 0), _get_png_format(encode_image(Image.linear_gradient('L'))))
+
+
+if __name__ == '__main__':
+    unittest.main()
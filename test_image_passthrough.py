@@ -0,0 +1,111 @@
+import io
+import os
+import tempfile
+import unittest
+
+from PIL import Image, ImageDraw
+from PIL.PngImagePlugin import PngInfo
+
+from henskan.archive_cbz import ArchiveCBZ
+from henskan.benchmark import generate_samples
+from henskan.encoders import PAGE_DEVICE_KEY
+from henskan.image import EReaderData, convert_source
+from henskan.parameters import ConversionSettings
+
+DEVICE = 'Kobo Libra H2O'
+
+
+class TestPassthrough(unittest.TestCase):
+    
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._settings = ConversionSettings(DEVICE, False, False)
+    
+    
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+    
+    
+    def _save(self, name, image):
+        path = os.path.join(self._tmp_dir.name, name)
+        image.save(path)
+        return path
+    
+    
+    def _save_data(self, name, data):
+        path = os.path.join(self._tmp_dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+    
+    
+    def _get_drawing(self, size):
+        image = Image.new('L', size, 255)
+        ImageDraw.Draw(image).rectangle((40, 30, size[0] - 40, size[1] - 30), outline=0, width=8)
+        return image
+    
+    
+    def test_converted_page_is_copied(self):
+        scan = self._save('scan.png', self._get_drawing((900, 1300)))
+        data = convert_source(scan, self._settings)[0]
+        # re-export: the page is already for the device
+        converted_page = self._save_data('00000.png', data)
+        self.assertEqual([data], convert_source(converted_page, self._settings))
+    
+    
+    def test_other_pages_are_converted(self):
+        size = EReaderData.get_size(DEVICE)
+        # same size, but with white borders to crop
+        bordered = self._get_drawing((size[0] // 2, size[1] // 2))
+        page = Image.new('L', size, 255)
+        page.paste(bordered, (size[0] // 4, size[1] // 4))
+        path = self._save('bordered.png', page)
+        with open(path, 'rb') as f:
+            self.assertNotEqual([f.read()], convert_source(path, self._settings))
+        # same size, but in colors
+        colored = self._get_drawing(size).convert('RGB')
+        colored.putpixel((100, 100), (255, 0, 0))
+        path = self._save('colors.png', colored)
+        with open(path, 'rb') as f:
+            self.assertNotEqual([f.read()], convert_source(path, self._settings))
+    
+    
+    def test_converted_book_is_copied(self):
+        # real looking pages, the auto crop would find another box on them
+        samples = generate_samples(self._tmp_dir.name, 2)
+        datas = []
+        for kind in ('manga_double', 'colour'):
+            for sample in samples[kind]:
+                datas.extend(convert_source(sample, self._settings, split_right_then_left=True))
+        archive = ArchiveCBZ(os.path.join(self._tmp_dir.name, 'Tome 1'), 'Tome 1')
+        for page_number, data in enumerate(datas):
+            archive.add_page(page_number, '%05d.png' % page_number, data)
+        archive.close()
+        cbz_path = os.path.join(self._tmp_dir.name, 'Tome 1.cbz')
+        for page_number, data in enumerate(datas):
+            self.assertEqual([data], convert_source('%s/%05d.png' % (cbz_path, page_number), self._settings))
+    
+    
+    def test_page_of_another_device_is_converted(self):
+        scan = self._save('scan.png', self._get_drawing((900, 1300)))
+        page = Image.open(io.BytesIO(convert_source(scan, self._settings)[0]))
+        self.assertEqual(DEVICE, page.info[PAGE_DEVICE_KEY])
+        # same pixels, but not marked, or marked for another device
+        pnginfo = PngInfo()
+        pnginfo.add_text(PAGE_DEVICE_KEY, 'Kobo Aura HD')
+        for name, options in (('unmarked.png', {}), ('other.png', {'pnginfo': pnginfo})):
+            path = os.path.join(self._tmp_dir.name, name)
+            page.save(path, **options)
+            with open(path, 'rb') as f:
+                self.assertNotEqual([f.read()], convert_source(path, self._settings))
+    
+    
+    def test_size_budget_pages_are_not_marked(self):
+        scan = self._save('scan.png', self._get_drawing((900, 1300)))
+        settings = ConversionSettings(DEVICE, False, False, encoder=EReaderData.get_profile(DEVICE).get_encoder())
+        page = Image.open(io.BytesIO(convert_source(scan, settings)[0]))
+        self.assertNotIn(PAGE_DEVICE_KEY, page.info)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import io
+import logging
+import os
+import unittest
+
+from henskan import log
+from henskan.log import RingBufferHandler, get_logger, set_batch_mode
+
+
+class TestRingBuffer(unittest.TestCase):
+    
+    def test_dump_on_error_only(self):
+        stream = io.StringIO()
+        handler = RingBufferHandler(3, stream=stream)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger = logging.getLogger('henskan_test_ring')
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        try:
+            for idx in range(5):
+                logger.debug('page %s', idx)
+            self.assertEqual('', stream.getvalue())  # nothing displayed while all is fine
+            
+            logger.error('cannot encode')
+            dumped = stream.getvalue()
+            # only the last records are kept
+            self.assertNotIn('page 1', dumped)
+            self.assertIn('page 2', dumped)
+            self.assertIn('page 4', dumped)
+            self.assertEqual([], handler.get_records())
+        finally:
+            logger.removeHandler(handler)
+    
+    
+    def test_lazy_formatting(self):
+        class Exploding(object):
+            def __str__(self):
+                raise AssertionError('should not be formatted')
+        
+        
+        handler = RingBufferHandler(10, stream=io.StringIO())
+        logger = logging.getLogger('henskan_test_lazy')
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        try:
+            logger.debug('%s', Exploding())  # stored, but never formatted
+            self.assertEqual(1, len(handler.get_records()))
+        finally:
+            logger.removeHandler(handler)
+
+
+class TestLevels(unittest.TestCase):
+    
+    def tearDown(self):
+        os.environ.pop(log.LOG_LEVEL_ENV, None)
+        set_batch_mode(False)
+    
+    
+    def test_batch_mode_is_quiet(self):
+        logger = get_logger('test')
+        self.assertEqual('henskan.test', logger.name)
+        set_batch_mode(True)
+        self.assertEqual(log.BATCH_LEVEL, log._console_handler.level)
+        set_batch_mode(False)
+        self.assertEqual(log.DEFAULT_LEVEL, log._console_handler.level)
+    
+    
+    def test_env_level_wins(self):
+        os.environ[log.LOG_LEVEL_ENV] = 'debug'
+        set_batch_mode(True)
+        self.assertEqual(logging.DEBUG, log._console_handler.level)
+
+
+if __name__ == '__main__':
+    unittest.main()
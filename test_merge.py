@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+from henskan.archive_cbz import ArchiveCBZ, COMIC_INFO_NAME
+from henskan.merge import merge_cbz
+
+
+class TestMergeCBZ(unittest.TestCase):
+    
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+    
+    
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+    
+    
+    def _path(self, name):
+        return os.path.join(self._tmp_dir.name, name)
+    
+    
+    def _new_cbz(self, name, pages, chapters=(), deflate_level=None, comic_info=True):
+        archive = ArchiveCBZ(self._path(name), name, deflate_level=deflate_level, comic_info=comic_info)
+        for page_number, chapter in chapters:
+            archive.add_chapter(chapter, page_number)
+        for page_number, data in enumerate(pages):
+            archive.add_page(page_number, '%05d.png' % page_number, data)
+        archive.close()
+        return self._path(name) + '.cbz'
+    
+    
+    def test_merge(self):
+        first_pages = [b'first %d ' % n * 100 for n in range(3)]
+        second_pages = [b'second %d ' % n * 100 for n in range(2)]
+        first = self._new_cbz('Tome 1', first_pages, chapters=[(0, 'Chapter 1'), (2, 'Chapter 2')], deflate_level=6)
+        second = self._new_cbz('Tome 2', second_pages, comic_info=False)
+        with ZipFile(second, 'a') as zf:  # not ours: no bookmark
+            zf.writestr(COMIC_INFO_NAME, '<ComicInfo />')
+        
+        self.assertEqual(self._path('Omnibus.cbz'), merge_cbz([first, second], self._path('Omnibus')))
+        
+        with ZipFile(self._path('Omnibus.cbz')) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(['%05d.png' % n for n in range(5)] + [COMIC_INFO_NAME], zf.namelist())
+            self.assertEqual(first_pages + second_pages, [zf.read('%05d.png' % n) for n in range(5)])
+            # compressed data is copied as it is
+            self.assertEqual(ZIP_DEFLATED, zf.getinfo('00001.png').compress_type)
+            self.assertEqual(ZIP_STORED, zf.getinfo('00004.png').compress_type)
+            comic_info = zf.read(COMIC_INFO_NAME).decode('utf-8')
+        self.assertIn('<Title>Omnibus</Title>', comic_info)
+        self.assertIn('<Page Image="0" Bookmark="Chapter 1" />', comic_info)
+        self.assertIn('<Page Image="2" Bookmark="Chapter 2" />', comic_info)
+        self.assertIn('<Page Image="3" Bookmark="Tome 2" />', comic_info)
+    
+    
+    def test_bad_input_removes_the_output(self):
+        first = self._new_cbz('Tome 1', [b'0'])
+        with open(self._path('bad.cbz'), 'wb') as f:
+            f.write(b'not a zip')
+        with self.assertRaises(RuntimeError):
+            merge_cbz([first, self._path('bad.cbz')], self._path('Omnibus'))
+        self.assertFalse(os.path.exists(self._path('Omnibus.cbz')))
+        with self.assertRaises(ValueError):
+            merge_cbz([first], first)
+
+
+if __name__ == '__main__':
+    unittest.main()
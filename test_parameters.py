@@ -0,0 +1,26 @@
+import unittest
+
+from henskan.parameters import Parameters
+from henskan.volume import VOLUME_SPLIT_MODES, plan_volumes
+
+
+class TestSortImages(unittest.TestCase):
+    
+    def test_chapter_without_images_is_removed(self):
+        parameters = Parameters()
+        # like a dropped archive with only a text file in it, then real chapters
+        for chapter in ('Tome 10', 'Notes', 'Tome 2'):
+            parameters.add_chapter(chapter)
+        for image in ('10.jpg', '2.jpg'):
+            parameters.add_image('Tome 10/%s' % image, 'Tome 10')
+        parameters.add_image('Tome 2/1.jpg', 'Tome 2')
+        
+        parameters.sort_images()
+        self.assertEqual(['Tome 2', 'Tome 10'], parameters.get_chapters())
+        self.assertEqual(['Tome 10/2.jpg', 'Tome 10/10.jpg'], parameters.get_images_by_chapter()['Tome 10'])
+        volumes = plan_volumes(parameters.get_chapters(), parameters.get_images_by_chapter(), VOLUME_SPLIT_MODES.CHAPTERS)
+        self.assertEqual([['Tome 2'], ['Tome 10']], [[chapter for (chapter, _) in volume.get_chapters()] for volume in volumes])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import json
+import os
+import tempfile
+import unittest
+import zlib
+
+from henskan.archive import ARCHIVE_FORMATS
+from henskan.encoders import PNGEncoder
+from henskan.profiles import DEFAULT_PROFILES_PATH, ProfileRegistry
+
+
+class TestProfileRegistry(unittest.TestCase):
+    
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._registry = ProfileRegistry()
+        self._registry.load(DEFAULT_PROFILES_PATH)
+    
+    
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+    
+    
+    def _write(self, data):
+        path = os.path.join(self._tmp_dir.name, 'profiles.json')
+        with open(path, 'w') as f:
+            f.write(data if isinstance(data, str) else json.dumps(data))
+        return path
+    
+    
+    def test_shipped_profiles(self):
+        names = self._registry.get_names()
+        self.assertEqual('Kindle 1', names[0])
+        self.assertEqual(12, names.index('Kobo Libra H2O'))  # the default device index
+        profile = self._registry.get('Kobo Libra H2O')
+        self.assertEqual((1264, 1680), profile.get_size())
+        self.assertEqual(ARCHIVE_FORMATS.CBZ, profile.get_archive_format())
+        self.assertEqual(48, len(profile.get_palette()))
+        self.assertEqual(256, len(profile.get_palette_lut()))
+        self.assertEqual(15, profile.get_palette_lut()[255])
+    
+    
+    def test_user_profiles(self):
+        path = self._write({
+            'palettes': {'8': [0, 36, 73, 109, 146, 182, 219, 255]},
+            'profiles': [
+                {'name': 'PocketBook Era', 'size': [1264, 1680], 'palette': '8', 'format': 'CBZ'},
+                {'name': 'Kindle 1', 'size': [600, 800], 'palette': [0, 255], 'format': 'CBZ'},
+            ]})
+        self._registry.load(path)
+        names = self._registry.get_names()
+        self.assertEqual('PocketBook Era', names[-1])
+        self.assertEqual('Kindle 1', names[0])  # replaced at the same place
+        self.assertEqual(ARCHIVE_FORMATS.CBZ, self._registry.get('Kindle 1').get_archive_format())
+        self.assertEqual([0, 0, 0, 255, 255, 255], self._registry.get('Kindle 1').get_palette())
+        self.assertEqual(24, len(self._registry.get('PocketBook Era').get_palette()))
+    
+    
+    def test_encoders(self):
+        self.assertEqual({'compress_level': 6, 'compress_type': zlib.Z_DEFAULT_STRATEGY}, self._registry.get('Kobo Libra H2O').get_encoder().get_options())
+        path = self._write({'profiles': [{'name': 'PocketBook Era', 'size': [1264, 1680], 'palette': '16', 'format': 'CBZ',
+                                          'png': {'compress_level': 9, 'strategy': 'rle'}},
+                                         {'name': 'Kobo JPEG', 'size': [1264, 1680], 'palette': '16', 'format': 'CBZ',
+                                          'encoder': 'jpeg', 'jpeg': {'quality': 80}, 'deflate': 6}]})
+        self._registry.load(path)
+        encoder = self._registry.get('PocketBook Era').get_encoder()
+        self.assertIsInstance(encoder, PNGEncoder)
+        self.assertEqual(9, encoder.get_compress_level())
+        self.assertEqual('rle', encoder.get_strategy())
+        self.assertEqual({'compress_level': 9, 'compress_type': zlib.Z_RLE}, encoder.get_options())
+        self.assertEqual('jpeg(quality=80,baseline)', self._registry.get('Kobo JPEG').get_encoder().get_description())
+        self.assertEqual(6, self._registry.get('Kobo JPEG').get_deflate_level())
+        self.assertIsNone(self._registry.get('PocketBook Era').get_deflate_level())
+    
+    
+    def test_bad_file_changes_nothing(self):
+        names = self._registry.get_names()
+        for data in ('{not json',
+                     {'profiles': [{'name': 'New', 'size': [600, 800], 'palette': '16', 'format': 'CBZ'},
+                                   {'name': 'Bad', 'size': [600], 'palette': '16', 'format': 'CBZ'}]},
+                     {'profiles': [{'name': 'Bad', 'size': [600, 800], 'palette': 'missing', 'format': 'CBZ'}]},
+                     {'profiles': [{'name': 'Bad', 'size': [600, 800], 'palette': '16', 'format': 'EPUB'}]},
+                     {'profiles': [{'name': 'Bad', 'size': [600, 800], 'palette': '16', 'format': 'CBZ', 'png': {'compress_level': 10}}]},
+                     {'profiles': [{'name': 'Bad', 'size': [600, 800], 'palette': '16', 'format': 'CBZ', 'png': {'strategy': 'best'}}]},
+                     {'profiles': [{'name': 'Bad', 'size': [600, 800], 'palette': '16', 'format': 'CBZ', 'encoder': 'bmp'}]},
+                     {'profiles': [{'name': 'Bad', 'size': [600, 800], 'palette': '16', 'format': 'CBZ', 'encoder': 'jpeg', 'jpeg': {'speed': 2}}]},
+                     {'profiles': [{'name': 'Bad', 'size': [600, 800], 'palette': '16', 'format': 'PDF', 'encoder': 'webp'}]},
+                     {'profiles': [{'name': 'Bad', 'size': [600, 800], 'palette': '16', 'format': 'PDF', 'deflate': 6}]},
+                     {'profiles': [{'name': 'Bad', 'size': [600, 800], 'palette': '16', 'format': 'CBZ', 'deflate': 0}]},
+                     {'palettes': {'bad': [0, 300]}}):
+            with self.assertRaises(ValueError):
+                self._registry.load(self._write(data))
+        self.assertEqual(names, self._registry.get_names())
+        with self.assertRaises(RuntimeError):
+            self._registry.load(os.path.join(self._tmp_dir.name, 'missing.json'))
+
+
+if __name__ == '__main__':
+    unittest.main()
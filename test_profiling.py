@@ -0,0 +1,79 @@
+import json
+import os
+import tempfile
+import unittest
+
+from henskan.profiling import Profiler
+
+
+class TestProfiler(unittest.TestCase):
+    
+    def test_stage_stats(self):
+        profiler = Profiler()
+        profiler.record('crop', 0.0015)
+        profiler.record('crop', 0.030)
+        with profiler.stage('encode'):
+            pass
+        
+        stats = profiler.get_stats()
+        self.assertEqual(2, stats['crop']['count'])
+        self.assertAlmostEqual(0.0315, stats['crop']['total'])
+        self.assertAlmostEqual(0.0015, stats['crop']['min'])
+        self.assertAlmostEqual(0.030, stats['crop']['max'])
+        self.assertEqual(1, stats['crop']['histogram']['<=2ms'])
+        self.assertEqual(1, stats['crop']['histogram']['<=50ms'])
+        self.assertEqual(1, stats['encode']['count'])
+    
+    
+    def test_stage_is_recorded_on_error(self):
+        profiler = Profiler()
+        with self.assertRaises(ValueError):
+            with profiler.stage('load'):
+                raise ValueError('bad image')
+        self.assertEqual(1, profiler.get_stats()['load']['count'])
+    
+    
+    def test_export_json(self):
+        profiler = Profiler()
+        profiler.record('resize', 0.2)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'profile.json')
+            profiler.export_json(path, extra={'nb_pages': 1})
+            with open(path) as f:
+                data = json.load(f)
+        self.assertEqual(1, data['nb_pages'])
+        self.assertEqual(1, data['stages']['resize']['count'])
+        
+        profiler.reset()
+        self.assertEqual({}, profiler.get_stats())
+    
+    
+    def test_capture(self):
+        profiler = Profiler()
+        profiler.record('load', 0.1)
+        with profiler.capture() as captured:
+            with profiler.stage('crop'):
+                pass
+        self.assertEqual(['load'], list(profiler.get_stats()))
+        self.assertEqual(['crop'], list(captured.get_stats()))
+    
+    
+    def test_merge(self):
+        child = Profiler()
+        child.record('crop', 0.0015)
+        child.record('encode', 0.3)
+        profiler = Profiler()
+        profiler.record('crop', 0.030)
+        
+        profiler.merge(child.get_stats())
+        
+        stats = profiler.get_stats()
+        self.assertEqual(2, stats['crop']['count'])
+        self.assertAlmostEqual(0.0015, stats['crop']['min'])
+        self.assertAlmostEqual(0.030, stats['crop']['max'])
+        self.assertEqual(1, stats['crop']['histogram']['<=2ms'])
+        self.assertEqual(1, stats['encode']['histogram']['<=500ms'])
+
+
+if __name__ == '__main__':
+    unittest.main()
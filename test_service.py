@@ -0,0 +1,188 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import unittest
+import zipfile
+
+from henskan import service as service_module
+from henskan.benchmark import generate_samples
+from henskan.image import convert_source
+from henskan.job import ConversionJob, JOB_STATES, JobCancelled
+from henskan.parameters import ConversionSettings
+from henskan.service import ConversionService
+
+
+class _ServiceTestCase(unittest.TestCase):
+    
+    @classmethod
+    def setUpClass(cls):
+        # the same sources for all the tests, each test has its own titles
+        cls._tmp_dir = tempfile.TemporaryDirectory()
+        samples = generate_samples(cls._tmp_dir.name, 3)
+        cls._images_by_chapter = {'ch1': samples['manga_double'], 'ch2': samples['colour']}
+        cls._webtoon_images = samples['webtoon_black']
+    
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmp_dir.cleanup()
+    
+    
+    def _new_job(self, title, images_by_chapter=None):
+        settings = ConversionSettings('Kobo Libra H2O', False, True)
+        images_by_chapter = images_by_chapter or self._images_by_chapter
+        return ConversionJob(title, self._tmp_dir.name, settings, list(images_by_chapter), images_by_chapter, split_right_then_left=True)
+    
+    
+    def _run_jobs(self, nb_processes, jobs, max_running_jobs=1, listener=None, profile_path=None):
+        states = []
+        service = ConversionService(nb_processes, max_running_jobs=max_running_jobs, profile_path=profile_path)
+        service.add_listener(lambda job: states.append((job.get_id(), job.get_state())))
+        if listener is not None:
+            service.add_listener(lambda job: listener(service, job))
+        service.start()
+        try:
+            for job in jobs:
+                service.add_job(job)
+            service.wait_until_idle()
+        finally:
+            service.stop()
+        return states
+    
+    
+    def _read_pages(self, title):
+        with zipfile.ZipFile(os.path.join(self._tmp_dir.name, f'{title}.cbz')) as archive:
+            return [archive.read(name) for name in archive.namelist() if name.endswith('.png')]
+
+
+class TestConversionService(_ServiceTestCase):
+    
+    def test_queued_jobs(self):
+        first, second = self._new_job('first'), self._new_job('second')
+        states = self._run_jobs(0, [first, second])
+        
+        self.assertEqual(JOB_STATES.DONE, first.get_state())
+        self.assertEqual(JOB_STATES.DONE, second.get_state())
+        self.assertEqual(100, second.get_progress_pct())
+        # jobs are done one after the other
+        self.assertEqual((first.get_id(), JOB_STATES.DONE), states[states.index((second.get_id(), JOB_STATES.RUNNING)) - 1])
+        # double pages are split, the colour ones are not
+        self.assertEqual(9, len(self._read_pages('first')))
+    
+    
+    def test_profile_export(self):
+        profile_path = os.path.join(self._tmp_dir.name, 'profile.json')
+        self._run_jobs(0, [self._new_job('profiled')], profile_path=profile_path)
+        with open(profile_path) as f:
+            profile = json.load(f)
+        self.assertEqual('profiled', profile['title'])
+        self.assertEqual(6, profile['nb_images'])
+        self.assertIn('stages', profile)
+    
+    
+    def test_processes_give_the_same_pages(self):
+        self._run_jobs(0, [self._new_job('in_thread')])
+        self._run_jobs(2, [self._new_job('in_processes')])
+        self.assertEqual(self._read_pages('in_thread'), self._read_pages('in_processes'))
+    
+    
+    def test_concurrent_jobs(self):
+        jobs = [self._new_job(f'concurrent_{idx}') for idx in range(3)]
+        states = self._run_jobs(0, jobs, max_running_jobs=2)
+        
+        self.assertTrue(all(job.get_state() == JOB_STATES.DONE for job in jobs))
+        # the second job did start before the end of the first one
+        self.assertLess(states.index((jobs[1].get_id(), JOB_STATES.RUNNING)), states.index((jobs[0].get_id(), JOB_STATES.DONE)))
+        for job in jobs:
+            self.assertEqual(9, len(self._read_pages(job.get_title())))
+        with self.assertRaises(ValueError):
+            ConversionService(0, max_running_jobs=0)
+    
+    
+    def test_failed_job_does_not_stop_the_queue(self):
+        bad = self._new_job('bad', {'ch1': [os.path.join(self._tmp_dir.name, 'missing.jpg')]})
+        good = self._new_job('good')
+        self._run_jobs(1, [bad, good])
+        
+        self.assertEqual(JOB_STATES.FAILED, bad.get_state())
+        self.assertIn('missing.jpg', bad.get_error())
+        self.assertEqual(JOB_STATES.DONE, good.get_state())
+    
+    
+    def test_killed_process_does_not_break_the_next_jobs(self):
+        killed, after = self._new_job('killed'), self._new_job('after_kill')
+        
+        def _on_job_changed(service, job):
+            if job is killed and job.get_nb_done_images() == 1 and job.get_state() == JOB_STATES.RUNNING:
+                for process in multiprocessing.active_children():  # like the OOM killer
+                    process.kill()
+        
+        self._run_jobs(2, [killed, after], listener=_on_job_changed)
+        
+        self.assertEqual(JOB_STATES.FAILED, killed.get_state())
+        self.assertIn('conversion process did stop', killed.get_error())
+        self.assertFalse(os.path.exists(os.path.join(self._tmp_dir.name, 'killed.cbz')))
+        self.assertEqual(JOB_STATES.DONE, after.get_state())
+        self.assertEqual(9, len(self._read_pages('after_kill')))
+
+
+class TestCancelAndPause(_ServiceTestCase):
+    
+    def test_cancel(self):
+        running, queued, cancelled_in_queue = self._new_job('running'), self._new_job('queued'), self._new_job('cancelled_in_queue')
+        
+        def _on_job_changed(service, job):
+            if job is running and job.get_nb_done_images() == 2 and not job.is_cancel_requested():
+                service.cancel_job(running)
+                service.cancel_job(cancelled_in_queue)
+        
+        states = self._run_jobs(0, [running, queued, cancelled_in_queue], listener=_on_job_changed)
+        
+        self.assertEqual(JOB_STATES.CANCELLED, running.get_state())
+        self.assertEqual(2, running.get_nb_done_images())
+        self.assertFalse(os.path.exists(os.path.join(self._tmp_dir.name, 'running.cbz')))  # unfinished, removed
+        self.assertEqual(JOB_STATES.DONE, queued.get_state())
+        self.assertEqual(JOB_STATES.CANCELLED, cancelled_in_queue.get_state())
+        self.assertNotIn((cancelled_in_queue.get_id(), JOB_STATES.RUNNING), states)
+    
+    
+    def test_pause(self):
+        job = self._new_job('paused')
+        
+        def _on_job_changed(service, changed_job):
+            if changed_job.get_nb_done_images() == 1 and changed_job.get_state() == JOB_STATES.RUNNING:
+                service.pause_job(changed_job)
+                threading.Timer(0.2, service.resume_job, (changed_job,)).start()
+        
+        states = self._run_jobs(0, [job], listener=_on_job_changed)
+        
+        self.assertIn((job.get_id(), JOB_STATES.PAUSED), states)
+        self.assertEqual(JOB_STATES.DONE, job.get_state())
+        self.assertEqual(9, len(self._read_pages('paused')))
+    
+    
+    def test_webtoon_split_checkpoint(self):
+        settings = ConversionSettings('Kobo Libra H2O', True, True)
+        
+        def _checkpoint():
+            raise JobCancelled('cancelled')
+        
+        with self.assertRaises(JobCancelled):
+            convert_source(self._webtoon_images[0], settings, checkpoint=_checkpoint)
+        
+        # in the processes, the cancelled jobs are in a shared array
+        old_cancelled_job_ids = service_module._cancelled_job_ids
+        service_module._cancelled_job_ids = [0, 42]
+        try:
+            with self.assertRaises(JobCancelled):
+                service_module._convert_source_in_process(42, self._webtoon_images[0], settings, False, False)
+            datas, _ = service_module._convert_source_in_process(7, self._webtoon_images[0], settings, False, False)
+            self.assertTrue(datas)
+        finally:
+            service_module._cancelled_job_ids = old_cancelled_job_ids
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from PIL import Image
+
+from henskan.image import _load_image, convert_source
+from henskan.parameters import ConversionSettings
+from henskan.source import get_member_path, get_source_size, is_archive_file, list_archive_images, open_source, split_member_path, pymupdf
+
+
+def _encode(size, image_format='PNG'):
+    with io.BytesIO() as buffer:
+        Image.linear_gradient('L').resize(size).save(buffer, format=image_format)
+        return buffer.getvalue()
+
+
+class TestArchiveSource(unittest.TestCase):
+    
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._archive_path = os.path.join(self._tmp_dir.name, 'Tome 1.cbz')
+        with zipfile.ZipFile(self._archive_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name in ('p10.png', 'p2.png', 'sub/p1.png'):
+                archive.writestr(name, _encode((60, 80)))
+            archive.writestr('scan.jpg', _encode((900, 1200), 'JPEG'))
+            archive.writestr('readme.txt', b'not an image')
+            archive.writestr('__MACOSX/._p2.png', b'resource fork')
+    
+    
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+    
+    
+    def test_list_in_natural_order(self):
+        self.assertTrue(is_archive_file(self._archive_path))
+        members = list_archive_images(self._archive_path)
+        self.assertEqual(['p2.png', 'p10.png', 'scan.jpg', 'sub/p1.png'], [split_member_path(member)[1] for member in members])
+    
+    
+    def test_member_path(self):
+        member_path = get_member_path(self._archive_path, 'sub/p1.png')
+        self.assertEqual((self._archive_path, 'sub/p1.png'), split_member_path(member_path))
+        self.assertIsNone(split_member_path(self._archive_path))
+        self.assertEqual(len(_encode((60, 80))), get_source_size(member_path))
+        with open_source(member_path) as f:
+            self.assertEqual(_encode((60, 80)), f.read())
+        with self.assertRaises(RuntimeError):
+            open_source(get_member_path(self._archive_path, 'missing.png'))
+    
+    
+    def test_convert_member(self):
+        member_path = get_member_path(self._archive_path, 'scan.jpg')
+        self.assertEqual((900, 1200), _load_image(member_path).size)
+        datas = convert_source(member_path, ConversionSettings('Kobo Libra H2O', False, True))
+        self.assertEqual(1, len(datas))
+        self.assertEqual((1264, 1680), Image.open(io.BytesIO(datas[0])).size)
+    
+    
+    def test_member_stream_is_closed(self):
+        member_streams = []
+        
+        def _open_source(path):
+            member_streams.append(open_source(path))
+            return member_streams[-1]
+        
+        with mock.patch('henskan.image.open_source', _open_source):
+            image = _load_image(get_member_path(self._archive_path, 'scan.jpg'))
+        self.assertEqual(1, len(member_streams))
+        self.assertTrue(member_streams[0].closed)
+        image.load()  # the pixels are still there
+        self.assertEqual((900, 1200), image.size)
+
+
+
+@unittest.skipIf(pymupdf is None, 'PyMuPDF is not installed')
+class TestPdfSource(unittest.TestCase):
+    
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._pdf_path = os.path.join(self._tmp_dir.name, 'Tome 2.pdf')
+        self._jpeg = _encode((900, 1200), 'JPEG')
+        document = pymupdf.open()
+        for stream in (self._jpeg, _encode((60, 80))):
+            page = document.new_page(width=600, height=800)
+            page.insert_image(page.rect, stream=stream)
+        document.new_page()  # a text only page
+        document.save(self._pdf_path)
+        document.close()
+    
+    
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+    
+    
+    def test_list_pages_images(self):
+        self.assertTrue(is_archive_file(self._pdf_path))
+        members = list_archive_images(self._pdf_path)
+        self.assertEqual(2, len(members))
+        member_names = [split_member_path(member)[1] for member in members]
+        self.assertTrue(member_names[0].startswith('00001_') and member_names[0].endswith('.jpg'))
+        self.assertTrue(member_names[1].startswith('00002_') and member_names[1].endswith('.png'))
+    
+    
+    def test_jpeg_is_not_decoded(self):
+        jpeg_member, png_member = list_archive_images(self._pdf_path)
+        with open_source(jpeg_member) as f:
+            self.assertEqual(self._jpeg, f.read())
+        self.assertEqual(len(self._jpeg), get_source_size(jpeg_member))
+        self.assertEqual((60, 80), _load_image(png_member).size)
+    
+    
+    def test_convert_member(self):
+        datas = convert_source(list_archive_images(self._pdf_path)[0], ConversionSettings('Kobo Libra H2O', False, True))
+        self.assertEqual(1, len(datas))
+        self.assertEqual((1264, 1680), Image.open(io.BytesIO(datas[0])).size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import io
+import os
+import tempfile
+import unittest
+from zipfile import ZipFile
+
+from PIL import Image
+
+from henskan.archive_cbz import ArchiveCBZ, COMIC_INFO_NAME
+from henskan.encoders import JPEGEncoder, PNGEncoder
+from henskan.image import EReaderData, _apply_grey_palette
+from henskan.pdf_reader import PDFReader
+from henskan.transcode import transcode
+
+# Same page size, CBZ and PDF, the Kobo greys are a part of the Kindle ones
+KOBO_DEVICE = 'Kobo Glo HD'
+KINDLE_DEVICE = 'Kindle Paperwhite 3/Voyage/Oasis'
+
+
+class TestTranscode(unittest.TestCase):
+    
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        size = EReaderData.get_size(KOBO_DEVICE)
+        gradient = Image.linear_gradient('L').resize(size)
+        self._pages = [
+            PNGEncoder().encode(_apply_grey_palette(gradient, EReaderData.get_palette(KOBO_DEVICE))),  # 4-bit P
+            PNGEncoder().encode(gradient),  # L
+            JPEGEncoder().encode(gradient.transpose(Image.Transpose.FLIP_TOP_BOTTOM)),
+            PNGEncoder().encode(Image.merge('RGB', (gradient, gradient.rotate(180), gradient))),
+        ]
+        self._cbz_path = self._path('Tome 1.cbz')
+        archive = ArchiveCBZ(self._path('Tome 1'), 'Tome 1')
+        archive.add_chapter('Chapter 1')
+        for page_number, data in enumerate(self._pages):
+            if page_number == 2:
+                archive.add_chapter('Chapter 2 (été)')
+            archive.add_page(page_number, '%05d.%s' % (page_number, 'jpg' if page_number == 2 else 'png'), data)
+        archive.close()
+    
+    
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+    
+    
+    def _path(self, name):
+        return os.path.join(self._tmp_dir.name, name)
+    
+    
+    def _assert_same_pixels(self, expected_data, data):
+        expected, image = Image.open(io.BytesIO(expected_data)), Image.open(io.BytesIO(data))
+        self.assertEqual(expected.format, image.format)
+        self.assertEqual(expected.size, image.size)
+        self.assertEqual(list(expected.convert('RGB').getdata()), list(image.convert('RGB').getdata()))
+    
+    
+    # the page was converted again: device size, format and greys (only the grey pages get the device palette)
+    def _assert_device_page(self, device, data, in_palette=True):
+        image = Image.open(io.BytesIO(data))
+        self.assertEqual('PNG', image.format)
+        self.assertEqual(EReaderData.get_size(device), image.size)
+        self.assertIn(image.mode, ('L', 'P'))
+        if in_palette:
+            device_greys = set(EReaderData.get_palette(device)[::3])
+            self.assertTrue(all(grey in device_greys for (_, grey) in image.convert('L').getcolors(256)))
+    
+    
+    def test_cbz_to_pdf_and_back(self):
+        pdf_path = transcode(self._cbz_path, KINDLE_DEVICE)
+        self.assertEqual(self._path('Tome 1.pdf'), pdf_path)
+        
+        reader = PDFReader(pdf_path)
+        try:
+            self.assertEqual('Tome 1', reader.get_title())
+            self.assertEqual([(0, 'Chapter 1'), (2, 'Chapter 2 (été)')], reader.get_outlines())
+            datas = list(reader.iter_pages())
+        finally:
+            reader.close()
+        self.assertEqual(len(self._pages), len(datas))
+        self._assert_same_pixels(self._pages[0], datas[0])  # only the page with the Kobo greys is copied
+        self._assert_device_page(KINDLE_DEVICE, datas[1])  # 256 greys
+        self._assert_device_page(KINDLE_DEVICE, datas[2])  # JPEG
+        self._assert_device_page(KINDLE_DEVICE, datas[3], in_palette=False)  # colors
+        
+        cbz_path = transcode(pdf_path, KOBO_DEVICE, output_path=self._path('Tome 1 again'))
+        with ZipFile(cbz_path) as zf:
+            self.assertEqual(['00000.png', '00001.png', '00002.png', '00003.png', COMIC_INFO_NAME], zf.namelist())
+            self.assertEqual(self._pages[0], zf.read('00000.png'))
+            for name in zf.namelist()[1:-1]:  # the Kindle greys are not all Kobo ones
+                self._assert_device_page(KOBO_DEVICE, zf.read(name))
+            comic_info = zf.read(COMIC_INFO_NAME).decode('utf-8')
+        self.assertIn('<Page Image="0" Bookmark="Chapter 1" />', comic_info)
+        self.assertIn('<Page Image="2" Bookmark="Chapter 2 (été)" />', comic_info)
+    
+    
+    def test_other_palette_is_converted(self):
+        # same size, but only 4 greys
+        self.assertEqual(EReaderData.get_size('Kobo Mini/Touch'), EReaderData.get_size('Kindle 1'))
+        size = EReaderData.get_size('Kobo Mini/Touch')
+        gradient = Image.linear_gradient('L').resize(size)
+        page = PNGEncoder().encode(_apply_grey_palette(gradient, EReaderData.get_palette('Kobo Mini/Touch')))
+        archive = ArchiveCBZ(self._path('Mini'), 'Mini')
+        archive.add_page(0, '00000.png', page)
+        archive.close()
+        
+        pdf_path = transcode(self._path('Mini.cbz'), 'Kindle 1')
+        reader = PDFReader(pdf_path)
+        try:
+            datas = list(reader.iter_pages())
+        finally:
+            reader.close()
+        self._assert_device_page('Kindle 1', datas[0])
+        self.assertEqual(4, len(Image.open(io.BytesIO(datas[0])).convert('L').getcolors(256)))
+    
+    
+    def test_other_size_is_resized(self):
+        cbz_path = transcode(self._cbz_path, 'Kobo Libra H2O', output_path=self._path('Libra.cbz'))
+        with ZipFile(cbz_path) as zf:
+            for name in zf.namelist()[:-1]:
+                self.assertEqual(EReaderData.get_size('Kobo Libra H2O'), Image.open(io.BytesIO(zf.read(name))).size)
+    
+    
+    def test_bad_inputs(self):
+        with self.assertRaises(ValueError):
+            transcode(self._cbz_path, KOBO_DEVICE)  # into itself
+        with self.assertRaises(ValueError):
+            transcode(self._cbz_path, 'Missing e-reader')
+        with open(self._path('other.pdf'), 'wb') as f:
+            f.write(b'%PDF-1.4\n1 0 obj\n<< >>\nendobj\n')
+        with self.assertRaises(RuntimeError):
+            transcode(self._path('other.pdf'), KOBO_DEVICE)
+        self.assertFalse(os.path.exists(self._path('other.cbz')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+from henskan.volume import VOLUME_SPLIT_MODES, plan_volumes, get_volume_name
+
+CHAPTERS = ['T1', 'T2', 'T3']
+IMAGES_BY_CHAPTER = {
+    'T1': ['T1/%d.jpg' % i for i in range(3)],
+    'T2': ['T2/%d.jpg' % i for i in range(5)],
+    'T3': ['T3/%d.jpg' % i for i in range(2)],
+}
+
+
+def _describe(volumes):
+    return [[(chapter, len(images)) for (chapter, images) in volume.get_chapters()] for volume in volumes]
+
+
+class TestPlanVolumes(unittest.TestCase):
+    
+    def test_no_split(self):
+        volumes = plan_volumes(CHAPTERS, IMAGES_BY_CHAPTER, VOLUME_SPLIT_MODES.NONE)
+        self.assertEqual([[('T1', 3), ('T2', 5), ('T3', 2)]], _describe(volumes))
+    
+    
+    def test_by_chapters(self):
+        volumes = plan_volumes(CHAPTERS, IMAGES_BY_CHAPTER, VOLUME_SPLIT_MODES.CHAPTERS)
+        self.assertEqual([[('T1', 3)], [('T2', 5)], [('T3', 2)]], _describe(volumes))
+        self.assertEqual([1, 2, 3], [volume.get_number() for volume in volumes])
+    
+    
+    def test_by_images_keep_chapters(self):
+        volumes = plan_volumes(CHAPTERS, IMAGES_BY_CHAPTER, VOLUME_SPLIT_MODES.IMAGES, max_images=8)
+        self.assertEqual([[('T1', 3), ('T2', 5)], [('T3', 2)]], _describe(volumes))
+    
+    
+    def test_by_images_cut_big_chapter(self):
+        volumes = plan_volumes(CHAPTERS, IMAGES_BY_CHAPTER, VOLUME_SPLIT_MODES.IMAGES, max_images=4)
+        self.assertEqual([[('T1', 3)], [('T2', 4)], [('T2', 1), ('T3', 2)]], _describe(volumes))
+    
+    
+    def test_by_size_is_decided_at_conversion(self):
+        volumes = plan_volumes(CHAPTERS, IMAGES_BY_CHAPTER, VOLUME_SPLIT_MODES.SIZE)
+        self.assertEqual(1, len(volumes))
+        self.assertEqual(10, volumes[0].get_nb_images())
+    
+    
+    def test_volume_name(self):
+        self.assertEqual('Title', get_volume_name('Title', 1, VOLUME_SPLIT_MODES.NONE))
+        self.assertEqual('Title - Vol 02', get_volume_name('Title', 2, VOLUME_SPLIT_MODES.IMAGES))
+
+
+if __name__ == '__main__':
+    unittest.main()